@@ -2,29 +2,117 @@ from __future__ import annotations
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy import create_engine
 from dotenv import load_dotenv
 import os
-from typing import Optional
+from typing import Any, Mapping, Optional, Union
 
 load_dotenv()
 
 db = SQLAlchemy()
 migrate = Migrate()
 
-def create_app() -> Flask:
+def create_app(config: Union[str, Mapping[str, Any], None] = None) -> Flask:
+    """Build the app for a config profile, or for overrides applied on top of one.
+
+    ``config`` is a profile name from ``app.profiles.PROFILES`` or a mapping of
+    settings. Without a name the profile comes from ``APP_CONFIG`` and
+    defaults to ``development``.
+    """
+    from app.profiles import load_profile
+
     app = Flask(__name__)
 
-    database_url: Optional[str] = os.getenv('DATABASE_URL')
+    overrides = dict(config) if isinstance(config, Mapping) else {}
+    profile = config if isinstance(config, str) else os.getenv('APP_CONFIG', 'development')
+
+    database_url: Optional[str] = overrides.get('SQLALCHEMY_DATABASE_URI') or os.getenv('DATABASE_URL')
     if database_url is None:
         raise ValueError("DATABASE_URL environment variable is required")
 
     app.config['SQLALCHEMY_DATABASE_URI'] = database_url
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['FX_RATE_CACHE_TTL'] = float(os.getenv('FX_RATE_CACHE_TTL', '300'))
+    app.config['FX_RATE_CACHE_MAX_STALENESS'] = float(os.getenv('FX_RATE_CACHE_MAX_STALENESS', '5'))
+    app.config['FX_RATE_BATCH_MAX_PAIRS'] = int(os.getenv('FX_RATE_BATCH_MAX_PAIRS', '1000'))
+    app.config['FX_RATE_HISTORY_WINDOW'] = float(os.getenv('FX_RATE_HISTORY_WINDOW', '86400'))
+    app.config['FX_RATE_PROVIDER'] = os.getenv('FX_RATE_PROVIDER', 'file')
+    app.config['FX_RATE_PROVIDER_PATH'] = os.getenv('FX_RATE_PROVIDER_PATH')
+    app.config['FX_RATE_INGEST_INTERVAL'] = float(os.getenv('FX_RATE_INGEST_INTERVAL', '300'))
+    app.config['FX_QUOTE_TTL'] = float(os.getenv('FX_QUOTE_TTL', '30'))
+    app.config['FX_QUOTE_MAX_SIZE'] = int(os.getenv('FX_QUOTE_MAX_SIZE', '10000'))
+    app.config['FX_PIVOT_CURRENCY'] = os.getenv('FX_PIVOT_CURRENCY', 'USD')
+    supported_currencies = os.getenv('SUPPORTED_CURRENCIES')
+    app.config['SUPPORTED_CURRENCIES'] = (
+        [currency.strip().upper() for currency in supported_currencies.split(',') if currency.strip()]
+        if supported_currencies else None
+    )
+    app.config['WALLET_LOCKING_STRATEGY'] = os.getenv('WALLET_LOCKING_STRATEGY', 'pessimistic')
+    app.config['WALLET_MAX_RETRIES'] = int(os.getenv('WALLET_MAX_RETRIES', '5'))
+    app.config['WALLET_RETRY_BASE_DELAY'] = float(os.getenv('WALLET_RETRY_BASE_DELAY', '0.01'))
+    app.config['WALLET_BATCH_MAX_OPERATIONS'] = int(os.getenv('WALLET_BATCH_MAX_OPERATIONS', '10000'))
+    app.config['TRANSACTIONS_MAX_PAGE_SIZE'] = int(os.getenv('TRANSACTIONS_MAX_PAGE_SIZE', '1000'))
+    app.config['TRANSACTIONS_EXPORT_BATCH_SIZE'] = int(os.getenv('TRANSACTIONS_EXPORT_BATCH_SIZE', '1000'))
+    app.config['IDEMPOTENCY_KEY_TTL'] = float(os.getenv('IDEMPOTENCY_KEY_TTL', '86400'))
+    app.config['IDEMPOTENCY_LOCK_TIMEOUT'] = float(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT', '30'))
+    app.config['IDEMPOTENCY_CACHE_SIZE'] = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', '10000'))
+    app.config['IDEMPOTENCY_SWEEP_INTERVAL'] = float(os.getenv('IDEMPOTENCY_SWEEP_INTERVAL', '3600'))
+    app.config['RECONCILE_CHECKPOINT_SETTLE_SECONDS'] = float(os.getenv('RECONCILE_CHECKPOINT_SETTLE_SECONDS', '60'))
+    app.config['SNAPSHOT_SETTLE_SECONDS'] = float(os.getenv('SNAPSHOT_SETTLE_SECONDS', '60'))
+    app.config['LEDGER_PARTITION_MONTHS_AHEAD'] = int(os.getenv('LEDGER_PARTITION_MONTHS_AHEAD', '3'))
+    app.config['LEDGER_PARTITION_INTERVAL'] = float(os.getenv('LEDGER_PARTITION_INTERVAL', '86400'))
+    app.config['LEDGER_ARCHIVE_DIR'] = os.getenv('LEDGER_ARCHIVE_DIR', 'ledger-archive')
+    app.config['LEDGER_ARCHIVE_AFTER_MONTHS'] = int(os.getenv('LEDGER_ARCHIVE_AFTER_MONTHS', '12'))
+    app.config['LEDGER_ARCHIVE_USER_BUCKETS'] = int(os.getenv('LEDGER_ARCHIVE_USER_BUCKETS', '16'))
+    app.config['BALANCE_CACHE_BACKEND'] = os.getenv('BALANCE_CACHE_BACKEND', 'memory')
+    app.config['BALANCE_CACHE_SIZE'] = int(os.getenv('BALANCE_CACHE_SIZE', '10000'))
+    app.config['BALANCE_CACHE_TTL'] = float(os.getenv('BALANCE_CACHE_TTL', '2'))
+    app.config['ASYNC_DATABASE_URL'] = os.getenv('ASYNC_DATABASE_URL')
+    app.config['DATABASE_REPLICA_URL'] = os.getenv('DATABASE_REPLICA_URL')
+    app.config['READ_YOUR_WRITES_WINDOW'] = float(os.getenv('READ_YOUR_WRITES_WINDOW', '5'))
+
+    app.config.update(load_profile(profile, database_url))
+    app.config.update(overrides)
+    if app.config['WALLET_LOCKING_STRATEGY'] not in ('pessimistic', 'optimistic'):
+        raise ValueError("WALLET_LOCKING_STRATEGY must be 'pessimistic' or 'optimistic'")
 
     db.init_app(app)
     migrate.init_app(app, db)
 
+    from app.cache import BalanceCache, FxQuoteStore, FxRateCache, IdempotencyCache
+    app.extensions['fx_rate_cache'] = FxRateCache(
+        ttl=app.config['FX_RATE_CACHE_TTL'],
+        max_staleness=app.config['FX_RATE_CACHE_MAX_STALENESS'],
+        pivot=app.config['FX_PIVOT_CURRENCY'],
+        currencies=app.config['SUPPORTED_CURRENCIES'],
+        history_window=app.config['FX_RATE_HISTORY_WINDOW']
+    )
+    app.extensions['fx_quote_store'] = FxQuoteStore(
+        ttl=app.config['FX_QUOTE_TTL'],
+        max_size=app.config['FX_QUOTE_MAX_SIZE']
+    )
+    app.extensions['idempotency_cache'] = IdempotencyCache(app.config['IDEMPOTENCY_CACHE_SIZE'])
+    app.extensions['balance_cache'] = BalanceCache.from_config(app.config)
+
+    from app.metrics import LockMetrics
+    app.extensions['wallet_lock_metrics'] = LockMetrics()
+
+    from app.archive import LedgerArchive
+    app.extensions['ledger_archive'] = LedgerArchive(app.config['LEDGER_ARCHIVE_DIR'])
+
+    from app.replica import ReadRouter
+    replica_engine = None
+    if app.config['DATABASE_REPLICA_URL']:
+        replica_engine = create_engine(app.config['DATABASE_REPLICA_URL'],
+                                       **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    read_router = ReadRouter(window=app.config['READ_YOUR_WRITES_WINDOW'], engine=replica_engine)
+    app.extensions['read_router'] = read_router
+    app.teardown_appcontext(lambda exc: read_router.remove())
+
     from app.routes import bp as main_bp
     app.register_blueprint(main_bp)
 
+    from app.cli import register_commands
+    register_commands(app)
+
     return app
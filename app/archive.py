@@ -0,0 +1,193 @@
+from __future__ import annotations
+from app.models import TransactionType
+from bisect import bisect_right
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, IO, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import gzip
+import json
+import mmap
+import os
+import zlib
+
+# Uncompressed bytes per gzip member; the sparse index holds one entry per member.
+MEMBER_SIZE = 64 * 1024
+
+class ArchivedTransaction(NamedTuple):
+    """A ``transactions`` row read back from an archive segment."""
+    id: int
+    user_id: str
+    transaction_type: TransactionType
+    currency: str
+    amount: Decimal
+    from_currency: Optional[str]
+    to_currency: Optional[str]
+    fx_rate: Optional[Decimal]
+    created_at: datetime
+
+def _encode(row: Any) -> bytes:
+    return (json.dumps({
+        "id": row.id,
+        "user_id": row.user_id,
+        "transaction_type": row.transaction_type.value,
+        "currency": row.currency,
+        "amount": str(row.amount),
+        "from_currency": row.from_currency,
+        "to_currency": row.to_currency,
+        "fx_rate": None if row.fx_rate is None else str(row.fx_rate),
+        "created_at": row.created_at.isoformat()
+    }, separators=(',', ':')) + "\n").encode()
+
+def _decode(line: bytes) -> ArchivedTransaction:
+    record = json.loads(line)
+    return ArchivedTransaction(
+        id=record["id"],
+        user_id=record["user_id"],
+        transaction_type=TransactionType(record["transaction_type"]),
+        currency=record["currency"],
+        amount=Decimal(record["amount"]),
+        from_currency=record["from_currency"],
+        to_currency=record["to_currency"],
+        fx_rate=None if record["fx_rate"] is None else Decimal(record["fx_rate"]),
+        created_at=datetime.fromisoformat(record["created_at"])
+    )
+
+def signed_sums(rows: Iterable[ArchivedTransaction]) -> Dict[Tuple[str, str], Tuple[Decimal, int]]:
+    """Per ``(user_id, currency)`` balance effect and highest id of ``rows``."""
+    sums: Dict[Tuple[str, str], Tuple[Decimal, int]] = {}
+    for row in rows:
+        amount = -row.amount if row.transaction_type in (TransactionType.WITHDRAW, TransactionType.CONVERT_OUT) \
+            else row.amount
+        total, last_id = sums.get((row.user_id, row.currency), (Decimal('0'), 0))
+        sums[(row.user_id, row.currency)] = (total + amount, max(last_id, row.id))
+    return sums
+
+class _SegmentWriter:
+    """Writes one segment as a series of gzip members that each start at a user boundary."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file: IO[bytes] = open(f"{path}.tmp", 'wb')
+        self.index: List[Tuple[str, int]] = []
+        self.member: Optional[gzip.GzipFile] = None
+        self.member_bytes = 0
+        self.user_id: Optional[str] = None
+
+    def write(self, user_id: str, line: bytes) -> None:
+        if self.user_id is not None and user_id < self.user_id:
+            # Readers bisect and stop early in codepoint order; any other order loses rows.
+            raise ValueError(f"Archive rows must be ordered by user id codepoints: {user_id!r} after {self.user_id!r}")
+        if user_id != self.user_id and (self.member is None or self.member_bytes >= MEMBER_SIZE):
+            if self.member is not None:
+                self.member.close()
+            self.index.append((user_id, self.file.tell()))
+            self.member = gzip.GzipFile(fileobj=self.file, mode='wb')
+            self.member_bytes = 0
+        assert self.member is not None
+        self.member.write(line)
+        self.member_bytes += len(line)
+        self.user_id = user_id
+
+    def close(self) -> None:
+        if self.member is None:
+            # An empty but valid gzip stream, so every bucket has a segment.
+            gzip.GzipFile(fileobj=self.file, mode='wb').close()
+        else:
+            self.member.close()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        with open(f"{self.path}.idx.tmp", 'w') as index_file:
+            json.dump(self.index, index_file)
+
+    def commit(self) -> None:
+        os.replace(f"{self.path}.idx.tmp", f"{self.path}.idx")
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def abort(self) -> None:
+        self.file.close()
+        for path in (f"{self.path}.tmp", f"{self.path}.idx.tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+class LedgerArchive:
+    """Archived ledger rows on local disk as gzip NDJSON, one segment per month and user bucket.
+
+    ``<root>/<YYYY-MM>/bucket-<NNN>.ndjson.gz`` holds that month's rows for users
+    whose ``crc32(user_id) % buckets`` is ``NNN``, ordered by user (in codepoint
+    order), time and id.
+    The segment is a chain of gzip members, each starting at a user boundary,
+    and ``bucket-<NNN>.ndjson.gz.idx`` records the first user and byte offset
+    of every member. Reads ``mmap`` the segment, seek to the member that can
+    hold the first wanted user and decompress only from there. Every bucket
+    gets a segment, even an empty one, so a missing file always means a lost
+    segment rather than a bucket with no rows.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    @staticmethod
+    def bucket_for(user_id: str, buckets: int) -> int:
+        return zlib.crc32(user_id.encode()) % buckets
+
+    def segment_path(self, month: datetime, bucket: int) -> str:
+        return os.path.join(self.root, f"{month:%Y-%m}", f"bucket-{bucket:03d}.ndjson.gz")
+
+    def write_month(self, month: datetime, buckets: int, rows: Iterable[Any]) -> int:
+        """Write every segment of ``month`` from ``rows`` and return the row count.
+
+        ``rows`` must be ordered by user, time and id, comparing user ids by
+        codepoint as Python does rather than by a database collation. Segments are written to
+        temporary files, flushed to disk and renamed into place only once all
+        of them are complete.
+        """
+        os.makedirs(os.path.join(self.root, f"{month:%Y-%m}"), exist_ok=True)
+        writers = [_SegmentWriter(self.segment_path(month, bucket)) for bucket in range(buckets)]
+        try:
+            count = 0
+            for row in rows:
+                writers[self.bucket_for(row.user_id, buckets)].write(row.user_id, _encode(row))
+                count += 1
+            for writer in writers:
+                writer.close()
+        except BaseException:
+            for writer in writers:
+                writer.abort()
+            raise
+        for writer in writers:
+            writer.commit()
+        return count
+
+    def read_range(self, month: datetime, bucket: int, first_user_id: str,
+                   last_user_id: str) -> Iterator[ArchivedTransaction]:
+        """Rows of users in ``[first_user_id, last_user_id]`` from one segment, in segment order."""
+        path = self.segment_path(month, bucket)
+        with open(f"{path}.idx") as index_file:
+            index: List[Tuple[str, int]] = [tuple(entry) for entry in json.load(index_file)]  # type: ignore[misc]
+        if not index:
+            return
+        position = bisect_right([user_id for user_id, _ in index], first_user_id) - 1
+        offset = index[max(position, 0)][1]
+
+        with open(path, 'rb') as segment_file, \
+                mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            mapped.seek(offset)
+            with gzip.GzipFile(fileobj=mapped, mode='rb') as lines:  # type: ignore[call-overload]
+                for line in lines:
+                    row = _decode(line)
+                    if row.user_id > last_user_id:
+                        return
+                    if row.user_id >= first_user_id:
+                        yield row
+
+    def read_month(self, month: datetime, buckets: int) -> Iterator[ArchivedTransaction]:
+        """Every archived row of ``month``, segment by segment."""
+        for bucket in range(buckets):
+            with gzip.open(self.segment_path(month, bucket), 'rb') as lines:
+                for line in lines:
+                    yield _decode(line)
+
+    def read_user(self, month: datetime, buckets: int, user_id: str) -> Iterator[ArchivedTransaction]:
+        """A user's archived rows for ``month``, oldest first."""
+        return self.read_range(month, self.bucket_for(user_id, buckets), user_id, user_id)
@@ -0,0 +1,149 @@
+"""ASGI application that serves the hot read endpoints without a thread per request.
+
+``GET /wallets/<user_id>/balances``, ``GET /wallets/<user_id>/transactions`` and
+``GET /fx/rates`` are answered on an event loop through SQLAlchemy's asyncio
+engine, so a request waiting on the database holds no thread. They build their
+statements and shape their results with the same ``WalletService`` and
+``FxService`` helpers as the Flask views. Every other request, including
+``/balances?as_of=...``, is handed to the Flask app through asgiref's WSGI
+adapter and runs on its thread pool exactly as it would under gunicorn.
+
+With ``DATABASE_REPLICA_URL`` set the reads go to the replica, following the
+Flask app's ``ReadRouter`` so a user still reads their own recent writes.
+
+Needs ``asgiref``, ``greenlet`` and an async driver: ``asyncpg`` for
+PostgreSQL or ``aiosqlite`` for SQLite.
+"""
+from __future__ import annotations
+from app.profiles import async_database_url
+from app.services import FxService, WalletService
+from asgiref.wsgi import WsgiToAsgi
+from flask import Flask
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Pattern, Tuple
+from urllib.parse import parse_qsl
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+Scope = Dict[str, Any]
+Message = Dict[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+# A handler returns a status code and JSON body, or None to defer to Flask.
+Handler = Callable[..., Awaitable[Optional[Tuple[int, Any]]]]
+
+class AsyncReadApp:
+    """ASGI app answering read endpoints natively and everything else through Flask."""
+
+    def __init__(self, flask_app: Flask, engine: Optional[AsyncEngine] = None,
+                 replica_engine: Optional[AsyncEngine] = None) -> None:
+        self.flask_app = flask_app
+        engine_options = flask_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        if engine is None:
+            url = flask_app.config.get('ASYNC_DATABASE_URL') or async_database_url(flask_app.config['SQLALCHEMY_DATABASE_URI'])
+            engine = create_async_engine(url, **engine_options)
+        if replica_engine is None and flask_app.config.get('DATABASE_REPLICA_URL'):
+            replica_engine = create_async_engine(async_database_url(flask_app.config['DATABASE_REPLICA_URL']), **engine_options)
+        self.engine = engine
+        self.replica_engine = replica_engine
+        self.primary_sessions = async_sessionmaker(engine, expire_on_commit=False)
+        self.replica_sessions = async_sessionmaker(replica_engine, expire_on_commit=False) if replica_engine else None
+        self.read_router = flask_app.extensions['read_router']
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.routes: List[Tuple[Pattern[str], Handler]] = [
+            (re.compile(r'^/wallets/(?P<user_id>[^/]+)/balances$'), self.get_balances),
+            (re.compile(r'^/wallets/(?P<user_id>[^/]+)/transactions$'), self.get_transactions),
+            (re.compile(r'^/fx/rates$'), self.get_rates),
+        ]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            for pattern, handler in self.routes:
+                match = pattern.match(scope['path'])
+                if match is None:
+                    continue
+                args = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+                result = await self._dispatch(handler, args, match.groupdict())
+                if result is not None:
+                    await self._respond(send, *result)
+                    return
+                break
+
+        await self.wsgi(scope, receive, send)
+
+    def sessions(self, user_id: Optional[str] = None) -> AsyncSession:
+        if self.replica_sessions is not None and self.read_router.use_replica(user_id):
+            return self.replica_sessions()
+        return self.primary_sessions()
+
+    async def dispose(self) -> None:
+        await self.engine.dispose()
+        if self.replica_engine is not None:
+            await self.replica_engine.dispose()
+
+    async def get_balances(self, args: Dict[str, str], user_id: str) -> Optional[Tuple[int, Any]]:
+        if 'as_of' in args:
+            # Point-in-time balances go through the FX rate cache, which lives in Flask.
+            return None
+        async with self.sessions(user_id) as session:
+            rows = await session.execute(WalletService.balances_statement(user_id))
+            balances = WalletService.balances_from_rows(rows)
+        return 200, balances
+
+    async def get_transactions(self, args: Dict[str, str], user_id: str) -> Optional[Tuple[int, Any]]:
+        try:
+            limit = int(args.get('limit', 100))
+        except ValueError:
+            limit = 100
+        with self.flask_app.app_context():
+            stmt, limit = WalletService.transactions_statement(user_id, limit, args.get('cursor'))
+        async with self.sessions(user_id) as session:
+            transactions = list((await session.execute(stmt)).scalars())
+            page = WalletService.transactions_page(transactions, limit)
+        return 200, page
+
+    async def get_rates(self, args: Dict[str, str]) -> Optional[Tuple[int, Any]]:
+        async with self.sessions() as session:
+            rows = await session.execute(FxService.rates_statement())
+            rates = FxService.rates_from_rows(rows)
+        return 200, {"rates": rates}
+
+    async def _dispatch(self, handler: Handler, args: Dict[str, str],
+                        params: Dict[str, str]) -> Optional[Tuple[int, Any]]:
+        try:
+            return await handler(args, **params)
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        except Exception:
+            logger.exception("Async read handler failed")
+            return 500, {"error": "Internal server error"}
+
+    @staticmethod
+    async def _respond(send: Send, status: int, payload: Any) -> None:
+        body = (json.dumps(payload, sort_keys=True) + '\n').encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,453 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from app import db
+from app.models import FxRate, FxRateHistory, FxRateVersion
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from sqlalchemy import func, select
+from typing import Any, Deque, Dict, FrozenSet, Iterable, List, Mapping, NamedTuple, Optional, Tuple, Type
+import threading
+import time
+import uuid
+
+RATE_QUANTUM = Decimal('0.00000001')
+
+class FxRateMatrix:
+    """Dense table of conversion rates between every pair of known currencies.
+
+    Stored pairs are used as-is. Any other pair is derived by multiplying rates
+    along a path through the rate graph, where each stored pair is an edge and so
+    is its inverse when the reverse pair is not stored. A path through ``pivot``
+    is preferred; otherwise the path with the fewest hops is used. Building is
+    O(N * (N + E)); lookups are O(1).
+    """
+
+    def __init__(self, rates: Dict[Tuple[str, str], Decimal], pivot: str,
+                 currencies: Iterable[str] = ()) -> None:
+        self.pivot = pivot
+        names = set(currencies)
+        for from_currency, to_currency in rates:
+            names.add(from_currency)
+            names.add(to_currency)
+        self.currencies: List[str] = sorted(names)
+        self._index = {currency: i for i, currency in enumerate(self.currencies)}
+
+        edges: Dict[str, Dict[str, Decimal]] = {currency: {} for currency in self.currencies}
+        for (from_currency, to_currency), rate in rates.items():
+            edges[from_currency][to_currency] = rate
+        for (from_currency, to_currency), rate in rates.items():
+            if rate > 0 and (to_currency, from_currency) not in rates:
+                edges[to_currency][from_currency] = Decimal('1') / rate
+
+        size = len(self.currencies)
+        self._matrix: List[List[Optional[Decimal]]] = [[None] * size for _ in range(size)]
+        for source in self.currencies:
+            row = self._matrix[self._index[source]]
+            for target, rate in self._derive_from(source, edges).items():
+                row[self._index[target]] = rate
+
+    def _derive_from(self, source: str, edges: Dict[str, Dict[str, Decimal]]) -> Dict[str, Decimal]:
+        derived: Dict[str, Decimal] = {source: Decimal('1')}
+        # Breadth-first search gives every currency its fewest-hop rate from source.
+        queue: Deque[str] = deque([source])
+        while queue:
+            current = queue.popleft()
+            for target, rate in edges[current].items():
+                if target not in derived:
+                    derived[target] = derived[current] * rate
+                    queue.append(target)
+
+        pivot_edges = edges.get(self.pivot, {})
+        via_pivot = edges[source].get(self.pivot)
+        result: Dict[str, Decimal] = {}
+        for target, rate in derived.items():
+            if target == source:
+                result[target] = rate
+            elif target in edges[source]:
+                result[target] = rate.quantize(RATE_QUANTUM)
+            elif via_pivot is not None and target in pivot_edges:
+                result[target] = (via_pivot * pivot_edges[target]).quantize(RATE_QUANTUM)
+            else:
+                result[target] = rate.quantize(RATE_QUANTUM)
+        return result
+
+    def rate(self, from_currency: str, to_currency: str) -> Optional[Decimal]:
+        from_index = self._index.get(from_currency)
+        to_index = self._index.get(to_currency)
+        if from_index is None or to_index is None:
+            return None
+        return self._matrix[from_index][to_index]
+
+class _RateSnapshot(NamedTuple):
+    matrix: FxRateMatrix
+    history_start: datetime
+    history: Dict[Tuple[str, str], Tuple[List[datetime], List[Decimal]]]
+
+class FxRateCache:
+    """Process-local snapshot of ``fx_rates`` kept fresh by a shared version counter.
+
+    Lookups are answered from memory. Every rate write bumps the single row in
+    ``fx_rate_versions``; the cache polls that counter at most once every
+    ``max_staleness`` seconds, so rates written by other workers are picked up
+    within that bound. The whole snapshot is reloaded unconditionally once it is
+    older than ``ttl`` seconds.
+
+    The snapshot also keeps the last ``history_window`` seconds of
+    ``fx_rate_history`` per pair, led by the rate that was in effect when the
+    window opened, so point-in-time lookups for recent conversions bisect in
+    memory even for pairs that have not changed within it; older ones fall
+    back to an indexed query.
+    """
+
+    def __init__(self, ttl: float, max_staleness: float, pivot: str = 'USD',
+                 currencies: Optional[Iterable[str]] = None, history_window: float = 86400) -> None:
+        self.ttl = ttl
+        self.max_staleness = max_staleness
+        self.pivot = pivot
+        self.configured_currencies: Optional[FrozenSet[str]] = frozenset(currencies) if currencies else None
+        self.history_window = history_window
+        self._lock = threading.Lock()
+        self._rates: Optional[_RateSnapshot] = None
+        self._version: Optional[int] = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+
+    def get(self, from_currency: str, to_currency: str) -> Optional[Decimal]:
+        return self._snapshot().matrix.rate(from_currency, to_currency)
+
+    def get_at(self, from_currency: str, to_currency: str, at: datetime) -> Optional[Decimal]:
+        """Rate of a stored pair in effect at ``at`` (naive UTC), from ``fx_rate_history``."""
+        snapshot = self._snapshot()
+        if at >= snapshot.history_start:
+            times, rates = snapshot.history.get((from_currency, to_currency), ([], []))
+            index = bisect_right(times, at)
+            if index > 0:
+                return rates[index - 1]
+
+        return db.session.execute(
+            select(FxRateHistory.rate)
+            .where(
+                FxRateHistory.from_currency == from_currency,
+                FxRateHistory.to_currency == to_currency,
+                FxRateHistory.effective_at <= at
+            )
+            .order_by(FxRateHistory.effective_at.desc(), FxRateHistory.id.desc())
+            .limit(1)
+        ).scalar()
+
+    def currencies(self) -> FrozenSet[str]:
+        """Configured currency whitelist, or every currency present in ``fx_rates``."""
+        if self.configured_currencies is not None:
+            return self.configured_currencies
+        return frozenset(self._snapshot().matrix.currencies)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._rates = None
+
+    def _snapshot(self) -> _RateSnapshot:
+        now = time.monotonic()
+        with self._lock:
+            if self._rates is None or now - self._loaded_at >= self.ttl:
+                self._load(now)
+            elif now - self._checked_at >= self.max_staleness:
+                self._checked_at = now
+                if self._read_version() != self._version:
+                    self._load(now)
+            assert self._rates is not None
+            return self._rates
+
+    def _load(self, now: float) -> None:
+        # Read the version first: a write landing between the two queries leaves
+        # us with newer rates under an older version, which the next poll repairs.
+        self._version = self._read_version()
+        rows = db.session.execute(select(FxRate.from_currency, FxRate.to_currency, FxRate.rate)).all()
+        matrix = FxRateMatrix(
+            {(row.from_currency, row.to_currency): row.rate for row in rows},
+            pivot=self.pivot,
+            currencies=self.configured_currencies or ()
+        )
+
+        history_start = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=self.history_window)
+        history: Dict[Tuple[str, str], Tuple[List[datetime], List[Decimal]]] = {}
+        columns = (FxRateHistory.from_currency, FxRateHistory.to_currency, FxRateHistory.rate, FxRateHistory.effective_at)
+        newest_first = func.row_number().over(
+            partition_by=(FxRateHistory.from_currency, FxRateHistory.to_currency),
+            order_by=(FxRateHistory.effective_at.desc(), FxRateHistory.id.desc())
+        ).label('newest_first')
+        before_window = select(*columns, newest_first).where(FxRateHistory.effective_at < history_start).subquery()
+        # Each pair's rate as the window opened, then everything inside the window.
+        opening_rows = db.session.execute(
+            select(before_window.c.from_currency, before_window.c.to_currency,
+                   before_window.c.rate, before_window.c.effective_at)
+            .where(before_window.c.newest_first == 1)
+        )
+        history_rows = db.session.execute(
+            select(*columns)
+            .where(FxRateHistory.effective_at >= history_start)
+            .order_by(FxRateHistory.effective_at, FxRateHistory.id)
+        )
+        for row in [*opening_rows, *history_rows]:
+            times, rates = history.setdefault((row.from_currency, row.to_currency), ([], []))
+            times.append(row.effective_at)
+            rates.append(row.rate)
+
+        self._rates = _RateSnapshot(matrix, history_start, history)
+        self._loaded_at = now
+        self._checked_at = now
+
+    @staticmethod
+    def _read_version() -> Optional[int]:
+        return db.session.execute(select(FxRateVersion.version).where(FxRateVersion.id == 1)).scalar()
+
+class FxQuote(NamedTuple):
+    quote_id: str
+    user_id: str
+    from_currency: str
+    to_currency: str
+    rate: Decimal
+    expires_at: datetime
+
+class FxQuoteStore:
+    """Bounded, process-local cache of the rate quotes this process issued.
+
+    ``fx_quotes`` is the record of which quotes exist; this store only saves
+    the lookup when a convert lands on the process that issued its quote.
+    Every quote lives for ``ttl`` seconds. Quotes are kept in expiry order, so
+    expired ones are purged from the front on each issue, and once ``max_size``
+    live quotes are held the oldest is evicted to make room.
+    """
+
+    def __init__(self, ttl: float, max_size: int) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._quotes: OrderedDict[str, Tuple[FxQuote, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._quotes)
+
+    def issue(self, user_id: str, from_currency: str, to_currency: str, rate: Decimal) -> FxQuote:
+        now = time.monotonic()
+        quote = FxQuote(
+            quote_id=uuid.uuid4().hex,
+            user_id=user_id,
+            from_currency=from_currency,
+            to_currency=to_currency,
+            rate=rate,
+            expires_at=datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=self.ttl)
+        )
+        with self._lock:
+            self._purge(now)
+            while len(self._quotes) >= self.max_size:
+                self._quotes.popitem(last=False)
+            self._quotes[quote.quote_id] = (quote, now + self.ttl)
+        return quote
+
+    def get(self, quote_id: str) -> Optional[FxQuote]:
+        """Return a live quote, or ``None`` if it is unknown here or expired."""
+        with self._lock:
+            entry = self._quotes.get(quote_id)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def discard(self, quote_id: str) -> None:
+        with self._lock:
+            self._quotes.pop(quote_id, None)
+
+    def _purge(self, now: float) -> None:
+        while self._quotes:
+            _, (_, deadline) = next(iter(self._quotes.items()))
+            if deadline > now:
+                break
+            self._quotes.popitem(last=False)
+
+class StoredResponse(NamedTuple):
+    request_hash: str
+    status_code: int
+    body: str
+    expires_at: datetime
+
+class IdempotencyCache:
+    """Bounded LRU of completed idempotent responses, keyed by ``(user_id, key)``.
+
+    Sits in front of ``idempotency_keys`` so that replays within the same
+    process are answered without a database round trip.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._responses: OrderedDict[Tuple[str, str], StoredResponse] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    def get(self, user_id: str, key: str) -> Optional[StoredResponse]:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        with self._lock:
+            stored = self._responses.get((user_id, key))
+            if stored is None:
+                return None
+            if stored.expires_at <= now:
+                del self._responses[(user_id, key)]
+                return None
+            self._responses.move_to_end((user_id, key))
+            return stored
+
+    def put(self, user_id: str, key: str, stored: StoredResponse) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._responses[(user_id, key)] = stored
+            self._responses.move_to_end((user_id, key))
+            while len(self._responses) > self.max_size:
+                self._responses.popitem(last=False)
+
+# Balance and wallet version for each of a user's currencies.
+WalletBalances = Dict[str, Tuple[Decimal, int]]
+
+class BalanceCacheBackend(ABC):
+    """Storage for cached wallet balances, local to the process or shared between them.
+
+    A backend holds two kinds of entries per user. A complete entry comes from
+    reading every wallet of the user. A partial entry comes only from
+    write-through and is never served. ``merge`` must be atomic per user and
+    keep, for every currency, the value with the highest wallet version. That
+    way a slow read can never overwrite a newer committed write.
+    """
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> BalanceCacheBackend:
+        return cls()
+
+    @abstractmethod
+    def get(self, user_id: str) -> Optional[WalletBalances]:
+        """Return a live complete entry, or ``None``."""
+
+    @abstractmethod
+    def merge(self, user_id: str, balances: WalletBalances, complete: bool, ttl: float) -> None:
+        """Fold ``balances`` into the user's entry; a complete read restarts its ``ttl``."""
+
+    @abstractmethod
+    def delete(self, user_id: str) -> None:
+        """Drop the user's entry."""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Number of entries held."""
+
+class _BalanceEntry(NamedTuple):
+    balances: WalletBalances
+    complete: bool
+    deadline: float
+
+class MemoryBalanceBackend(BalanceCacheBackend):
+    """Process-local LRU backend bounded to ``max_size`` users."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, _BalanceEntry] = OrderedDict()
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> BalanceCacheBackend:
+        return cls(config['BALANCE_CACHE_SIZE'])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, user_id: str) -> Optional[WalletBalances]:
+        with self._lock:
+            entry = self._live(user_id, time.monotonic())
+            if entry is None or not entry.complete:
+                return None
+            self._entries.move_to_end(user_id)
+            return dict(entry.balances)
+
+    def merge(self, user_id: str, balances: WalletBalances, complete: bool, ttl: float) -> None:
+        if self.max_size <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live(user_id, now)
+            if entry is None:
+                entry = _BalanceEntry({}, False, now + ttl)
+            merged = dict(entry.balances)
+            for currency, (balance, version) in balances.items():
+                if currency not in merged or version >= merged[currency][1]:
+                    merged[currency] = (balance, version)
+            deadline = now + ttl if complete else entry.deadline
+            self._entries[user_id] = _BalanceEntry(merged, entry.complete or complete, deadline)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, user_id: str) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def _live(self, user_id: str, now: float) -> Optional[_BalanceEntry]:
+        entry = self._entries.get(user_id)
+        if entry is not None and entry.deadline <= now:
+            del self._entries[user_id]
+            return None
+        return entry
+
+BALANCE_CACHE_BACKENDS: Dict[str, Type[BalanceCacheBackend]] = {
+    'memory': MemoryBalanceBackend,
+}
+
+class BalanceCache:
+    """Per-user wallet balances kept for ``ttl`` seconds, with hit and miss counters.
+
+    Reads fill the cache; committed wallet writes are written through with the
+    wallet version they produced, so a cached balance never outlives a write
+    committed in this process. Writes made by other processes are only seen
+    once the entry expires, unless the backend is shared.
+    """
+
+    def __init__(self, backend: BalanceCacheBackend, ttl: float) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> BalanceCache:
+        name = config['BALANCE_CACHE_BACKEND']
+        backend_class = BALANCE_CACHE_BACKENDS.get(name)
+        if backend_class is None:
+            raise ValueError(f"Unknown balance cache backend {name!r}; expected one of {', '.join(sorted(BALANCE_CACHE_BACKENDS))}")
+        return cls(backend_class.from_config(config), config['BALANCE_CACHE_TTL'])
+
+    def get(self, user_id: str) -> Optional[WalletBalances]:
+        balances = self.backend.get(user_id)
+        with self._lock:
+            if balances is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return balances
+
+    def fill(self, user_id: str, balances: WalletBalances) -> None:
+        """Cache every wallet of ``user_id`` as just read from the database."""
+        self.backend.merge(user_id, balances, complete=True, ttl=self.ttl)
+
+    def write_through(self, user_id: str, balances: WalletBalances) -> None:
+        """Record balances committed by a write."""
+        self.backend.merge(user_id, balances, complete=False, ttl=self.ttl)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "size": len(self.backend)
+            }
@@ -0,0 +1,165 @@
+from __future__ import annotations
+from app.services import LedgerArchiveService, LedgerPartitionService, ReconciliationService, SnapshotService
+from datetime import datetime, timezone
+from flask import Flask, current_app
+from flask.cli import with_appcontext
+from typing import Optional
+import click
+import os
+
+@click.command('reconcile-all')
+@click.option('--output', required=True, type=click.Path(dir_okay=False), help='Report file to write discrepancies to.')
+@click.option('--format', 'report_format', type=click.Choice(['jsonl', 'csv']), default=None,
+              help='Report format (defaults to the output file extension, else jsonl).')
+@click.option('--shard-size', default=1000, show_default=True, help='Users per shard.')
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True, help='Parallel worker processes.')
+@click.option('--full', is_flag=True, help='Replay the whole ledger instead of starting from checkpoints.')
+@click.option('--resume', is_flag=True, help='Continue an interrupted sweep into the same output file.')
+@with_appcontext
+def reconcile_all_command(output: str, report_format: Optional[str], shard_size: int, workers: int,
+                          full: bool, resume: bool) -> None:
+    """Reconcile every wallet and write discrepancies to a report."""
+    if report_format is None:
+        report_format = 'csv' if output.endswith('.csv') else 'jsonl'
+
+    summary = ReconciliationService.reconcile_all(
+        output, report_format=report_format, shard_size=shard_size,
+        workers=workers, full=full, resume=resume
+    )
+    click.echo(
+        f"Reconciled {summary['shards']} shards ({summary['skipped_shards']} resumed): "
+        f"{summary['discrepancies']} discrepancies written to {output}"
+    )
+
+@click.command('build-snapshots')
+@click.option('--as-of', default=None, help='ISO 8601 timestamp to snapshot balances at (defaults to now minus SNAPSHOT_SETTLE_SECONDS).')
+@with_appcontext
+def build_snapshots_command(as_of: Optional[str]) -> None:
+    """Materialize wallet balance snapshots for point-in-time queries."""
+    try:
+        snapshot_time: Optional[datetime] = None
+        if as_of is not None:
+            snapshot_time = datetime.fromisoformat(as_of)
+            if snapshot_time.tzinfo is not None:
+                snapshot_time = snapshot_time.astimezone(timezone.utc).replace(tzinfo=None)
+        written = SnapshotService.build_snapshots(snapshot_time)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Wrote {written} balance snapshots")
+
+@click.command('ingest-rates')
+@click.option('--once', is_flag=True, help='Ingest a single rate set and exit.')
+@with_appcontext
+def ingest_rates_command(once: bool) -> None:
+    """Pull FX rates from the configured provider on FX_RATE_INGEST_INTERVAL."""
+    from app.providers import build_provider
+    from app.workers import RateIngestionWorker
+
+    app = current_app._get_current_object()  # type: ignore[attr-defined]
+    try:
+        provider = build_provider(app.config)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    worker = RateIngestionWorker(app, provider, app.config['FX_RATE_INGEST_INTERVAL'])
+
+    if once:
+        click.echo(f"Ingested {worker.run_once()} FX rates")
+        return
+
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(1)
+    except KeyboardInterrupt:
+        worker.stop()
+
+@click.command('sweep-idempotency-keys')
+@click.option('--once', is_flag=True, help='Purge expired keys a single time and exit.')
+@with_appcontext
+def sweep_idempotency_keys_command(once: bool) -> None:
+    """Purge expired idempotency keys every IDEMPOTENCY_SWEEP_INTERVAL seconds."""
+    from app.workers import IdempotencySweeper
+
+    app = current_app._get_current_object()  # type: ignore[attr-defined]
+    worker = IdempotencySweeper(app, app.config['IDEMPOTENCY_SWEEP_INTERVAL'])
+
+    if once:
+        click.echo(f"Purged {worker.run_once()} expired idempotency keys")
+        return
+
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(1)
+    except KeyboardInterrupt:
+        worker.stop()
+
+@click.command('ensure-ledger-partitions')
+@click.option('--months-ahead', type=int, default=None,
+              help='Months of partitions to keep ahead (defaults to LEDGER_PARTITION_MONTHS_AHEAD).')
+@click.option('--once', is_flag=True, help='Create missing partitions a single time and exit.')
+@with_appcontext
+def ensure_ledger_partitions_command(months_ahead: Optional[int], once: bool) -> None:
+    """Create future monthly transactions partitions every LEDGER_PARTITION_INTERVAL seconds."""
+    from app.workers import LedgerPartitionWorker
+
+    app = current_app._get_current_object()  # type: ignore[attr-defined]
+    months: int = app.config['LEDGER_PARTITION_MONTHS_AHEAD'] if months_ahead is None else months_ahead
+    worker = LedgerPartitionWorker(app, months, app.config['LEDGER_PARTITION_INTERVAL'])
+
+    if once:
+        if not LedgerPartitionService.is_partitioned():
+            click.echo("transactions is not partitioned on this database; nothing to do")
+            return
+        try:
+            click.echo(f"Created {worker.run_once()} ledger partitions")
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        return
+
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(1)
+    except KeyboardInterrupt:
+        worker.stop()
+
+@click.command('detach-ledger-partitions')
+@click.option('--before', required=True, help='Detach monthly partitions ending on or before this ISO 8601 date.')
+@click.option('--archive-schema', default=None, help='Schema to move detached partitions into.')
+@click.option('--force', is_flag=True, help='Detach even if reconciliation checkpoints do not cover the rows.')
+@with_appcontext
+def detach_ledger_partitions_command(before: str, archive_schema: Optional[str], force: bool) -> None:
+    """Detach old monthly transactions partitions from the live ledger."""
+    try:
+        cutoff = datetime.fromisoformat(before)
+        if cutoff.tzinfo is not None:
+            cutoff = cutoff.astimezone(timezone.utc).replace(tzinfo=None)
+        detached = LedgerPartitionService.detach_partitions(cutoff, archive_schema, force)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Detached {len(detached)} ledger partitions" + (f": {', '.join(detached)}" if detached else ""))
+
+@click.command('archive-ledger')
+@click.option('--older-than-months', type=int, default=None,
+              help='Archive months that ended this many months ago or earlier (defaults to LEDGER_ARCHIVE_AFTER_MONTHS).')
+@with_appcontext
+def archive_ledger_command(older_than_months: Optional[int]) -> None:
+    """Move old months of transactions into compressed archive segments."""
+    months: int = current_app.config['LEDGER_ARCHIVE_AFTER_MONTHS'] if older_than_months is None else older_than_months
+    try:
+        archived = LedgerArchiveService.archive_months(months)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    for month in archived:
+        click.echo(f"Archived {month.row_count} transactions from {month.month:%Y-%m}")
+    click.echo(f"Archived {len(archived)} ledger months")
+
+def register_commands(app: Flask) -> None:
+    app.cli.add_command(reconcile_all_command)
+    app.cli.add_command(build_snapshots_command)
+    app.cli.add_command(ingest_rates_command)
+    app.cli.add_command(sweep_idempotency_keys_command)
+    app.cli.add_command(ensure_ledger_partitions_command)
+    app.cli.add_command(detach_ledger_partitions_command)
+    app.cli.add_command(archive_ledger_command)
@@ -0,0 +1,39 @@
+from __future__ import annotations
+from typing import Any, Dict
+import threading
+
+class LockMetrics:
+    """Process-local counters for wallet row locking and conflict retries."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.acquisitions = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.retries = 0
+        self.failures = 0
+
+    def record_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.acquisitions += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "acquisitions": self.acquisitions,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_avg": self.wait_seconds_total / self.acquisitions if self.acquisitions else 0.0,
+                "wait_seconds_max": self.wait_seconds_max,
+                "retries": self.retries,
+                "failures": self.failures
+            }
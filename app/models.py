@@ -2,7 +2,7 @@ from __future__ import annotations
 from app import db
 from datetime import datetime, timezone
 from decimal import Decimal
-from sqlalchemy import Integer, String, DECIMAL, DateTime, Enum
+from sqlalchemy import Integer, String, DECIMAL, DateTime, Enum, Text
 from sqlalchemy.orm import Mapped, mapped_column  # type: ignore[attr-defined]
 from typing import Optional
 import enum
@@ -20,15 +20,21 @@ class Wallet(db.Model):
     user_id: Mapped[str] = mapped_column(String(50), nullable=False)
     currency: Mapped[str] = mapped_column(String(3), nullable=False)
     balance: Mapped[Decimal] = mapped_column(DECIMAL(20, 8), nullable=False, default=Decimal('0'))
+    # Bumped by every balance write; the ORM checks it on flush for optimistic locking.
+    version: Mapped[int] = mapped_column(Integer, nullable=False, server_default='1')
     created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
     __table_args__ = (db.UniqueConstraint('user_id', 'currency', name='_user_currency_uc'),)
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self) -> str:
         return f'<Wallet {self.user_id}:{self.currency}={self.balance}>'
 
 class Transaction(db.Model):
+    # On PostgreSQL the table is range-partitioned by month on created_at, with
+    # a (id, created_at) primary key (migration d2a78057c3ab). ids still come
+    # from a single sequence, so the ORM keeps identifying rows by id alone.
     __tablename__ = 'transactions'
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -41,6 +47,14 @@ class Transaction(db.Model):
     fx_rate: Mapped[Optional[Decimal]] = mapped_column(DECIMAL(20, 8), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc))
 
+    __table_args__ = (
+        # Transaction history: filter by user, newest first, id as tie-breaker.
+        db.Index('ix_transactions_user_id_created_at', 'user_id', 'created_at', 'id'),
+        # Reconciliation: per-user ranges of ids, covering the summed columns on PostgreSQL.
+        db.Index('ix_transactions_user_id_id', 'user_id', 'id',
+                 postgresql_include=['currency', 'transaction_type', 'amount']),
+    )
+
     def __repr__(self) -> str:
         return f'<Transaction {self.id}: {self.user_id} {self.transaction_type.value} {self.amount} {self.currency}>'
 
@@ -52,8 +66,121 @@ class FxRate(db.Model):
     to_currency: Mapped[str] = mapped_column(String(3), nullable=False)
     rate: Mapped[Decimal] = mapped_column(DECIMAL(20, 8), nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
     __table_args__ = (db.UniqueConstraint('from_currency', 'to_currency', name='_currency_pair_uc'),)
 
     def __repr__(self) -> str:
         return f'<FxRate {self.from_currency}/{self.to_currency}: {self.rate}>'
+
+class FxRateHistory(db.Model):
+    __tablename__ = 'fx_rate_history'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    from_currency: Mapped[str] = mapped_column(String(3), nullable=False)
+    to_currency: Mapped[str] = mapped_column(String(3), nullable=False)
+    rate: Mapped[Decimal] = mapped_column(DECIMAL(20, 8), nullable=False)
+    effective_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_fx_rate_history_pair_effective_at', 'from_currency', 'to_currency', 'effective_at'),
+        db.Index('ix_fx_rate_history_effective_at', 'effective_at'),
+    )
+
+    def __repr__(self) -> str:
+        return f'<FxRateHistory {self.from_currency}/{self.to_currency}: {self.rate}@{self.effective_at}>'
+
+class FxRateVersion(db.Model):
+    __tablename__ = 'fx_rate_versions'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f'<FxRateVersion {self.version}>'
+
+class ReconciliationCheckpoint(db.Model):
+    __tablename__ = 'reconciliation_checkpoints'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[str] = mapped_column(String(50), nullable=False)
+    currency: Mapped[str] = mapped_column(String(3), nullable=False)
+    calculated_balance: Mapped[Decimal] = mapped_column(DECIMAL(20, 8), nullable=False, default=Decimal('0'))
+    last_transaction_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'currency', name='_checkpoint_user_currency_uc'),)
+
+    def __repr__(self) -> str:
+        return f'<ReconciliationCheckpoint {self.user_id}:{self.currency}={self.calculated_balance}@{self.last_transaction_id}>'
+
+class WalletBalanceSnapshot(db.Model):
+    __tablename__ = 'wallet_balance_snapshots'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[str] = mapped_column(String(50), nullable=False)
+    currency: Mapped[str] = mapped_column(String(3), nullable=False)
+    balance: Mapped[Decimal] = mapped_column(DECIMAL(20, 8), nullable=False)
+    as_of: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'currency', 'as_of', name='_snapshot_user_currency_as_of_uc'),
+        db.Index('ix_wallet_balance_snapshots_user_id_as_of', 'user_id', 'as_of'),
+        db.Index('ix_wallet_balance_snapshots_as_of', 'as_of'),
+    )
+
+    def __repr__(self) -> str:
+        return f'<WalletBalanceSnapshot {self.user_id}:{self.currency}={self.balance}@{self.as_of}>'
+
+class FxRateQuote(db.Model):
+    """A rate locked for one user's conversion until ``expires_at``; deleted when used."""
+    __tablename__ = 'fx_quotes'
+
+    quote_id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    user_id: Mapped[str] = mapped_column(String(50), nullable=False)
+    from_currency: Mapped[str] = mapped_column(String(3), nullable=False)
+    to_currency: Mapped[str] = mapped_column(String(3), nullable=False)
+    rate: Mapped[Decimal] = mapped_column(DECIMAL(20, 8), nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    __table_args__ = (db.Index('ix_fx_quotes_user_id_expires_at', 'user_id', 'expires_at'),)
+
+    def __repr__(self) -> str:
+        return f'<FxRateQuote {self.quote_id}: {self.user_id} {self.from_currency}/{self.to_currency}={self.rate}>'
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[str] = mapped_column(String(50), nullable=False)
+    key: Mapped[str] = mapped_column(String(255), nullable=False)
+    request_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+    # NULL until the original request finishes.
+    status_code: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    response_body: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc))
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='_idempotency_user_key_uc'),
+        db.Index('ix_idempotency_keys_expires_at', 'expires_at'),
+    )
+
+    def __repr__(self) -> str:
+        return f'<IdempotencyKey {self.user_id}:{self.key}={self.status_code}>'
+
+class LedgerArchiveMonth(db.Model):
+    """A calendar month of ``transactions`` moved out to gzip NDJSON segment files."""
+    __tablename__ = 'ledger_archive_months'
+
+    # First day of the month, naive UTC.
+    month: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
+    # Segments are split by user hash into this many buckets.
+    user_buckets: Mapped[int] = mapped_column(Integer, nullable=False)
+    row_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    # Highest transaction id in the month; readers past it can skip the month's segments.
+    max_transaction_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    archived_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self) -> str:
+        return f'<LedgerArchiveMonth {self.month:%Y-%m}: {self.row_count} rows>'
@@ -0,0 +1,56 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict
+import os
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+def engine_options(database_url: str) -> Dict[str, Any]:
+    """``SQLALCHEMY_ENGINE_OPTIONS`` built from the ``DB_POOL_*`` environment variables.
+
+    SQLite runs on a single-connection or per-file pool that takes no sizing
+    arguments, so it only gets the pool-agnostic options.
+    """
+    options: Dict[str, Any] = {
+        'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', True),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+    }
+    if not database_url.startswith('sqlite'):
+        options.update(
+            pool_size=int(os.getenv('DB_POOL_SIZE', '10')),
+            max_overflow=int(os.getenv('DB_MAX_OVERFLOW', '20')),
+            pool_timeout=float(os.getenv('DB_POOL_TIMEOUT', '30')),
+        )
+    return options
+
+# Async drivers used by the ASGI read path, keyed by the URL's dialect.
+ASYNC_DRIVERS: Dict[str, str] = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+def async_database_url(database_url: str) -> str:
+    """The same database as ``database_url``, addressed through its async driver."""
+    scheme, separator, rest = database_url.partition('://')
+    dialect = scheme.split('+', 1)[0]
+    if not separator or dialect not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for database URL scheme {scheme!r}")
+    return f"{ASYNC_DRIVERS[dialect]}://{rest}"
+
+def _production(database_url: str) -> Dict[str, Any]:
+    return {'SQLALCHEMY_ENGINE_OPTIONS': engine_options(database_url)}
+
+# Each profile maps the database URL to the config it layers over the environment defaults.
+PROFILES: Dict[str, Callable[[str], Dict[str, Any]]] = {
+    'development': lambda database_url: {},
+    'testing': lambda database_url: {'TESTING': True},
+    'production': _production,
+}
+
+def load_profile(name: str, database_url: str) -> Dict[str, Any]:
+    if name not in PROFILES:
+        raise ValueError(f"Unknown config profile {name!r}; expected one of {', '.join(sorted(PROFILES))}")
+    return PROFILES[name](database_url)
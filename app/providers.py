@@ -0,0 +1,63 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Mapping, Tuple, Type
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+class RateProvider(ABC):
+    """Source of complete FX rate sets for the ingestion worker."""
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> RateProvider:
+        return cls()
+
+    @abstractmethod
+    def fetch_rates(self) -> Dict[Tuple[str, str], Decimal]:
+        """Return the latest rate for every pair the provider publishes."""
+
+def parse_rate_table(table: Mapping[str, Any]) -> Dict[Tuple[str, str], Decimal]:
+    """Parse ``{"USD/MXN": "18.70", ...}`` into rate pairs, skipping malformed entries."""
+    rates: Dict[Tuple[str, str], Decimal] = {}
+    for pair, value in table.items():
+        try:
+            from_currency, to_currency = pair.split('/')
+            rate = Decimal(str(value))
+        except (ValueError, InvalidOperation):
+            logger.warning("Skipping malformed FX rate %r: %r", pair, value)
+            continue
+        if len(from_currency) != 3 or len(to_currency) != 3 or not rate.is_finite() or rate <= 0:
+            logger.warning("Skipping invalid FX rate %r: %r", pair, value)
+            continue
+        rates[(from_currency.upper(), to_currency.upper())] = rate
+    return rates
+
+class FileRateProvider(RateProvider):
+    """Reads a JSON object mapping ``"FROM/TO"`` pairs to rates from a local file."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> RateProvider:
+        path = config.get('FX_RATE_PROVIDER_PATH')
+        if not path:
+            raise ValueError("FX_RATE_PROVIDER_PATH is required for the file provider")
+        return cls(path)
+
+    def fetch_rates(self) -> Dict[Tuple[str, str], Decimal]:
+        with open(self.path) as rate_file:
+            return parse_rate_table(json.load(rate_file))
+
+PROVIDERS: Dict[str, Type[RateProvider]] = {
+    'file': FileRateProvider,
+}
+
+def build_provider(config: Mapping[str, Any]) -> RateProvider:
+    name = config['FX_RATE_PROVIDER']
+    provider_class = PROVIDERS.get(name)
+    if provider_class is None:
+        raise ValueError(f"Unknown FX rate provider: {name}")
+    return provider_class.from_config(config)
@@ -0,0 +1,76 @@
+from __future__ import annotations
+from app import db
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import g
+from sqlalchemy import Engine
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from typing import Iterator, Optional
+import threading
+import time
+
+def _app_ctx_id() -> int:
+    # One replica session per app context, as Flask-SQLAlchemy scopes db.session;
+    # every app context gets its own ``g``.
+    return id(g._get_current_object())
+
+class ReadRouter:
+    """Sends read-only queries to the replica engine, or to the primary when it has to.
+
+    A user's reads go to the primary for ``window`` seconds after one of their
+    own writes, so they see it even while the replica is still catching up;
+    ``window`` should exceed the replica's usual lag. Writes are remembered per
+    process, so the guarantee holds for requests served by the same worker.
+    Without a replica engine every read goes to the primary.
+    """
+
+    def __init__(self, window: float, engine: Optional[Engine] = None) -> None:
+        self.window = window
+        self.engine = engine
+        self.enabled = engine is not None
+        self._lock = threading.Lock()
+        self._writes: OrderedDict[str, float] = OrderedDict()
+        self._sessions = scoped_session(sessionmaker(bind=engine), scopefunc=_app_ctx_id)
+
+    def record_write(self, *user_ids: str) -> None:
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for user_id in user_ids:
+                self._writes[user_id] = now
+                self._writes.move_to_end(user_id)
+            # Entries are kept in write order, so expired ones sit at the front.
+            while self._writes:
+                oldest = next(iter(self._writes.values()))
+                if now - oldest < self.window:
+                    break
+                self._writes.popitem(last=False)
+
+    def wrote_recently(self, user_id: str) -> bool:
+        with self._lock:
+            written_at = self._writes.get(user_id)
+        return written_at is not None and time.monotonic() - written_at < self.window
+
+    def use_replica(self, user_id: Optional[str] = None) -> bool:
+        return self.enabled and (user_id is None or not self.wrote_recently(user_id))
+
+    @contextmanager
+    def reading(self, user_id: Optional[str] = None) -> Iterator[Session]:
+        """Session for a read on behalf of ``user_id`` (``None`` for data no user owns).
+
+        Replica reads are rolled back on exit so the next read starts a fresh
+        transaction rather than reusing an old snapshot.
+        """
+        if not self.use_replica(user_id):
+            yield db.session  # type: ignore[misc]
+            return
+
+        session = self._sessions()
+        try:
+            yield session
+        finally:
+            session.rollback()
+
+    def remove(self) -> None:
+        self._sessions.remove()
@@ -1,10 +1,21 @@
 from __future__ import annotations
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify, make_response, Response, current_app, g, stream_with_context
 from werkzeug.exceptions import BadRequest
-from app.services import WalletService, FxService
+from app.services import (
+    WalletService, FxService, IdempotencyKeyInUse, IdempotencyKeyMismatch, IdempotencyService, SnapshotService
+)
+from datetime import datetime, timezone
 from decimal import Decimal, InvalidOperation
-from marshmallow import Schema, fields, ValidationError
-from typing import Tuple
+from marshmallow import Schema, fields, validate, ValidationError
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import csv
+import functools
+import hashlib
+import io
+import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 bp = Blueprint('main', __name__)
 
@@ -21,19 +32,108 @@ def get_json_data():
     except BadRequest:
         return None, "Request body contains invalid JSON"
 
+def parse_timestamp(value: Optional[str], name: str) -> Optional[datetime]:
+    """Parse an ISO 8601 query parameter into the naive UTC form stored in the database."""
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 date or datetime")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def key_in_use() -> Tuple[Response, int]:
+    return jsonify({"error": "A request with this Idempotency-Key is still being processed"}), 409
+
+def idempotent(view: Callable[..., Any]) -> Callable[..., Any]:
+    """Replay the stored response when a request repeats its ``Idempotency-Key``.
+
+    Keys are scoped to the ``user_id`` in the URL and bound to the method, path
+    and body of the first request that used them. Responses below 500 are
+    stored; a failed request releases its key so the client can retry. A
+    successful wallet operation stores its response itself, in the same
+    transaction as its ledger write (``IdempotencyService.record_response``).
+    """
+    @functools.wraps(view)
+    def wrapper(user_id: str, *args: Any, **kwargs: Any) -> Any:
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return view(user_id, *args, **kwargs)
+        if not key or len(key) > 255:
+            return jsonify({"error": "Idempotency-Key must be between 1 and 255 characters"}), 400
+
+        request_hash = hashlib.sha256(
+            b'\n'.join([request.method.encode(), request.path.encode(), request.get_data()])
+        ).hexdigest()
+        try:
+            stored = IdempotencyService.reserve(user_id, key, request_hash)
+        except IdempotencyKeyInUse:
+            return key_in_use()
+        except IdempotencyKeyMismatch:
+            return jsonify({"error": "Idempotency-Key was already used with a different request"}), 422
+        except Exception:
+            return jsonify({"error": "Internal server error"}), 500
+
+        if stored is not None:
+            response = Response(stored.body, status=stored.status_code, mimetype='application/json')
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = make_response(view(user_id, *args, **kwargs))
+        finally:
+            claim = g.pop('idempotency_claim')
+            recorded = g.pop('idempotency_response', None)
+        try:
+            if recorded is not None and response.status_code == recorded.status_code:
+                IdempotencyService.remember(claim, recorded)
+            elif response.status_code < 500:
+                IdempotencyService.complete(claim, response.status_code, response.get_data(as_text=True))
+            else:
+                IdempotencyService.release(claim)
+        except Exception:
+            # Only responses that changed nothing get here unstored; the claim
+            # lapses and a retry simply runs the request again.
+            logger.exception("Failed to record Idempotency-Key %r for %s", key, user_id)
+        return response
+
+    return wrapper
+
+def is_supported_currency(value: str) -> bool:
+    return value in FxService.supported_currencies()
+
 class FundWalletSchema(Schema):
-    currency = fields.Str(required=True, validate=lambda x: x in ['USD', 'MXN'])
+    currency = fields.Str(required=True, validate=is_supported_currency)
     amount = fields.Decimal(required=True, places=8)
 
 class ConvertCurrencySchema(Schema):
-    from_currency = fields.Str(required=True, validate=lambda x: x in ['USD', 'MXN'])
-    to_currency = fields.Str(required=True, validate=lambda x: x in ['USD', 'MXN'])
+    from_currency = fields.Str(required=True, validate=is_supported_currency)
+    to_currency = fields.Str(required=True, validate=is_supported_currency)
     amount = fields.Decimal(required=True, places=8)
+    quote_id = fields.Str(load_default=None)
 
 class WithdrawFundsSchema(Schema):
-    currency = fields.Str(required=True, validate=lambda x: x in ['USD', 'MXN'])
+    currency = fields.Str(required=True, validate=is_supported_currency)
+    amount = fields.Decimal(required=True, places=8)
+
+class BatchOperationSchema(Schema):
+    user_id = fields.Str(required=True, validate=validate.Length(min=1, max=50))
+    type = fields.Str(required=True, validate=validate.OneOf(['fund', 'withdraw']))
+    currency = fields.Str(required=True, validate=is_supported_currency)
     amount = fields.Decimal(required=True, places=8)
 
+class FxQuoteSchema(Schema):
+    user_id = fields.Str(required=True, validate=validate.Length(min=1, max=50))
+    from_currency = fields.Str(required=True, validate=is_supported_currency)
+    to_currency = fields.Str(required=True, validate=is_supported_currency)
+
+class FxRateSchema(Schema):
+    from_currency = fields.Str(required=True, validate=validate.Length(equal=3))
+    to_currency = fields.Str(required=True, validate=validate.Length(equal=3))
+    rate = fields.Decimal(required=True, places=8, validate=validate.Range(min=0, min_inclusive=False))
+
 @bp.route('/')
 def index() -> Response:
     return jsonify({
@@ -43,14 +143,20 @@ def index() -> Response:
             "fund": "POST /wallets/<user_id>/fund",
             "convert": "POST /wallets/<user_id>/convert",
             "withdraw": "POST /wallets/<user_id>/withdraw",
+            "batch": "POST /wallets/batch",
             "balances": "GET /wallets/<user_id>/balances",
             "transactions": "GET /wallets/<user_id>/transactions",
+            "export": "GET /wallets/<user_id>/transactions/export",
             "reconcile": "GET /wallets/<user_id>/reconcile",
-            "fx_rates": "GET /fx/rates"
+            "fx_rates": "GET /fx/rates",
+            "fx_rates_batch": "PUT /fx/rates/batch",
+            "fx_quotes": "POST /fx/quotes",
+            "metrics": "GET /metrics"
         }
     })
 
 @bp.route('/wallets/<user_id>/fund', methods=['POST'])
+@idempotent
 def fund_wallet(user_id: str) -> Tuple[Response, int]:
     try:
         json_data, error = get_json_data()
@@ -72,10 +178,13 @@ def fund_wallet(user_id: str) -> Tuple[Response, int]:
         return jsonify({"error": "Validation error", "details": e.messages}), 400
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    except IdempotencyKeyInUse:
+        return key_in_use()
     except Exception:
         return jsonify({"error": "Internal server error"}), 500
 
 @bp.route('/wallets/<user_id>/convert', methods=['POST'])
+@idempotent
 def convert_currency(user_id: str) -> Tuple[Response, int]:
     try:
         json_data, error = get_json_data()
@@ -89,7 +198,8 @@ def convert_currency(user_id: str) -> Tuple[Response, int]:
             user_id=user_id,
             from_currency=data['from_currency'],  # type: ignore[typeddict-item]
             to_currency=data['to_currency'],  # type: ignore[typeddict-item]
-            amount=data['amount']  # type: ignore[typeddict-item]
+            amount=data['amount'],  # type: ignore[typeddict-item]
+            quote_id=data['quote_id']  # type: ignore[typeddict-item]
         )
 
         return jsonify(result), 200
@@ -98,10 +208,13 @@ def convert_currency(user_id: str) -> Tuple[Response, int]:
         return jsonify({"error": "Validation error", "details": e.messages}), 400
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    except IdempotencyKeyInUse:
+        return key_in_use()
     except Exception:
         return jsonify({"error": "Internal server error"}), 500
 
 @bp.route('/wallets/<user_id>/withdraw', methods=['POST'])
+@idempotent
 def withdraw_funds(user_id: str) -> Tuple[Response, int]:
     try:
         json_data, error = get_json_data()
@@ -123,15 +236,68 @@ def withdraw_funds(user_id: str) -> Tuple[Response, int]:
         return jsonify({"error": "Validation error", "details": e.messages}), 400
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    except IdempotencyKeyInUse:
+        return key_in_use()
+    except Exception:
+        return jsonify({"error": "Internal server error"}), 500
+
+@bp.route('/wallets/batch', methods=['POST'])
+def apply_batch() -> Tuple[Response, int]:
+    try:
+        json_data, error = get_json_data()
+        if error:
+            return jsonify({"error": error}), 400
+
+        operations = json_data.get('operations') if isinstance(json_data, dict) else None
+        if not isinstance(operations, list) or not operations:
+            return jsonify({"error": "operations must be a non-empty list"}), 400
+
+        max_operations = current_app.config['WALLET_BATCH_MAX_OPERATIONS']
+        if len(operations) > max_operations:
+            return jsonify({"error": f"A batch may contain at most {max_operations} operations"}), 400
+
+        # Validate the whole batch in one pass; errors come back keyed by index.
+        schema = BatchOperationSchema(many=True)
+        errors: Dict[int, Any] = {}
+        try:
+            data = schema.load(operations)
+        except ValidationError as e:
+            errors = e.messages  # type: ignore[assignment]
+            data = e.valid_data
+
+        valid_indexes = [i for i in range(len(operations)) if i not in errors]
+        applied = WalletService.apply_batch([data[i] for i in valid_indexes])  # type: ignore[index]
+
+        results: List[Dict[str, Any]] = [
+            {"index": i, "success": False, "error": "Validation error", "details": errors[i]}
+            for i in errors
+        ]
+        for i, outcome in zip(valid_indexes, applied):
+            results.append({"index": i, **outcome})
+        results.sort(key=lambda item: item['index'])
+
+        succeeded = sum(1 for item in results if item['success'])
+        return jsonify({
+            "results": results,
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded
+        }), 200
+
     except Exception:
         return jsonify({"error": "Internal server error"}), 500
 
 @bp.route('/wallets/<user_id>/balances', methods=['GET'])
 def get_balances(user_id: str) -> Tuple[Response, int]:
     try:
-        balances = WalletService.get_balances(user_id)
+        as_of = parse_timestamp(request.args.get('as_of'), 'as_of')
+        if as_of is not None:
+            balances = SnapshotService.get_balances_as_of(user_id, as_of)
+        else:
+            balances = WalletService.get_balances(user_id)
         return jsonify(balances), 200
 
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception:
         return jsonify({"error": "Internal server error"}), 500
 
@@ -139,16 +305,65 @@ def get_balances(user_id: str) -> Tuple[Response, int]:
 def get_transactions(user_id: str) -> Tuple[Response, int]:
     try:
         limit = request.args.get('limit', 100, type=int)
-        transactions = WalletService.get_transactions(user_id, limit)
-        return jsonify({"transactions": transactions}), 200
+        cursor = request.args.get('cursor')
+        page = WalletService.get_transactions(user_id, limit, cursor)
+        return jsonify(page), 200
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception:
+        return jsonify({"error": "Internal server error"}), 500
+
+@bp.route('/wallets/<user_id>/transactions/export', methods=['GET'])
+def export_transactions(user_id: str) -> Tuple[Response, int]:
+    try:
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in ('ndjson', 'csv'):
+            return jsonify({"error": "format must be 'ndjson' or 'csv'"}), 400
+
+        start = parse_timestamp(request.args.get('from'), 'from')
+        end = parse_timestamp(request.args.get('to'), 'to')
+        rows = WalletService.iter_transactions(user_id, start, end)
+
+        def generate_ndjson() -> Iterator[str]:
+            for row in rows:
+                yield json.dumps(row) + "\n"
+
+        def generate_csv() -> Iterator[str]:
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=WalletService.TRANSACTION_FIELDS)
+            writer.writeheader()
+            yield buffer.getvalue()
+            for row in rows:
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerow(row)
+                yield buffer.getvalue()
+
+        if export_format == 'csv':
+            body, mimetype = generate_csv(), 'text/csv'
+        else:
+            body, mimetype = generate_ndjson(), 'application/x-ndjson'
+
+        return Response(
+            stream_with_context(body),
+            mimetype=mimetype,
+            headers={"Content-Disposition": f"attachment; filename={user_id}-transactions.{export_format}"}
+        ), 200
 
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception:
         return jsonify({"error": "Internal server error"}), 500
 
 @bp.route('/wallets/<user_id>/reconcile', methods=['GET'])
 def reconcile_balances(user_id: str) -> Tuple[Response, int]:
     try:
-        result = WalletService.reconcile_balances(user_id)
+        mode = request.args.get('mode', 'incremental')
+        if mode not in ('incremental', 'full'):
+            return jsonify({"error": "mode must be 'incremental' or 'full'"}), 400
+
+        result = WalletService.reconcile_balances(user_id, full=mode == 'full')
         return jsonify(result), 200
 
     except Exception:
@@ -190,3 +405,96 @@ def update_fx_rate() -> Tuple[Response, int]:
         return jsonify({"error": "Invalid rate value"}), 400
     except Exception:
         return jsonify({"error": "Internal server error"}), 500
+
+@bp.route('/fx/rates/batch', methods=['PUT'])
+def update_fx_rates_batch() -> Tuple[Response, int]:
+    try:
+        json_data, error = get_json_data()
+        if error:
+            return jsonify({"error": error}), 400
+
+        entries = json_data.get('rates') if isinstance(json_data, dict) else None
+        if not isinstance(entries, list) or not entries:
+            return jsonify({"error": "rates must be a non-empty list"}), 400
+
+        max_pairs = current_app.config['FX_RATE_BATCH_MAX_PAIRS']
+        if len(entries) > max_pairs:
+            return jsonify({"error": f"A batch may contain at most {max_pairs} rates"}), 400
+
+        schema = FxRateSchema(many=True)
+        errors: Dict[int, Any] = {}
+        data: List[Dict[str, Any]]
+        try:
+            data = schema.load(entries)  # type: ignore[assignment]
+        except ValidationError as e:
+            errors = e.messages  # type: ignore[assignment]
+            data = e.valid_data  # type: ignore[assignment]
+
+        results: List[Dict[str, Any]] = []
+        rates: Dict[Tuple[str, str], Decimal] = {}
+        for index, entry in enumerate(data):
+            if index in errors:
+                results.append({"index": index, "success": False, "error": "Validation error", "details": errors[index]})
+                continue
+
+            pair = (entry['from_currency'].upper(), entry['to_currency'].upper())
+            result: Dict[str, Any] = {"index": index, "pair": f"{pair[0]}/{pair[1]}"}
+            if pair[0] == pair[1]:
+                result.update(success=False, error="Cannot set a rate between the same currency")
+            elif pair in rates:
+                result.update(success=False, error="Duplicate pair in batch")
+            else:
+                rate: Decimal = entry['rate']
+                rates[pair] = rate
+                result.update(success=True)
+            results.append(result)
+
+        FxService.upsert_rates(rates)
+
+        return jsonify({
+            "results": results,
+            "updated": len(rates),
+            "failed": len(results) - len(rates)
+        }), 200
+
+    except Exception:
+        return jsonify({"error": "Internal server error"}), 500
+
+@bp.route('/fx/quotes', methods=['POST'])
+def create_fx_quote() -> Tuple[Response, int]:
+    try:
+        json_data, error = get_json_data()
+        if error:
+            return jsonify({"error": error}), 400
+
+        schema = FxQuoteSchema()
+        data = schema.load(json_data)  # type: ignore[arg-type]
+
+        quote = FxService.create_quote(
+            user_id=data['user_id'],  # type: ignore[typeddict-item]
+            from_currency=data['from_currency'],  # type: ignore[typeddict-item]
+            to_currency=data['to_currency']  # type: ignore[typeddict-item]
+        )
+
+        return jsonify({
+            "quote_id": quote.quote_id,
+            "user_id": quote.user_id,
+            "from_currency": quote.from_currency,
+            "to_currency": quote.to_currency,
+            "rate": quote.rate,
+            "expires_at": quote.expires_at.isoformat() + 'Z'
+        }), 201
+
+    except ValidationError as e:
+        return jsonify({"error": "Validation error", "details": e.messages}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception:
+        return jsonify({"error": "Internal server error"}), 500
+
+@bp.route('/metrics', methods=['GET'])
+def get_metrics() -> Tuple[Response, int]:
+    return jsonify({
+        "wallet_locks": current_app.extensions['wallet_lock_metrics'].snapshot(),
+        "balance_cache": current_app.extensions['balance_cache'].snapshot()
+    }), 200
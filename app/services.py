@@ -1,27 +1,248 @@
 from __future__ import annotations
 from app import db
-from app.models import Wallet, Transaction, FxRate, TransactionType
+from app.archive import ArchivedTransaction, LedgerArchive, signed_sums
+from app.cache import BalanceCache, FxQuote, FxQuoteStore, FxRateCache, IdempotencyCache, StoredResponse, WalletBalances
+from app.models import (
+    Wallet, Transaction, FxRate, FxRateHistory, FxRateQuote, FxRateVersion, IdempotencyKey, LedgerArchiveMonth,
+    ReconciliationCheckpoint, TransactionType, WalletBalanceSnapshot
+)
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal, ROUND_DOWN
-from typing import Dict, List, Any
+from app.metrics import LockMetrics
+from app.replica import ReadRouter
+from flask import current_app, g
+from sqlalchemy import DECIMAL, CursorResult, DateTime, Select, String, case, delete, func, insert, literal, select, text, tuple_, type_coerce, union_all, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.orm import Session, scoped_session
+from sqlalchemy.orm.exc import StaleDataError
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Any, NamedTuple, Optional, Sequence, Set, Tuple, TypeVar, Union, cast
+import base64
+import csv
+import functools
+import json
+import os
+import random
+import re
+import time
+
+T = TypeVar('T')
+
+def _dialect_insert(model: Any) -> Any:
+    """Return an INSERT supporting ``ON CONFLICT`` for the bound dialect, or ``None``."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(model)
+    if dialect == 'sqlite':
+        return sqlite.insert(model)
+    return None
+
+# Deadlock and serialization failure on PostgreSQL.
+_RETRYABLE_SQLSTATES = frozenset({'40001', '40P01'})
+
+def _is_retryable(error: Union[DBAPIError, StaleDataError]) -> bool:
+    if not isinstance(error, DBAPIError):
+        return True
+    sqlstate = getattr(error.orig, 'pgcode', None) or getattr(error.orig, 'sqlstate', None)
+    if sqlstate in _RETRYABLE_SQLSTATES:
+        return True
+    return 'database is locked' in str(error.orig)
+
+def _retry_on_conflict(operation: Callable[..., T]) -> Callable[..., T]:
+    """Re-run a wallet transaction that lost a deadlock, serialization or version race.
+
+    Each attempt starts from a rolled-back session. Retries are bounded by
+    ``WALLET_MAX_RETRIES`` and back off exponentially from
+    ``WALLET_RETRY_BASE_DELAY`` with full jitter, so colliding transactions do
+    not retry in lockstep.
+    """
+    @functools.wraps(operation)
+    def wrapper(*args: Any, **kwargs: Any) -> T:
+        max_retries = current_app.config['WALLET_MAX_RETRIES']
+        base_delay = current_app.config['WALLET_RETRY_BASE_DELAY']
+        metrics = WalletService._lock_metrics()
+        attempt = 0
+        while True:
+            try:
+                return operation(*args, **kwargs)
+            except (DBAPIError, StaleDataError) as e:
+                db.session.rollback()
+                if not _is_retryable(e):
+                    raise
+                if attempt >= max_retries:
+                    metrics.record_failure()
+                    raise
+                attempt += 1
+                metrics.record_retry()
+                time.sleep(random.uniform(0, base_delay * 2 ** attempt))
+    return wrapper
 
 class WalletService:
 
+    TRANSACTION_FIELDS = ["id", "type", "currency", "amount", "from_currency", "to_currency", "fx_rate", "timestamp"]
+
     @staticmethod
     def get_or_create_wallet(user_id: str, currency: str) -> Wallet:
+        """Return the wallet, provisioning it inside the caller's transaction.
+
+        Nothing is committed here; a concurrent creator racing on
+        ``_user_currency_uc`` is absorbed by ``ON CONFLICT DO NOTHING``.
+        """
+        insert_ = _dialect_insert(Wallet)
+        if insert_ is not None:
+            stmt = insert_.values(user_id=user_id, currency=currency, balance=Decimal('0'))
+            stmt = stmt.on_conflict_do_nothing(index_elements=['user_id', 'currency']).returning(Wallet)
+            wallet = db.session.execute(stmt).scalar()
+            if wallet is not None:
+                return wallet
+            return Wallet.query.filter_by(user_id=user_id, currency=currency).one()
+
         wallet = Wallet.query.filter_by(user_id=user_id, currency=currency).first()
         if not wallet:
-            wallet = Wallet(user_id=user_id, currency=currency, balance=Decimal('0'))  # type: ignore[call-arg]
-            db.session.add(wallet)
-            db.session.commit()
+            try:
+                with db.session.begin_nested():
+                    wallet = Wallet(user_id=user_id, currency=currency, balance=Decimal('0'))  # type: ignore[call-arg]
+                    db.session.add(wallet)
+            except IntegrityError:
+                wallet = Wallet.query.filter_by(user_id=user_id, currency=currency).one()
         return wallet
 
     @staticmethod
+    def _credit_wallet(user_id: str, currency: str, amount: Decimal) -> Tuple[Decimal, int]:
+        """Credit a wallet, creating it if needed, and return the new balance and version.
+
+        On PostgreSQL and SQLite this is a single ``INSERT ... ON CONFLICT DO UPDATE``.
+        """
+        insert_ = _dialect_insert(Wallet)
+        if insert_ is None:
+            WalletService.get_or_create_wallet(user_id, currency)
+            credited = WalletService._apply_balance_delta(user_id, currency, amount)
+            assert credited is not None
+            return credited
+
+        stmt = insert_.values(user_id=user_id, currency=currency, balance=amount)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'currency'],
+            set_={
+                'balance': Wallet.balance + stmt.excluded.balance,
+                'version': Wallet.version + 1,
+                'updated_at': datetime.now(timezone.utc)
+            }
+        ).returning(Wallet.balance, Wallet.version)
+        row = db.session.execute(stmt).one()
+        return row.balance, row.version
+
+    @staticmethod
+    def _apply_balance_delta(user_id: str, currency: str, delta: Decimal) -> Optional[Tuple[Decimal, int]]:
+        """Add ``delta`` to a wallet balance in a single UPDATE and return the new balance and version.
+
+        Debits carry a ``balance >= amount`` guard so the funds check happens in the
+        database; ``None`` means the wallet does not exist or cannot cover the debit.
+        """
+        stmt = (
+            update(Wallet)
+            .where(Wallet.user_id == user_id, Wallet.currency == currency)
+            .values(balance=Wallet.balance + delta, version=Wallet.version + 1)
+            .returning(Wallet.balance, Wallet.version)
+        )
+        if delta < 0:
+            stmt = stmt.where(Wallet.balance >= -delta)
+        row = db.session.execute(stmt).first()
+        return None if row is None else (row.balance, row.version)
+
+    @staticmethod
+    def _lock_metrics() -> LockMetrics:
+        return current_app.extensions['wallet_lock_metrics']
+
+    @staticmethod
+    def _balance_cache() -> BalanceCache:
+        return current_app.extensions['balance_cache']
+
+    @staticmethod
+    def _read_router() -> ReadRouter:
+        return current_app.extensions['read_router']
+
+    @staticmethod
+    def _optimistic() -> bool:
+        return current_app.config['WALLET_LOCKING_STRATEGY'] == 'optimistic'
+
+    @staticmethod
+    def _acquire_wallets(keys: Set[Tuple[str, str]],
+                         provision: Optional[Set[Tuple[str, str]]] = None) -> Dict[Tuple[str, str], Wallet]:
+        """Provision the ``(user_id, currency)`` wallets and load them for writing.
+
+        Only the keys in ``provision`` (all of ``keys`` by default) are created
+        when missing; the rest are loaded only if they already exist.
+
+        Under the pessimistic strategy the rows are locked in ascending id order;
+        every caller takes its locks in the same global order, so two
+        transactions over overlapping wallets queue instead of deadlocking.
+        Under the optimistic strategy they are read without locks and conflicts
+        surface at write time through the ``version`` column.
+        """
+        provision = keys if provision is None else provision
+        insert_ = _dialect_insert(Wallet)
+        if provision and insert_ is not None:
+            db.session.execute(
+                insert_.on_conflict_do_nothing(index_elements=['user_id', 'currency']),
+                [{"user_id": user_id, "currency": currency, "balance": Decimal('0')} for user_id, currency in provision]
+            )
+        else:
+            for user_id, currency in provision:
+                WalletService.get_or_create_wallet(user_id, currency)
+
+        stmt = (
+            select(Wallet)
+            .where(tuple_(Wallet.user_id, Wallet.currency).in_(list(keys)))
+            .order_by(Wallet.id)
+            .execution_options(populate_existing=True)
+        )
+        if WalletService._optimistic():
+            wallets = db.session.execute(stmt).scalars().all()
+        else:
+            started = time.perf_counter()
+            wallets = db.session.execute(stmt.with_for_update()).scalars().all()
+            WalletService._lock_metrics().record_wait(time.perf_counter() - started)
+
+        return {(wallet.user_id, wallet.currency): wallet for wallet in wallets}
+
+    @staticmethod
+    def _write_balances(wallets: Dict[Tuple[str, str], Wallet],
+                        balances: Dict[Tuple[str, str], Decimal]) -> Dict[Tuple[str, str], Tuple[Decimal, int]]:
+        """Persist new balances for wallets returned by ``_acquire_wallets``.
+
+        This is an ORM bulk UPDATE by primary key, so ``version_id_col`` makes
+        each row's UPDATE match the version that was read and bump it. Under
+        the optimistic strategy a concurrent write therefore raises
+        ``StaleDataError`` instead of being overwritten. Returns each wallet's
+        new balance and version.
+        """
+        now = datetime.now(timezone.utc)
+        db.session.execute(update(Wallet), [
+            {"id": wallets[key].id, "version": wallets[key].version, "balance": balance, "updated_at": now}
+            for key, balance in balances.items()
+        ])
+        return {key: (balance, wallets[key].version + 1) for key, balance in balances.items()}
+
+    @staticmethod
+    def _publish_writes(written: Dict[Tuple[str, str], Tuple[Decimal, int]]) -> None:
+        """Tell the balance cache and the read router about committed wallet writes."""
+        by_user: Dict[str, WalletBalances] = {}
+        for (user_id, currency), value in written.items():
+            by_user.setdefault(user_id, {})[currency] = value
+        cache = WalletService._balance_cache()
+        for user_id, balances in by_user.items():
+            cache.write_through(user_id, balances)
+        WalletService._read_router().record_write(*by_user)
+
+    @staticmethod
+    @_retry_on_conflict
     def fund_wallet(user_id: str, currency: str, amount: Decimal) -> Dict[str, Any]:
         if amount <= 0:
             raise ValueError("Amount must be greater than 0")
 
-        wallet = WalletService.get_or_create_wallet(user_id, currency)
-        wallet.balance += amount
+        balance, version = WalletService._credit_wallet(user_id, currency, amount)
 
         transaction = Transaction(
             user_id=user_id,  # type: ignore[call-arg]
@@ -31,25 +252,26 @@ class WalletService:
         )
 
         db.session.add(transaction)
-        db.session.commit()
-
-        return {
+        result = {
             "success": True,
             "message": f"Funded {amount} {currency}",
-            "balance": wallet.balance
+            "balance": balance
         }
+        IdempotencyService.record_response(user_id, result)
+        db.session.commit()
+        WalletService._publish_writes({(user_id, currency): (balance, version)})
+        return result
 
     @staticmethod
+    @_retry_on_conflict
     def withdraw_funds(user_id: str, currency: str, amount: Decimal) -> Dict[str, Any]:
         if amount <= 0:
             raise ValueError("Amount must be greater than 0")
 
-        wallet = WalletService.get_or_create_wallet(user_id, currency)
-
-        if wallet.balance < amount:
+        debited = WalletService._apply_balance_delta(user_id, currency, -amount)
+        if debited is None:
             raise ValueError("Insufficient funds")
-
-        wallet.balance -= amount
+        balance, version = debited
 
         transaction = Transaction(
             user_id=user_id,  # type: ignore[call-arg]
@@ -59,33 +281,58 @@ class WalletService:
         )
 
         db.session.add(transaction)
-        db.session.commit()
-
-        return {
+        result = {
             "success": True,
             "message": f"Withdrew {amount} {currency}",
-            "balance": wallet.balance
+            "balance": balance
         }
+        IdempotencyService.record_response(user_id, result)
+        db.session.commit()
+        WalletService._publish_writes({(user_id, currency): (balance, version)})
+        return result
 
     @staticmethod
-    def convert_currency(user_id: str, from_currency: str, to_currency: str, amount: Decimal) -> Dict[str, Any]:
+    def convert_currency(user_id: str, from_currency: str, to_currency: str, amount: Decimal,
+                         quote_id: Optional[str] = None) -> Dict[str, Any]:
+        """Convert between two wallets, at the locked rate of ``quote_id`` when given.
+
+        A quote is single-use and only valid for the user it was issued to. It
+        is deleted in the conversion's own transaction, so a conversion that
+        fails leaves it usable.
+        """
         if amount <= 0:
             raise ValueError("Amount must be greater than 0")
 
         if from_currency == to_currency:
             raise ValueError("Cannot convert to the same currency")
 
-        from_wallet = WalletService.get_or_create_wallet(user_id, from_currency)
-        to_wallet = WalletService.get_or_create_wallet(user_id, to_currency)
+        if quote_id is None:
+            return WalletService._convert(user_id, from_currency, to_currency, amount,
+                                          FxService.get_rate(from_currency, to_currency))
 
-        if from_wallet.balance < amount:
-            raise ValueError("Insufficient funds")
+        quote = FxService.get_quote(quote_id, user_id)
+        if (quote.from_currency, quote.to_currency) != (from_currency, to_currency):
+            raise ValueError("Quote does not match the requested currency pair")
+        return WalletService._convert(user_id, from_currency, to_currency, amount, quote.rate, quote)
 
-        fx_rate = FxService.get_rate(from_currency, to_currency)
+    @staticmethod
+    @_retry_on_conflict
+    def _convert(user_id: str, from_currency: str, to_currency: str, amount: Decimal, fx_rate: Decimal,
+                 quote: Optional[FxQuote] = None) -> Dict[str, Any]:
         converted_amount = (amount * fx_rate).quantize(Decimal('0.00000001'), rounding=ROUND_DOWN)
 
-        from_wallet.balance -= amount
-        to_wallet.balance += converted_amount
+        # Both wallets are acquired up front, in id order, so opposite conversions
+        # for the same user (USD->MXN against MXN->USD) cannot deadlock.
+        source_key, target_key = (user_id, from_currency), (user_id, to_currency)
+        wallets = WalletService._acquire_wallets({source_key, target_key})
+        if wallets[source_key].balance < amount:
+            db.session.rollback()
+            raise ValueError("Insufficient funds")
+
+        written = WalletService._write_balances(wallets, {
+            source_key: wallets[source_key].balance - amount,
+            target_key: wallets[target_key].balance + converted_amount
+        })
 
         out_transaction = Transaction(
             user_id=user_id,  # type: ignore[call-arg]
@@ -109,92 +356,385 @@ class WalletService:
 
         db.session.add(out_transaction)
         db.session.add(in_transaction)
-        db.session.commit()
-
-        return {
+        result = {
             "success": True,
             "message": f"Converted {amount} {from_currency} to {converted_amount} {to_currency}",
             "fx_rate": fx_rate,
             "converted_amount": converted_amount
         }
+        if quote is not None:
+            FxService.consume_quote(quote)
+            result["quote_id"] = quote.quote_id
+        IdempotencyService.record_response(user_id, result)
+        db.session.commit()
+        WalletService._publish_writes(written)
+        if quote is not None:
+            FxService._quote_store().discard(quote.quote_id)
+        return result
+
+    @staticmethod
+    @_retry_on_conflict
+    def apply_batch(operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Apply many fund/withdraw operations in a single transaction.
+
+        Each operation is a dict with ``user_id``, ``type`` (``fund`` or
+        ``withdraw``), ``currency`` and ``amount``. Operations are applied in
+        order against the locked wallet balances; one that cannot be applied is
+        reported and skipped without affecting the rest. The database sees a
+        fixed number of set-based statements regardless of batch size.
+        """
+        if not operations:
+            return []
+
+        keys = {(op['user_id'], op['currency']) for op in operations}
+        # Only a fund that will apply may create a wallet; a withdraw never does.
+        credited = {(op['user_id'], op['currency']) for op in operations if op['type'] != 'withdraw' and op['amount'] > 0}
+
+        wallets = WalletService._acquire_wallets(keys, provision=credited)
+        balances = {key: wallet.balance for key, wallet in wallets.items()}
+
+        results: List[Dict[str, Any]] = []
+        ledger: List[Dict[str, Any]] = []
+        touched = set()
+        for op in operations:
+            key = (op['user_id'], op['currency'])
+            amount = op['amount']
+            if amount <= 0:
+                results.append({"success": False, "error": "Amount must be greater than 0"})
+                continue
+
+            if op['type'] == 'withdraw':
+                if balances.get(key, Decimal('0')) < amount:
+                    results.append({"success": False, "error": "Insufficient funds"})
+                    continue
+                balances[key] -= amount
+                transaction_type = TransactionType.WITHDRAW
+            else:
+                balances[key] += amount
+                transaction_type = TransactionType.FUND
+
+            touched.add(key)
+            ledger.append({
+                "user_id": op['user_id'],
+                "transaction_type": transaction_type,
+                "currency": op['currency'],
+                "amount": amount
+            })
+            results.append({"success": True, "balance": balances[key]})
+
+        written: Dict[Tuple[str, str], Tuple[Decimal, int]] = {}
+        if touched:
+            written = WalletService._write_balances(wallets, {key: balances[key] for key in touched})
+            db.session.execute(insert(Transaction), ledger)
+        db.session.commit()
+        WalletService._publish_writes(written)
+
+        return results
+
+    @staticmethod
+    def balances_statement(user_id: str) -> Select:
+        return select(Wallet.currency, Wallet.balance, Wallet.version).where(Wallet.user_id == user_id)
+
+    @staticmethod
+    def balances_from_rows(rows: Iterable[Any]) -> Dict[str, float]:
+        return {row.currency: float(row.balance) for row in rows if row.balance > 0}
 
     @staticmethod
     def get_balances(user_id: str) -> Dict[str, float]:
-        wallets = Wallet.query.filter_by(user_id=user_id).all()
-        balances: Dict[str, float] = {}
+        cache = WalletService._balance_cache()
+        cached = cache.get(user_id)
+        if cached is not None:
+            return {currency: float(balance) for currency, (balance, _) in cached.items() if balance > 0}
 
-        for wallet in wallets:
-            if wallet.balance > 0:
-                balances[wallet.currency] = float(wallet.balance)
+        with WalletService._read_router().reading(user_id) as session:
+            rows = session.execute(WalletService.balances_statement(user_id)).all()
+        cache.fill(user_id, {row.currency: (row.balance, row.version) for row in rows})
+        return WalletService.balances_from_rows(rows)
 
-        return balances
+    @staticmethod
+    def _serialize_transaction(txn: Any) -> Dict[str, Any]:
+        return {
+            "id": txn.id,
+            "type": txn.transaction_type.value,
+            "currency": txn.currency,
+            "amount": float(txn.amount),
+            "from_currency": txn.from_currency,
+            "to_currency": txn.to_currency,
+            "fx_rate": float(txn.fx_rate) if txn.fx_rate else None,
+            "timestamp": txn.created_at.isoformat()
+        }
 
     @staticmethod
-    def get_transactions(user_id: str, limit: int = 100) -> List[Dict[str, Any]]:
-        transactions = Transaction.query.filter_by(user_id=user_id)\
-            .order_by(Transaction.created_at.desc())\
-            .limit(limit)\
-            .all()
-
-        result: List[Dict[str, Any]] = []
-        for txn in transactions:
-            result.append({
-                "id": txn.id,
-                "type": txn.transaction_type.value,
-                "currency": txn.currency,
-                "amount": float(txn.amount),
-                "from_currency": txn.from_currency,
-                "to_currency": txn.to_currency,
-                "fx_rate": float(txn.fx_rate) if txn.fx_rate else None,
-                "timestamp": txn.created_at.isoformat()
-            })
+    def _encode_cursor(txn: Transaction) -> str:
+        payload = json.dumps([txn.created_at.isoformat(), txn.id]).encode()
+        return base64.urlsafe_b64encode(payload).decode().rstrip('=')
 
-        return result
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+        try:
+            payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            created_at, txn_id = json.loads(payload)
+            return datetime.fromisoformat(created_at), int(txn_id)
+        except (ValueError, TypeError):
+            raise ValueError("Invalid cursor")
 
     @staticmethod
-    def reconcile_balances(user_id: str) -> Dict[str, Any]:
-        transactions = Transaction.query.filter_by(user_id=user_id).all()
-        calculated_balances: Dict[str, Decimal] = {}
+    def transactions_statement(user_id: str, limit: int, cursor: Optional[str] = None) -> Tuple[Select, int]:
+        """Build the keyset query for one history page and return it with the effective page size.
 
-        for txn in transactions:
-            currency = txn.currency
-            if currency not in calculated_balances:
-                calculated_balances[currency] = Decimal('0')
+        The statement selects one row more than the page so the caller can tell
+        whether another page follows; see ``transactions_page``.
+        """
+        if limit < 1:
+            raise ValueError("Limit must be greater than 0")
+        limit = min(limit, current_app.config['TRANSACTIONS_MAX_PAGE_SIZE'])
 
-            if txn.transaction_type == TransactionType.FUND:
-                calculated_balances[currency] += txn.amount
-            elif txn.transaction_type == TransactionType.WITHDRAW:
-                calculated_balances[currency] -= txn.amount
-            elif txn.transaction_type == TransactionType.CONVERT_IN:
-                calculated_balances[currency] += txn.amount
-            elif txn.transaction_type == TransactionType.CONVERT_OUT:
-                calculated_balances[currency] -= txn.amount
+        stmt = select(Transaction).where(Transaction.user_id == user_id)
+        if cursor is not None:
+            created_at, txn_id = WalletService._decode_cursor(cursor)
+            # The plain bound on created_at lets PostgreSQL prune later monthly
+            # partitions; it cannot prune on the row comparison alone.
+            stmt = stmt.where(Transaction.created_at <= created_at,
+                              tuple_(Transaction.created_at, Transaction.id) < tuple_(created_at, txn_id))
 
-        actual_balances: Dict[str, Decimal] = {}
-        wallets = Wallet.query.filter_by(user_id=user_id).all()
-        for wallet in wallets:
-            actual_balances[wallet.currency] = wallet.balance
+        stmt = stmt.order_by(Transaction.created_at.desc(), Transaction.id.desc()).limit(limit + 1)
+        return stmt, limit
+
+    @staticmethod
+    def transactions_page(transactions: List[Transaction], limit: int) -> Dict[str, Any]:
+        next_cursor: Optional[str] = None
+        if len(transactions) > limit:
+            transactions = transactions[:limit]
+            next_cursor = WalletService._encode_cursor(transactions[-1])
+
+        return {
+            "transactions": [WalletService._serialize_transaction(txn) for txn in transactions],
+            "next_cursor": next_cursor
+        }
+
+    @staticmethod
+    def get_transactions(user_id: str, limit: int = 100, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Return one page of a user's history, newest first.
+
+        Pages are keyed on ``(created_at, id)``: ``next_cursor`` encodes the last
+        row returned and the next page seeks past it on the
+        ``ix_transactions_user_id_created_at`` index, so every page costs the same
+        no matter how deep it is. ``next_cursor`` is ``None`` on the last page.
+        """
+        stmt, limit = WalletService.transactions_statement(user_id, limit, cursor)
+        with WalletService._read_router().reading(user_id) as session:
+            transactions = list(session.execute(stmt).scalars())
+            return WalletService.transactions_page(transactions, limit)
+
+    @staticmethod
+    def iter_transactions(user_id: str, start: Optional[datetime] = None,
+                          end: Optional[datetime] = None) -> Iterator[Dict[str, Any]]:
+        """Yield a user's full history, oldest first, within ``[start, end)``.
+
+        Rows are fetched through a server-side cursor in batches of
+        ``TRANSACTIONS_EXPORT_BATCH_SIZE`` and serialized one at a time, so memory
+        stays flat regardless of how long the history is. Archived months in
+        the range come first, streamed from the user's archive segments; they
+        are always older than anything left in ``transactions``.
+        """
+        archive = LedgerArchiveService._archive()
+        for month, buckets in LedgerArchiveService.archived_months():
+            if (end is not None and month >= end) or \
+                    (start is not None and LedgerPartitionService.add_months(month, 1) <= start):
+                continue
+            for archived in archive.read_user(month, buckets, user_id):
+                if (start is None or archived.created_at >= start) and (end is None or archived.created_at < end):
+                    yield WalletService._serialize_transaction(archived)
+
+        stmt = select(
+            Transaction.id, Transaction.transaction_type, Transaction.currency, Transaction.amount,
+            Transaction.from_currency, Transaction.to_currency, Transaction.fx_rate, Transaction.created_at
+        ).where(Transaction.user_id == user_id)
+        if start is not None:
+            stmt = stmt.where(Transaction.created_at >= start)
+        if end is not None:
+            stmt = stmt.where(Transaction.created_at < end)
+        stmt = stmt.order_by(Transaction.created_at, Transaction.id)\
+            .execution_options(yield_per=current_app.config['TRANSACTIONS_EXPORT_BATCH_SIZE'])
+
+        for row in db.session.execute(stmt):
+            yield WalletService._serialize_transaction(row)
+
+    @staticmethod
+    def _signed_amount() -> Any:
+        """SQL expression for a transaction's effect on its wallet balance."""
+        return case(
+            (Transaction.transaction_type.in_([TransactionType.FUND, TransactionType.CONVERT_IN]), Transaction.amount),
+            else_=-Transaction.amount
+        )
+
+    @staticmethod
+    def reconcile_balances(user_id: str, full: bool = False) -> Dict[str, Any]:
+        """Compare the ledger-derived balances with the stored wallet balances.
+
+        By default only transactions newer than the user's reconciliation
+        checkpoint are folded in; ``full=True`` replays the whole ledger and
+        rebuilds the checkpoint. The checkpoint only advances over transactions
+        older than ``RECONCILE_CHECKPOINT_SETTLE_SECONDS`` so that a lower id
+        still committing behind a newer one is never skipped.
+
+        All summing happens in SQL, so memory stays proportional to the number
+        of currencies rather than the number of ledger rows. Checkpoints are
+        read, advanced and written on the primary, so replica lag can never
+        make them skip a transaction. Only the final comparison runs on the
+        read replica when one is configured; while replica lag exceeds the
+        settle window it can report differences that clear once it catches up.
+        Rows in archived months are summed from their segments, which are only
+        opened when they hold ids past the checkpoint.
+        """
+        with WalletService._read_router().reading(user_id) as session:
+            return WalletService._reconcile(session, user_id, full)
+
+    @staticmethod
+    def _reconcile(session: Session, user_id: str, full: bool) -> Dict[str, Any]:
+        checkpoints: Dict[str, ReconciliationCheckpoint] = {
+            checkpoint.currency: checkpoint
+            for checkpoint in ReconciliationCheckpoint.query.filter_by(user_id=user_id).all()
+        }
+        checkpoint_ids = {checkpoint.last_transaction_id for checkpoint in checkpoints.values()}
+        if len(checkpoint_ids) > 1:
+            full = True
+        last_transaction_id = 0 if full or not checkpoint_ids else checkpoint_ids.pop()
+
+        base_balances, base_transaction_id = WalletService._advance_checkpoints(
+            user_id, checkpoints, last_transaction_id, full
+        )
+
+        amount_type = DECIMAL(20, 8)
+        zero = literal(Decimal('0'), amount_type)
+        parts = [
+            select(Transaction.currency.label('currency'),
+                   func.sum(WalletService._signed_amount()).label('calculated'),
+                   zero.label('actual'))
+            .where(Transaction.user_id == user_id, Transaction.id > base_transaction_id)
+            .group_by(Transaction.currency),
+            select(Wallet.currency, zero, Wallet.balance).where(Wallet.user_id == user_id)
+        ]
+        for currency, balance in base_balances.items():
+            parts.append(select(literal(currency, String(3)), literal(balance, amount_type), zero))
+        archived = signed_sums(LedgerArchiveService.iter_rows(session, [user_id], base_transaction_id))
+        for (_, currency), (amount, _) in archived.items():
+            parts.append(select(literal(currency, String(3)), literal(amount, amount_type), zero))
+        combined = union_all(*parts).subquery()
+        calculated = type_coerce(func.sum(combined.c.calculated), amount_type)
+        actual = type_coerce(func.sum(combined.c.actual), amount_type)
+        rows = session.execute(
+            select(combined.c.currency, calculated.label('calculated'), actual.label('actual'))
+            .group_by(combined.c.currency)
+            .having(func.round(func.sum(combined.c.actual) - func.sum(combined.c.calculated), 8) != 0)
+        ).all()
 
         discrepancies: Dict[str, Dict[str, float]] = {}
-        all_currencies = set(calculated_balances.keys()) | set(actual_balances.keys())
-
-        for currency in all_currencies:
-            calculated = calculated_balances.get(currency, Decimal('0'))
-            actual = actual_balances.get(currency, Decimal('0'))
-            if calculated != actual:
-                discrepancies[currency] = {
-                    "calculated": float(calculated),
-                    "actual": float(actual),
-                    "difference": float(actual - calculated)
-                }
+        for row in rows:
+            discrepancies[row.currency] = {
+                "calculated": float(row.calculated),
+                "actual": float(row.actual),
+                "difference": float(row.actual - row.calculated)
+            }
 
         return {
             "reconciled": len(discrepancies) == 0,
+            "mode": "full" if full else "incremental",
             "discrepancies": discrepancies
         }
 
+    @staticmethod
+    def _advance_checkpoints(user_id: str, checkpoints: Dict[str, ReconciliationCheckpoint],
+                             last_transaction_id: int, full: bool) -> Tuple[Dict[str, Decimal], int]:
+        """Fold settled transactions into the checkpoint, reading them from the primary.
+
+        Returns the checkpointed balances and the transaction id they cover, so
+        the caller only has to sum what lies beyond it.
+        """
+        settle_seconds = current_app.config['RECONCILE_CHECKPOINT_SETTLE_SECONDS']
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=settle_seconds)
+        first_unsettled_id = db.session.execute(
+            select(func.min(Transaction.id))
+            .where(Transaction.user_id == user_id, Transaction.id > last_transaction_id, Transaction.created_at > cutoff)
+        ).scalar()
+
+        stmt = select(
+            Transaction.currency,
+            type_coerce(func.sum(WalletService._signed_amount()), DECIMAL(20, 8)).label('delta'),
+            func.max(Transaction.id).label('last_id')
+        ).where(Transaction.user_id == user_id, Transaction.id > last_transaction_id)
+        if first_unsettled_id is not None:
+            stmt = stmt.where(Transaction.id < first_unsettled_id)
+        deltas = db.session.execute(stmt.group_by(Transaction.currency)).all()
+        archived = signed_sums(
+            row for row in LedgerArchiveService.iter_rows(db.session, [user_id], last_transaction_id)
+            if first_unsettled_id is None or row.id < first_unsettled_id
+        )
+
+        balances: Dict[str, Decimal] = {}
+        if not full:
+            for currency, checkpoint in checkpoints.items():
+                balances[currency] = checkpoint.calculated_balance
+        settled_transaction_id = last_transaction_id
+        for row in deltas:
+            balances[row.currency] = balances.get(row.currency, Decimal('0')) + row.delta
+            settled_transaction_id = max(settled_transaction_id, row.last_id)
+        for (_, currency), (delta, last_id) in archived.items():
+            balances[currency] = balances.get(currency, Decimal('0')) + delta
+            settled_transaction_id = max(settled_transaction_id, last_id)
+
+        if full or deltas or archived:
+            WalletService._save_checkpoints(user_id, checkpoints, balances, settled_transaction_id)
+        return balances, settled_transaction_id
+
+    @staticmethod
+    def _save_checkpoints(user_id: str, checkpoints: Dict[str, ReconciliationCheckpoint],
+                          balances: Dict[str, Decimal], last_transaction_id: int) -> None:
+        for currency, balance in balances.items():
+            checkpoint = checkpoints.get(currency)
+            if checkpoint is None:
+                checkpoint = ReconciliationCheckpoint(user_id=user_id, currency=currency)  # type: ignore[call-arg]
+                db.session.add(checkpoint)
+            checkpoint.calculated_balance = balance
+            checkpoint.last_transaction_id = last_transaction_id
+        for currency, checkpoint in checkpoints.items():
+            if currency not in balances:
+                db.session.delete(checkpoint)
+
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent reconcile wrote the same checkpoint; it is only an
+            # optimisation, so keep theirs.
+            db.session.rollback()
+
 class FxService:
 
+    @staticmethod
+    def _rate_cache() -> FxRateCache:
+        return current_app.extensions['fx_rate_cache']
+
+    @staticmethod
+    def _bump_rate_version() -> None:
+        # Runs inside the caller's transaction so the new version becomes visible
+        # to other workers together with the rates it describes.
+        result = cast(CursorResult[Any], db.session.execute(
+            update(FxRateVersion)
+            .where(FxRateVersion.id == 1)
+            .values(version=FxRateVersion.version + 1)
+        ))
+        if result.rowcount == 0:
+            db.session.add(FxRateVersion(id=1, version=1))  # type: ignore[call-arg]
+
+    @staticmethod
+    def _record_history(from_currency: str, to_currency: str, rate: Decimal, effective_at: datetime) -> None:
+        db.session.add(FxRateHistory(  # type: ignore[call-arg]
+            from_currency=from_currency,  # type: ignore[call-arg]
+            to_currency=to_currency,  # type: ignore[call-arg]
+            rate=rate,  # type: ignore[call-arg]
+            effective_at=effective_at  # type: ignore[call-arg]
+        ))
+
     @staticmethod
     def initialize_rates() -> None:
         rates = [
@@ -202,45 +742,926 @@ class FxService:
             ("MXN", "USD", Decimal('0.053')),
         ]
 
+        inserted = False
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
         for from_curr, to_curr, rate in rates:
             existing = FxRate.query.filter_by(from_currency=from_curr, to_currency=to_curr).first()
             if not existing:
                 fx_rate = FxRate(from_currency=from_curr, to_currency=to_curr, rate=rate)  # type: ignore[call-arg]
                 db.session.add(fx_rate)
+                FxService._record_history(from_curr, to_curr, rate, now)
+                inserted = True
+
+        if inserted:
+            FxService._bump_rate_version()
+        db.session.commit()
+        FxService._rate_cache().invalidate()
+
+    @staticmethod
+    def _quote_store() -> FxQuoteStore:
+        return current_app.extensions['fx_quote_store']
+
+    @staticmethod
+    def create_quote(user_id: str, from_currency: str, to_currency: str) -> FxQuote:
+        """Lock the current rate for a pair for ``FX_QUOTE_TTL`` seconds on behalf of ``user_id``.
 
+        The quote is written to ``fx_quotes`` so that any app process can honour
+        it; the user's expired quotes are cleared out in the same transaction.
+        """
+        if from_currency == to_currency:
+            raise ValueError("Cannot quote a conversion to the same currency")
+        quote = FxService._quote_store().issue(
+            user_id, from_currency, to_currency, FxService.get_rate(from_currency, to_currency)
+        )
+        db.session.execute(
+            delete(FxRateQuote).where(FxRateQuote.user_id == user_id,
+                                      FxRateQuote.expires_at <= datetime.now(timezone.utc).replace(tzinfo=None))
+        )
+        db.session.add(FxRateQuote(**quote._asdict()))
         db.session.commit()
+        return quote
+
+    @staticmethod
+    def get_quote(quote_id: str, user_id: str) -> FxQuote:
+        """Return a live quote issued to ``user_id``, from this process's store or ``fx_quotes``."""
+        quote = FxService._quote_store().get(quote_id)
+        if quote is None:
+            record = db.session.get(FxRateQuote, quote_id)
+            if record is not None and record.expires_at > datetime.now(timezone.utc).replace(tzinfo=None):
+                quote = FxQuote(record.quote_id, record.user_id, record.from_currency, record.to_currency,
+                                record.rate, record.expires_at)
+        if quote is None or quote.user_id != user_id:
+            raise ValueError("Quote not found or expired")
+        return quote
 
     @staticmethod
-    def get_rate(from_currency: str, to_currency: str) -> Decimal:
+    def consume_quote(quote: FxQuote) -> None:
+        """Delete ``quote`` in the caller's transaction, failing if it was used or expired meanwhile."""
+        result = cast(CursorResult[Any], db.session.execute(
+            delete(FxRateQuote)
+            .where(FxRateQuote.quote_id == quote.quote_id, FxRateQuote.user_id == quote.user_id,
+                   FxRateQuote.expires_at > datetime.now(timezone.utc).replace(tzinfo=None))
+            .execution_options(synchronize_session=False)
+        ))
+        if result.rowcount != 1:
+            db.session.rollback()
+            FxService._quote_store().discard(quote.quote_id)
+            raise ValueError("Quote not found or expired")
+
+    @staticmethod
+    def supported_currencies() -> FrozenSet[str]:
+        return FxService._rate_cache().currencies()
+
+    @staticmethod
+    def get_rate(from_currency: str, to_currency: str, at: Optional[datetime] = None) -> Decimal:
+        """Return the current rate, or with ``at`` the stored rate that was in effect then.
+
+        Point-in-time lookups read ``fx_rate_history`` and only cover stored pairs.
+        """
         if from_currency == to_currency:
             return Decimal('1')
 
-        fx_rate = FxRate.query.filter_by(from_currency=from_currency, to_currency=to_currency).first()
-        if not fx_rate:
-            raise ValueError(f"FX rate not found for {from_currency} to {to_currency}")
+        if at is None:
+            rate = FxService._rate_cache().get(from_currency, to_currency)
+            if rate is None:
+                raise ValueError(f"FX rate not found for {from_currency} to {to_currency}")
+            return rate
 
-        return fx_rate.rate
+        if at.tzinfo is not None:
+            at = at.astimezone(timezone.utc).replace(tzinfo=None)
+        rate = FxService._rate_cache().get_at(from_currency, to_currency, at)
+        if rate is None:
+            raise ValueError(f"FX rate not found for {from_currency} to {to_currency} at {at.isoformat()}")
+        return rate
 
     @staticmethod
     def update_rate(from_currency: str, to_currency: str, rate: Decimal) -> FxRate:
+        now = datetime.now(timezone.utc)
         fx_rate = FxRate.query.filter_by(from_currency=from_currency, to_currency=to_currency).first()
         if fx_rate:
             fx_rate.rate = rate
+            fx_rate.updated_at = now
         else:
             fx_rate = FxRate(from_currency=from_currency, to_currency=to_currency, rate=rate)  # type: ignore[call-arg]
             db.session.add(fx_rate)
 
+        FxService._record_history(from_currency, to_currency, rate, now.replace(tzinfo=None))
+        FxService._bump_rate_version()
         db.session.commit()
+        FxService._rate_cache().invalidate()
         return fx_rate
 
     @staticmethod
-    def get_all_rates() -> Dict[str, Dict[str, Any]]:
-        rates = FxRate.query.all()
+    def upsert_rates(rates: Dict[Tuple[str, str], Decimal]) -> int:
+        """Write a whole set of rates in one transaction and return how many were written.
+
+        On PostgreSQL and SQLite the pairs go out as a single multi-row
+        ``INSERT ... ON CONFLICT DO UPDATE`` and their history rows as one more
+        statement; the rate version is bumped once, so every cache refreshes
+        onto the complete set together.
+        """
+        if not rates:
+            return 0
+
+        now = datetime.now(timezone.utc)
+        rows = [
+            {"from_currency": from_currency, "to_currency": to_currency, "rate": rate,
+             "created_at": now, "updated_at": now}
+            for (from_currency, to_currency), rate in rates.items()
+        ]
+
+        insert_ = _dialect_insert(FxRate)
+        if insert_ is not None:
+            stmt = insert_.values(rows)
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=['from_currency', 'to_currency'],
+                set_={"rate": stmt.excluded.rate, "updated_at": stmt.excluded.updated_at}
+            ))
+        else:
+            existing = {
+                (fx_rate.from_currency, fx_rate.to_currency): fx_rate
+                for fx_rate in FxRate.query.filter(
+                    tuple_(FxRate.from_currency, FxRate.to_currency).in_(list(rates.keys()))
+                )
+            }
+            for (from_currency, to_currency), rate in rates.items():
+                fx_rate = existing.get((from_currency, to_currency))
+                if fx_rate:
+                    fx_rate.rate = rate
+                    fx_rate.updated_at = now
+                else:
+                    db.session.add(FxRate(from_currency=from_currency, to_currency=to_currency, rate=rate))  # type: ignore[call-arg]
+
+        effective_at = now.replace(tzinfo=None)
+        db.session.execute(insert(FxRateHistory), [
+            {"from_currency": from_currency, "to_currency": to_currency, "rate": rate, "effective_at": effective_at}
+            for (from_currency, to_currency), rate in rates.items()
+        ])
+        FxService._bump_rate_version()
+        db.session.commit()
+        FxService._rate_cache().invalidate()
+        return len(rates)
+
+    @staticmethod
+    def rates_statement() -> Select:
+        return select(FxRate.from_currency, FxRate.to_currency, FxRate.rate, FxRate.updated_at)
+
+    @staticmethod
+    def rates_from_rows(rows: Iterable[Any]) -> Dict[str, Dict[str, Any]]:
         result: Dict[str, Dict[str, Any]] = {}
-        for rate in rates:
-            pair = f"{rate.from_currency}/{rate.to_currency}"
+        for row in rows:
+            pair = f"{row.from_currency}/{row.to_currency}"
             result[pair] = {
-                "rate": float(rate.rate),
-                "updated_at": rate.created_at.isoformat()
+                "rate": float(row.rate),
+                "updated_at": row.updated_at.isoformat()
             }
         return result
+
+    @staticmethod
+    def get_all_rates() -> Dict[str, Dict[str, Any]]:
+        with WalletService._read_router().reading() as session:
+            return FxService.rates_from_rows(session.execute(FxService.rates_statement()))
+
+def _init_reconcile_worker(database_uri: str, archive_dir: str) -> None:
+    # Each pool process gets its own app, engine and connection pool.
+    from app import create_app
+    create_app({'SQLALCHEMY_DATABASE_URI': database_uri, 'LEDGER_ARCHIVE_DIR': archive_dir}).app_context().push()
+
+def _reconcile_shard_worker(shard: Tuple[int, str, str], full: bool) -> Tuple[int, List[Dict[str, str]]]:
+    index, first_user_id, last_user_id = shard
+    return index, ReconciliationService.reconcile_shard(first_user_id, last_user_id, full)
+
+class ReconciliationService:
+
+    REPORT_FIELDS = ["user_id", "currency", "calculated", "actual", "difference"]
+
+    @staticmethod
+    def plan_shards(shard_size: int) -> List[Tuple[str, str]]:
+        """Split the user-id space into inclusive ``(first, last)`` ranges of ``shard_size`` users."""
+        if shard_size < 1:
+            raise ValueError("Shard size must be at least 1")
+
+        shards: List[Tuple[str, str]] = []
+        first_user_id: Optional[str] = None
+        count = 0
+        last_user_id = ''
+        user_ids = db.session.execute(
+            select(Wallet.user_id).distinct().order_by(Wallet.user_id).execution_options(yield_per=shard_size)
+        ).scalars()
+        for user_id in user_ids:
+            if first_user_id is None:
+                first_user_id = user_id
+            last_user_id = user_id
+            count += 1
+            if count == shard_size:
+                shards.append((first_user_id, last_user_id))
+                first_user_id = None
+                count = 0
+        if first_user_id is not None:
+            shards.append((first_user_id, last_user_id))
+        return shards
+
+    @staticmethod
+    def reconcile_shard(first_user_id: str, last_user_id: str, full: bool = False) -> List[Dict[str, str]]:
+        """Return every (user, currency) discrepancy for users in ``[first_user_id, last_user_id]``.
+
+        Uses the same signed-sum aggregation as ``WalletService.reconcile_balances``
+        but grouped by user as well, so a whole shard is one statement. Unless
+        ``full`` is set, each wallet starts from its reconciliation checkpoint.
+        The sweep is read-only and never advances checkpoints, so it runs on the
+        read replica when one is configured. Once months have been archived,
+        the shard's archived rows are added to the ledger sums in Python before
+        discrepancies are picked out.
+        """
+        amount_type = DECIMAL(20, 8)
+        zero = literal(Decimal('0'), amount_type)
+
+        ledger = select(
+            Transaction.user_id.label('user_id'),
+            Transaction.currency.label('currency'),
+            func.sum(WalletService._signed_amount()).label('calculated'),
+            zero.label('actual')
+        ).where(Transaction.user_id.between(first_user_id, last_user_id))
+        if not full:
+            ledger = ledger.outerjoin(
+                ReconciliationCheckpoint,
+                (ReconciliationCheckpoint.user_id == Transaction.user_id)
+                & (ReconciliationCheckpoint.currency == Transaction.currency)
+            ).where(Transaction.id > func.coalesce(ReconciliationCheckpoint.last_transaction_id, 0))
+        parts = [
+            ledger.group_by(Transaction.user_id, Transaction.currency),
+            select(Wallet.user_id, Wallet.currency, zero, Wallet.balance)
+            .where(Wallet.user_id.between(first_user_id, last_user_id))
+        ]
+        if not full:
+            parts.append(
+                select(ReconciliationCheckpoint.user_id, ReconciliationCheckpoint.currency,
+                       ReconciliationCheckpoint.calculated_balance, zero)
+                .where(ReconciliationCheckpoint.user_id.between(first_user_id, last_user_id))
+            )
+
+        combined = union_all(*parts).subquery()
+        calculated = type_coerce(func.sum(combined.c.calculated), amount_type)
+        actual = type_coerce(func.sum(combined.c.actual), amount_type)
+        stmt = select(combined.c.user_id, combined.c.currency, calculated.label('calculated'), actual.label('actual'))\
+            .group_by(combined.c.user_id, combined.c.currency)\
+            .order_by(combined.c.user_id, combined.c.currency)
+        with WalletService._read_router().reading() as session:
+            if not LedgerArchiveService.archived_months(session):
+                rows = session.execute(
+                    stmt.having(func.round(func.sum(combined.c.actual) - func.sum(combined.c.calculated), 8) != 0)
+                ).all()
+            else:
+                rows = ReconciliationService._add_archived(
+                    session, session.execute(stmt).all(), first_user_id, last_user_id, full
+                )
+
+        return [
+            {
+                "user_id": row[0],
+                "currency": row[1],
+                "calculated": str(row[2]),
+                "actual": str(row[3]),
+                "difference": str(row[3] - row[2])
+            }
+            for row in rows
+        ]
+
+    @staticmethod
+    def _add_archived(session: Union[Session, scoped_session], rows: Sequence[Any], first_user_id: str, last_user_id: str,
+                      full: bool) -> List[Tuple[str, str, Decimal, Decimal]]:
+        """Fold a shard's archived rows into its per-wallet sums and keep the mismatches.
+
+        Archived rows are looked up by the user ids the shard query returned
+        rather than by ``[first_user_id, last_user_id]``, whose bounds follow
+        the database collation and not segment order.
+        """
+        user_ids = {row.user_id for row in rows}
+        after_ids: Dict[Tuple[str, str], int] = {}
+        if not full:
+            after_ids = {
+                (user_id, currency): last_transaction_id
+                for user_id, currency, last_transaction_id in session.execute(
+                    select(ReconciliationCheckpoint.user_id, ReconciliationCheckpoint.currency,
+                           ReconciliationCheckpoint.last_transaction_id)
+                    .where(ReconciliationCheckpoint.user_id.between(first_user_id, last_user_id))
+                )
+            }
+        archived = signed_sums(
+            row for row in LedgerArchiveService.iter_rows(session, user_ids)
+            if row.id > after_ids.get((row.user_id, row.currency), 0)
+        )
+
+        totals: Dict[Tuple[str, str], List[Decimal]] = {
+            (row.user_id, row.currency): [row.calculated, row.actual] for row in rows
+        }
+        for key, (amount, _) in archived.items():
+            totals.setdefault(key, [Decimal('0'), Decimal('0')])[0] += amount
+        return [
+            (user_id, currency, calculated, actual)
+            for (user_id, currency), (calculated, actual) in sorted(totals.items())
+            if round(actual - calculated, 8) != 0
+        ]
+
+    @staticmethod
+    def reconcile_all(output_path: str, report_format: str = 'jsonl', shard_size: int = 1000,
+                      workers: int = 1, full: bool = False, resume: bool = False) -> Dict[str, int]:
+        """Reconcile every wallet and stream discrepancies to ``output_path``.
+
+        Shards run in a process pool when ``workers > 1``. Progress is recorded in
+        ``<output_path>.progress`` (the shard plan followed by one line per finished
+        shard), so an interrupted sweep restarted with ``resume=True`` reuses the
+        same plan and only runs the shards that did not finish.
+        """
+        if report_format not in ('jsonl', 'csv'):
+            raise ValueError("Report format must be 'jsonl' or 'csv'")
+
+        progress_path = f"{output_path}.progress"
+        completed: set = set()
+        if resume and os.path.exists(progress_path):
+            with open(progress_path) as progress_file:
+                shards = [tuple(shard) for shard in json.loads(progress_file.readline())['shards']]
+                for line in progress_file:
+                    completed.add(json.loads(line)['done'])
+        else:
+            resume = False
+            shards = ReconciliationService.plan_shards(shard_size)
+            with open(progress_path, 'w') as progress_file:
+                progress_file.write(json.dumps({"shards": shards}) + "\n")
+
+        pending = [(index, first, last) for index, (first, last) in enumerate(shards) if index not in completed]
+        discrepancy_count = 0
+
+        with open(output_path, 'a' if resume else 'w', newline='') as report, \
+                open(progress_path, 'a') as progress_file:
+            writer = csv.DictWriter(report, fieldnames=ReconciliationService.REPORT_FIELDS)
+            if report_format == 'csv' and not resume:
+                writer.writeheader()
+
+            def record(index: int, rows: List[Dict[str, str]]) -> None:
+                for row in rows:
+                    if report_format == 'csv':
+                        writer.writerow(row)
+                    else:
+                        report.write(json.dumps(row) + "\n")
+                report.flush()
+                progress_file.write(json.dumps({"done": index}) + "\n")
+                progress_file.flush()
+
+            if workers > 1 and len(pending) > 1:
+                database_uri = current_app.config['SQLALCHEMY_DATABASE_URI']
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_reconcile_worker,
+                                         initargs=(database_uri, current_app.config['LEDGER_ARCHIVE_DIR'])) as pool:
+                    futures = [pool.submit(_reconcile_shard_worker, shard, full) for shard in pending]
+                    for future in as_completed(futures):
+                        index, rows = future.result()
+                        record(index, rows)
+                        discrepancy_count += len(rows)
+            else:
+                for shard in pending:
+                    index, rows = _reconcile_shard_worker(shard, full)
+                    record(index, rows)
+                    discrepancy_count += len(rows)
+
+        return {
+            "shards": len(shards),
+            "skipped_shards": len(shards) - len(pending),
+            "discrepancies": discrepancy_count
+        }
+
+class SnapshotService:
+
+    @staticmethod
+    def build_snapshots(as_of: Optional[datetime] = None) -> int:
+        """Materialize every wallet's ledger balance as of ``as_of``.
+
+        Each batch is the previous batch plus the transactions between the two
+        timestamps, written with a single ``INSERT ... SELECT``, so a run only
+        scans the ledger written since the last one. Returns the number of rows
+        written.
+
+        A transaction stamped before ``as_of`` but committed after the batch is
+        read would be missed by every later batch too, so ``as_of`` must be at
+        least ``SNAPSHOT_SETTLE_SECONDS`` in the past; it defaults to exactly
+        that.
+
+        When the batch spans archived months, their rows are summed from the
+        archive segments and the batch is written from Python instead.
+        """
+        settled = datetime.now(timezone.utc).replace(tzinfo=None) \
+            - timedelta(seconds=current_app.config['SNAPSHOT_SETTLE_SECONDS'])
+        if as_of is None:
+            as_of = settled
+        elif as_of > settled:
+            raise ValueError("Snapshots must be at least SNAPSHOT_SETTLE_SECONDS in the past")
+
+        existing = db.session.execute(
+            select(WalletBalanceSnapshot.id).where(WalletBalanceSnapshot.as_of == as_of).limit(1)
+        ).first()
+        if existing is not None:
+            raise ValueError(f"Snapshots already exist as of {as_of.isoformat()}")
+
+        previous_as_of = db.session.execute(
+            select(func.max(WalletBalanceSnapshot.as_of)).where(WalletBalanceSnapshot.as_of < as_of)
+        ).scalar()
+
+        ledger = select(
+            Transaction.user_id.label('user_id'),
+            Transaction.currency.label('currency'),
+            func.sum(WalletService._signed_amount()).label('balance')
+        ).where(Transaction.created_at <= as_of)
+        parts = []
+        if previous_as_of is not None:
+            ledger = ledger.where(Transaction.created_at > previous_as_of)
+            parts.append(
+                select(WalletBalanceSnapshot.user_id, WalletBalanceSnapshot.currency, WalletBalanceSnapshot.balance)
+                .where(WalletBalanceSnapshot.as_of == previous_as_of)
+            )
+        parts.append(ledger.group_by(Transaction.user_id, Transaction.currency))
+
+        combined = union_all(*parts).subquery()
+        balances = select(
+            combined.c.user_id,
+            combined.c.currency,
+            type_coerce(func.sum(combined.c.balance), DECIMAL(20, 8))
+        ).group_by(combined.c.user_id, combined.c.currency)
+        archived = LedgerArchiveService.archived_sums(previous_as_of, as_of)
+        if not archived:
+            row_count = cast(CursorResult[Any], db.session.execute(
+                insert(WalletBalanceSnapshot).from_select(
+                    ['user_id', 'currency', 'balance', 'as_of'],
+                    balances.add_columns(literal(as_of, DateTime()))
+                )
+            )).rowcount
+        else:
+            totals = {(user_id, currency): balance for user_id, currency, balance in db.session.execute(balances)}
+            for key, amount in archived.items():
+                totals[key] = totals.get(key, Decimal('0')) + amount
+            db.session.execute(insert(WalletBalanceSnapshot), [
+                {"user_id": user_id, "currency": currency, "balance": balance, "as_of": as_of}
+                for (user_id, currency), balance in totals.items()
+            ])
+            row_count = len(totals)
+        db.session.commit()
+        return row_count
+
+    @staticmethod
+    def get_balances_as_of(user_id: str, as_of: datetime) -> Dict[str, float]:
+        """Return the user's balances as they stood at ``as_of``.
+
+        Starts from the user's latest snapshot at or before ``as_of`` and replays
+        only the transactions after it, so the work is bounded by the snapshot
+        cadence instead of the length of the ledger. Archived rows in that
+        window are read back from the user's segments.
+        """
+        snapshot_as_of = db.session.execute(
+            select(func.max(WalletBalanceSnapshot.as_of))
+            .where(WalletBalanceSnapshot.user_id == user_id, WalletBalanceSnapshot.as_of <= as_of)
+        ).scalar()
+
+        ledger = select(
+            Transaction.currency.label('currency'),
+            func.sum(WalletService._signed_amount()).label('balance')
+        ).where(Transaction.user_id == user_id, Transaction.created_at <= as_of)
+        parts = []
+        if snapshot_as_of is not None:
+            ledger = ledger.where(Transaction.created_at > snapshot_as_of)
+            parts.append(
+                select(WalletBalanceSnapshot.currency, WalletBalanceSnapshot.balance)
+                .where(WalletBalanceSnapshot.user_id == user_id, WalletBalanceSnapshot.as_of == snapshot_as_of)
+            )
+        parts.append(ledger.group_by(Transaction.currency))
+        for (_, currency), amount in LedgerArchiveService.archived_sums(snapshot_as_of, as_of, user_id).items():
+            parts.append(select(literal(currency, String(3)), literal(amount, DECIMAL(20, 8))))
+
+        combined = union_all(*parts).subquery()
+        rows = db.session.execute(
+            select(combined.c.currency, type_coerce(func.sum(combined.c.balance), DECIMAL(20, 8)).label('balance'))
+            .group_by(combined.c.currency)
+        ).all()
+
+        balances: Dict[str, float] = {}
+        for row in rows:
+            if row.balance > 0:
+                balances[row.currency] = float(row.balance)
+
+        return balances
+
+_PARTITION_BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+_SQL_IDENTIFIER = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+class LedgerPartitionService:
+    """Monthly range partitions of ``transactions`` by ``created_at`` on PostgreSQL.
+
+    Partitions are named ``transactions_yYYYYmMM`` and cover one calendar month
+    of naive UTC timestamps; ``transactions_default`` catches anything outside
+    them. On any other backend the table is not partitioned and every method
+    here is a no-op.
+    """
+
+    PARENT = 'transactions'
+
+    @staticmethod
+    def is_partitioned() -> bool:
+        if db.engine.dialect.name != 'postgresql':
+            return False
+        return bool(db.session.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:parent))"
+        ), {"parent": LedgerPartitionService.PARENT}).scalar())
+
+    @staticmethod
+    def add_months(month: datetime, months: int) -> datetime:
+        index = month.year * 12 + month.month - 1 + months
+        return datetime(index // 12, index % 12 + 1, 1)
+
+    @staticmethod
+    def partition_name(month: datetime) -> str:
+        return f"{LedgerPartitionService.PARENT}_y{month.year:04d}m{month.month:02d}"
+
+    @staticmethod
+    def parse_bound(expression: str) -> Optional[Tuple[datetime, datetime]]:
+        """``(start, end)`` of a ``pg_get_expr(relpartbound)`` range, or ``None`` for ``DEFAULT``."""
+        match = _PARTITION_BOUND.search(expression)
+        if match is None:
+            return None
+        return datetime.fromisoformat(match.group(1)), datetime.fromisoformat(match.group(2))
+
+    @staticmethod
+    def list_partitions() -> List[Tuple[str, datetime, datetime]]:
+        """Monthly partitions as ``(name, start, end)``, oldest first."""
+        if not LedgerPartitionService.is_partitioned():
+            return []
+        rows = db.session.execute(text(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(:parent)"
+        ), {"parent": LedgerPartitionService.PARENT}).all()
+        partitions = []
+        for name, expression in rows:
+            bound = LedgerPartitionService.parse_bound(expression)
+            if bound is not None:
+                partitions.append((name, bound[0], bound[1]))
+        return sorted(partitions, key=lambda partition: partition[1])
+
+    @staticmethod
+    def ensure_partitions(months_ahead: int, now: Optional[datetime] = None) -> List[str]:
+        """Create any missing partitions from the current month to ``months_ahead`` months out."""
+        if not LedgerPartitionService.is_partitioned():
+            return []
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        current = datetime(now.year, now.month, 1)
+        existing = {name for name, _, _ in LedgerPartitionService.list_partitions()}
+
+        created: List[str] = []
+        for offset in range(months_ahead + 1):
+            month = LedgerPartitionService.add_months(current, offset)
+            name = LedgerPartitionService.partition_name(month)
+            if name in existing:
+                continue
+            following = LedgerPartitionService.add_months(month, 1)
+            try:
+                db.session.execute(text(
+                    f"CREATE TABLE {name} PARTITION OF {LedgerPartitionService.PARENT} "
+                    f"FOR VALUES FROM ('{month.isoformat(' ')}') TO ('{following.isoformat(' ')}')"
+                ))
+                db.session.commit()
+            except DBAPIError as e:
+                db.session.rollback()
+                # Fails when the default partition already holds rows for this month.
+                raise ValueError(f"Could not create partition {name}: {e.orig}")
+            created.append(name)
+        return created
+
+    @staticmethod
+    def detach_partitions(before: datetime, archive_schema: Optional[str] = None,
+                          force: bool = False) -> List[str]:
+        """Detach every monthly partition that ends on or before ``before``.
+
+        Detached rows no longer take part in ``get_transactions`` or
+        ``reconcile_balances``, so unless ``force`` is set a partition is only
+        detached once reconciliation checkpoints cover all of its rows. With
+        ``archive_schema`` the detached tables are moved into that schema;
+        otherwise they stay next to ``transactions`` under their own names.
+        """
+        if archive_schema is not None and not _SQL_IDENTIFIER.match(archive_schema):
+            raise ValueError("Archive schema must be a lowercase SQL identifier")
+        if not LedgerPartitionService.is_partitioned():
+            return []
+
+        detached: List[str] = []
+        for name, _, end in LedgerPartitionService.list_partitions():
+            if end > before:
+                continue
+            if not force:
+                uncovered = db.session.execute(text(
+                    f"SELECT EXISTS (SELECT 1 FROM {name} t LEFT JOIN reconciliation_checkpoints c "
+                    "ON c.user_id = t.user_id AND c.currency = t.currency "
+                    "WHERE c.last_transaction_id IS NULL OR t.id > c.last_transaction_id)"
+                )).scalar()
+                if uncovered:
+                    db.session.rollback()
+                    raise ValueError(f"Partition {name} has transactions not covered by reconciliation checkpoints")
+            db.session.execute(text(f"ALTER TABLE {LedgerPartitionService.PARENT} DETACH PARTITION {name}"))
+            if archive_schema is not None:
+                db.session.execute(text(f"CREATE SCHEMA IF NOT EXISTS {archive_schema}"))
+                db.session.execute(text(f"ALTER TABLE {name} SET SCHEMA {archive_schema}"))
+            db.session.commit()
+            detached.append(name)
+        return detached
+
+class LedgerArchiveService:
+    """Moves whole months of old ledger rows out of ``transactions`` into ``LedgerArchive`` segments.
+
+    A month is archived in one step: its rows are written to segment files,
+    then deleted from ``transactions`` in the same database transaction that
+    records the month in ``ledger_archive_months``, so every reader sees each
+    row either in the table or in the archive. ``reconcile_balances``, the
+    reconciliation sweep, the history export and balance snapshots read
+    archived rows back transparently; paged history only covers rows still in
+    the table.
+    """
+
+    @staticmethod
+    def _archive() -> LedgerArchive:
+        return current_app.extensions['ledger_archive']
+
+    @staticmethod
+    def archived_months(session: Optional[Union[Session, scoped_session]] = None,
+                        after_id: int = 0) -> Sequence[Any]:
+        """``(month, user_buckets)`` of archived months holding ids above ``after_id``, oldest first."""
+        session = session or db.session
+        return session.execute(
+            select(LedgerArchiveMonth.month, LedgerArchiveMonth.user_buckets)
+            .where(LedgerArchiveMonth.max_transaction_id > after_id)
+            .order_by(LedgerArchiveMonth.month)
+        ).all()
+
+    @staticmethod
+    def archive_months(older_than_months: int, now: Optional[datetime] = None) -> List[LedgerArchiveMonth]:
+        """Archive every month that ended at least ``older_than_months`` months before ``now``."""
+        if older_than_months < 1:
+            raise ValueError("Archive age must be at least 1 month")
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        cutoff = LedgerPartitionService.add_months(datetime(now.year, now.month, 1), -older_than_months)
+        oldest = db.session.execute(
+            select(func.min(Transaction.created_at)).where(Transaction.created_at < cutoff)
+        ).scalar()
+        if oldest is None:
+            return []
+
+        archived: List[LedgerArchiveMonth] = []
+        month = datetime(oldest.year, oldest.month, 1)
+        while month < cutoff:
+            following = LedgerPartitionService.add_months(month, 1)
+            result = LedgerArchiveService._archive_month(month, following)
+            if result is not None:
+                archived.append(result)
+            month = following
+        return archived
+
+    @staticmethod
+    def _archive_month(month: datetime, following: datetime) -> Optional[LedgerArchiveMonth]:
+        in_month = (Transaction.created_at >= month, Transaction.created_at < following)
+        max_transaction_id = db.session.execute(select(func.max(Transaction.id)).where(*in_month)).scalar()
+        if max_transaction_id is None:
+            return None
+        if db.session.get(LedgerArchiveMonth, month) is not None:
+            db.session.rollback()
+            raise ValueError(f"{month:%Y-%m} is already archived but transactions still holds rows for it")
+
+        buckets = current_app.config['LEDGER_ARCHIVE_USER_BUCKETS']
+        rows = db.session.execute(
+            select(
+                Transaction.id, Transaction.user_id, Transaction.transaction_type, Transaction.currency,
+                Transaction.amount, Transaction.from_currency, Transaction.to_currency, Transaction.fx_rate,
+                Transaction.created_at
+            ).where(*in_month)
+            .order_by(LedgerArchiveService._codepoint_order(Transaction.user_id), Transaction.created_at, Transaction.id)
+            .execution_options(yield_per=current_app.config['TRANSACTIONS_EXPORT_BATCH_SIZE'])
+        )
+        row_count = LedgerArchiveService._archive().write_month(month, buckets, rows)
+
+        deleted = cast(CursorResult[Any], db.session.execute(
+            delete(Transaction).where(*in_month).execution_options(synchronize_session=False)
+        )).rowcount
+        if deleted != row_count:
+            db.session.rollback()
+            raise ValueError(f"Transactions for {month:%Y-%m} changed while archiving; run it again")
+        archive_month = LedgerArchiveMonth(
+            month=month,  # type: ignore[call-arg]
+            user_buckets=buckets,  # type: ignore[call-arg]
+            row_count=row_count,  # type: ignore[call-arg]
+            max_transaction_id=max_transaction_id  # type: ignore[call-arg]
+        )
+        db.session.add(archive_month)
+        db.session.commit()
+        return archive_month
+
+    @staticmethod
+    def _codepoint_order(column: Any) -> Any:
+        """``column`` compared by codepoint, the order segments are written and read in.
+
+        SQLite already compares text that way; PostgreSQL columns usually carry
+        a locale collation that, for instance, sorts ``Bob`` after ``alice``.
+        """
+        if db.engine.dialect.name == 'postgresql':
+            return column.collate('C')
+        return column
+
+    @staticmethod
+    def archived_sums(start: Optional[datetime], end: datetime,
+                      user_id: Optional[str] = None) -> Dict[Tuple[str, str], Decimal]:
+        """Balance effect per ``(user_id, currency)`` of archived rows stamped in ``(start, end]``.
+
+        Only ``user_id``'s segments are read when it is given. Months entirely
+        outside the window are skipped without opening their segments.
+        """
+        archive = LedgerArchiveService._archive()
+
+        def rows() -> Iterator[ArchivedTransaction]:
+            for month, buckets in LedgerArchiveService.archived_months():
+                if month > end or (start is not None and LedgerPartitionService.add_months(month, 1) <= start):
+                    continue
+                source = archive.read_month(month, buckets) if user_id is None \
+                    else archive.read_user(month, buckets, user_id)
+                for row in source:
+                    if row.created_at <= end and (start is None or row.created_at > start):
+                        yield row
+
+        return {key: amount for key, (amount, _) in signed_sums(rows()).items()}
+
+    @staticmethod
+    def iter_rows(session: Union[Session, scoped_session], user_ids: Iterable[str],
+                  after_id: int = 0) -> Iterator[ArchivedTransaction]:
+        """Archived rows of exactly ``user_ids`` with ids above ``after_id``.
+
+        Months whose rows all lie at or below ``after_id`` are skipped without
+        opening their segments. Each segment is read once, over the codepoint
+        range its wanted users span, so callers never have to translate a
+        database-collated user range into segment order. Rows come out month
+        by month; within a month each user's rows are oldest first.
+        """
+        wanted = set(user_ids)
+        if not wanted:
+            return
+        archive = LedgerArchiveService._archive()
+        for month, buckets in LedgerArchiveService.archived_months(session, after_id):
+            by_bucket: Dict[int, List[str]] = {}
+            for user_id in wanted:
+                by_bucket.setdefault(archive.bucket_for(user_id, buckets), []).append(user_id)
+            for bucket, bucket_user_ids in sorted(by_bucket.items()):
+                for row in archive.read_range(month, bucket, min(bucket_user_ids), max(bucket_user_ids)):
+                    if row.user_id in wanted and row.id > after_id:
+                        yield row
+
+class IdempotencyClaim(NamedTuple):
+    """A request's hold on an Idempotency-Key; ``claimed_at`` tells it apart from a later takeover."""
+    user_id: str
+    key: str
+    request_hash: str
+    claimed_at: datetime
+
+class IdempotencyKeyInUse(Exception):
+    """The key belongs to a request that is still being processed."""
+
+class IdempotencyKeyMismatch(Exception):
+    """The key was already used with a different request."""
+
+class IdempotencyService:
+
+    @staticmethod
+    def _cache() -> IdempotencyCache:
+        return current_app.extensions['idempotency_cache']
+
+    @staticmethod
+    def reserve(user_id: str, key: str, request_hash: str) -> Optional[StoredResponse]:
+        """Return the stored response for a replayed key, or claim the key.
+
+        When ``None`` is returned the caller owns the key: the claim is kept on
+        ``g.idempotency_claim`` for ``record_response``, and the caller must
+        finish with ``complete`` or ``release``. The claim is committed straight
+        away so that concurrent retries see it, and it lapses after
+        ``IDEMPOTENCY_LOCK_TIMEOUT`` seconds if its owner never finishes.
+        """
+        stored = IdempotencyService._cache().get(user_id, key)
+        if stored is None:
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            lease = now + timedelta(seconds=current_app.config['IDEMPOTENCY_LOCK_TIMEOUT'])
+            if IdempotencyService._claim(user_id, key, request_hash, now, lease):
+                db.session.commit()
+                g.idempotency_claim = IdempotencyClaim(user_id, key, request_hash, now)
+                return None
+
+            record = db.session.execute(
+                select(IdempotencyKey).where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+            ).scalar_one()
+            if record.request_hash != request_hash:
+                raise IdempotencyKeyMismatch()
+            if record.status_code is None:
+                raise IdempotencyKeyInUse()
+            stored = StoredResponse(record.request_hash, record.status_code, record.response_body or '', record.expires_at)
+            IdempotencyService._cache().put(user_id, key, stored)
+
+        if stored.request_hash != request_hash:
+            raise IdempotencyKeyMismatch()
+        return stored
+
+    @staticmethod
+    def _claim(user_id: str, key: str, request_hash: str, now: datetime, lease: datetime) -> bool:
+        values = dict(user_id=user_id, key=key, request_hash=request_hash, created_at=now, expires_at=lease)
+        insert_ = _dialect_insert(IdempotencyKey)
+        if insert_ is not None:
+            stmt = insert_.values(**values).on_conflict_do_nothing(index_elements=['user_id', 'key'])
+            if db.session.execute(stmt.returning(IdempotencyKey.id)).scalar() is not None:
+                return True
+        else:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(IdempotencyKey(**values))  # type: ignore[arg-type]
+                return True
+            except IntegrityError:
+                pass
+
+        # Take over a key whose response has expired or whose claim has lapsed.
+        result = cast(CursorResult[Any], db.session.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key, IdempotencyKey.expires_at <= now)
+            .values(request_hash=request_hash, status_code=None, response_body=None, created_at=now, expires_at=lease)
+        ))
+        return result.rowcount == 1
+
+    @staticmethod
+    def _owned(claim: IdempotencyClaim) -> Any:
+        """Match the key only while it is still unfinished and held by ``claim``."""
+        return (
+            (IdempotencyKey.user_id == claim.user_id) & (IdempotencyKey.key == claim.key)
+            & (IdempotencyKey.request_hash == claim.request_hash) & IdempotencyKey.status_code.is_(None)
+            & (IdempotencyKey.created_at == claim.claimed_at)
+        )
+
+    @staticmethod
+    def _store(claim: IdempotencyClaim, status_code: int, body: str) -> Optional[StoredResponse]:
+        expires_at = datetime.now(timezone.utc).replace(tzinfo=None) \
+            + timedelta(seconds=current_app.config['IDEMPOTENCY_KEY_TTL'])
+        result = cast(CursorResult[Any], db.session.execute(
+            update(IdempotencyKey).where(IdempotencyService._owned(claim))
+            .values(status_code=status_code, response_body=body, expires_at=expires_at)
+        ))
+        if result.rowcount != 1:
+            return None
+        return StoredResponse(claim.request_hash, status_code, body, expires_at)
+
+    @staticmethod
+    def record_response(user_id: str, payload: Dict[str, Any], status_code: int = 200) -> None:
+        """Store the current request's response in the caller's open transaction.
+
+        Wallet operations call this just before committing, so the ledger write
+        and the stored response commit or roll back together and a key can never
+        be left unfinished after its operation went through. If the claim lapsed
+        and another request took the key over, the transaction is rolled back
+        and ``IdempotencyKeyInUse`` raised rather than applying it twice. Does
+        nothing outside a request holding a key for ``user_id``.
+        """
+        claim: Optional[IdempotencyClaim] = g.get('idempotency_claim')
+        if claim is None or claim.user_id != user_id:
+            return
+        body = current_app.json.response(payload).get_data(as_text=True)
+        stored = IdempotencyService._store(claim, status_code, body)
+        if stored is None:
+            db.session.rollback()
+            raise IdempotencyKeyInUse()
+        g.idempotency_response = stored
+
+    @staticmethod
+    def remember(claim: IdempotencyClaim, stored: StoredResponse) -> None:
+        """Cache a response that ``record_response`` committed with its operation."""
+        IdempotencyService._cache().put(claim.user_id, claim.key, stored)
+
+    @staticmethod
+    def complete(claim: IdempotencyClaim, status_code: int, body: str) -> None:
+        """Store the response of a request that wrote nothing else, such as a rejected one."""
+        stored = IdempotencyService._store(claim, status_code, body)
+        db.session.commit()
+        if stored is not None:
+            IdempotencyService._cache().put(claim.user_id, claim.key, stored)
+
+    @staticmethod
+    def release(claim: IdempotencyClaim) -> None:
+        """Drop an unfinished claim so the request can be retried."""
+        db.session.rollback()
+        db.session.execute(delete(IdempotencyKey).where(IdempotencyService._owned(claim)))
+        db.session.commit()
+
+    @staticmethod
+    def purge_expired(batch_size: int = 1000) -> int:
+        """Delete expired keys in batches of ``batch_size`` and return how many were removed."""
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        purged = 0
+        while True:
+            expired = select(IdempotencyKey.id).where(IdempotencyKey.expires_at <= now).limit(batch_size)
+            result = cast(CursorResult[Any], db.session.execute(
+                delete(IdempotencyKey).where(IdempotencyKey.id.in_(expired))
+            ))
+            db.session.commit()
+            purged += result.rowcount
+            if result.rowcount < batch_size:
+                return purged
@@ -0,0 +1,77 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from app import db
+from app.providers import RateProvider
+from app.services import FxService, IdempotencyService, LedgerPartitionService
+from flask import Flask
+from typing import Optional
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class PeriodicWorker(threading.Thread, ABC):
+    """Daemon thread that calls ``run_once`` in an app context every ``interval`` seconds."""
+
+    def __init__(self, app: Flask, interval: float, name: str) -> None:
+        super().__init__(name=name, daemon=True)
+        self.app = app
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    @abstractmethod
+    def run_once(self) -> int:
+        """Do one unit of work and return how many items it handled."""
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            with self.app.app_context():
+                try:
+                    self.run_once()
+                except Exception:
+                    logger.exception("%s run failed", self.name)
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            self._stop_event.wait(self.interval)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop_event.set()
+        self.join(timeout)
+
+class RateIngestionWorker(PeriodicWorker):
+    """Pulls the full rate set from a provider and upserts it in one transaction."""
+
+    def __init__(self, app: Flask, provider: RateProvider, interval: float) -> None:
+        super().__init__(app, interval, name='fx-rate-ingestion')
+        self.provider = provider
+
+    def run_once(self) -> int:
+        rates = self.provider.fetch_rates()
+        written = FxService.upsert_rates(rates)
+        logger.info("Ingested %d FX rates", written)
+        return written
+
+class IdempotencySweeper(PeriodicWorker):
+    """Deletes expired ``idempotency_keys`` rows."""
+
+    def __init__(self, app: Flask, interval: float) -> None:
+        super().__init__(app, interval, name='idempotency-sweeper')
+
+    def run_once(self) -> int:
+        purged = IdempotencyService.purge_expired()
+        logger.info("Purged %d expired idempotency keys", purged)
+        return purged
+
+class LedgerPartitionWorker(PeriodicWorker):
+    """Keeps monthly ``transactions`` partitions created ``months_ahead`` months in advance."""
+
+    def __init__(self, app: Flask, months_ahead: int, interval: float) -> None:
+        super().__init__(app, interval, name='ledger-partitions')
+        self.months_ahead = months_ahead
+
+    def run_once(self) -> int:
+        created = LedgerPartitionService.ensure_partitions(self.months_ahead)
+        if created:
+            logger.info("Created ledger partitions %s", ', '.join(created))
+        return len(created)
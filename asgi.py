@@ -0,0 +1,5 @@
+from __future__ import annotations
+from app.asgi import AsyncReadApp
+from wsgi import app as flask_app
+
+app = AsyncReadApp(flask_app)
@@ -0,0 +1,142 @@
+"""Concurrent-connection capacity of the sync (gunicorn) and async (uvicorn) read paths.
+
+For each server and each value of ``--connections`` this starts the server,
+opens that many keep-alive connections at once from a single asyncio client
+and keeps every one of them issuing read requests (balances, transaction
+history and FX rates) for ``--duration`` seconds. The sync path is
+``gunicorn -c gunicorn.conf.py wsgi:app``, which serves at most
+``workers * threads`` requests at a time. The async path is ``uvicorn
+asgi:app``, which answers the read endpoints on the event loop. Throughput,
+latency percentiles and failed requests are reported per run.
+
+    DATABASE_URL=postgresql://... python benchmarks/async_capacity.py --connections 64,256,1024
+
+The database must be migrated first (``flask db upgrade``) and the async
+driver installed (``asyncpg`` for PostgreSQL, ``aiosqlite`` for SQLite).
+"""
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import ROOT, report, wait_until_ready  # noqa: E402
+
+def start_server(kind: str, workers: int, threads: int, port: int) -> subprocess.Popen:
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads),
+               PORT=str(port), APP_CONFIG='production')
+    if kind == 'sync':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                   '--workers', str(workers), '--no-access-log', '--lifespan', 'on']
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+async def _request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, path: str) -> Tuple[int, bool]:
+    """Send one GET and read the response; returns the status and whether the connection stays open."""
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n\r\n".encode())
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Server closed the connection")
+    length = 0
+    keep_alive = status_line.startswith(b'HTTP/1.1')
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'connection':
+            keep_alive = value.strip().lower() != 'close'
+    await reader.readexactly(length)
+    return int(status_line.split()[1]), keep_alive
+
+async def _drive(url: str, connections: int, duration: float, users: int) -> Dict[str, float]:
+    parts = urlsplit(url)
+    host = f"{parts.hostname}:{parts.port}"
+    latencies: List[float] = []
+    errors = [0]
+    deadline = time.monotonic() + duration
+
+    async def client(seed: int) -> None:
+        rng = random.Random(seed)
+        stream: Optional[tuple] = None
+        while time.monotonic() < deadline:
+            user_id = f"load{rng.randrange(users)}"
+            path = rng.choice((f'/wallets/{user_id}/balances', f'/wallets/{user_id}/transactions?limit=20', '/fx/rates'))
+            started = time.perf_counter()
+            try:
+                if stream is None:
+                    stream = await asyncio.open_connection(parts.hostname, parts.port)
+                status, keep_alive = await asyncio.wait_for(_request(*stream, host, path), timeout=10)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+                errors[0] += 1
+                if stream is not None:
+                    stream[1].close()
+                stream = None
+                continue
+            if not keep_alive:
+                stream[1].close()
+                stream = None
+            if status >= 500:
+                errors[0] += 1
+            latencies.append(time.perf_counter() - started)
+        if stream is not None:
+            stream[1].close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(connections)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def percentile(p: float) -> float:
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+    return {
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": percentile(0.50),
+        "p99_ms": percentile(0.99),
+        "errors": errors[0]
+    }
+
+def drive(url: str, connections: int, duration: float, users: int) -> Dict[str, float]:
+    return asyncio.run(_drive(url, connections, duration, users))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', default='sync,async', help='Comma-separated servers to run: sync, async.')
+    parser.add_argument('--connections', default='32,128,512', help='Comma-separated concurrent connection counts.')
+    parser.add_argument('--workers', type=int, default=2, help='Server worker processes.')
+    parser.add_argument('--threads', type=int, default=4, help='gthread threads per sync worker.')
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--duration', type=float, default=15.0, help='Seconds per run.')
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+
+    url = f"http://127.0.0.1:{args.port}"
+    print(f"{'run':<10} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for kind in args.servers.split(','):
+        server = start_server(kind, args.workers, args.threads, args.port)
+        try:
+            wait_until_ready(url)
+            for connections in (int(value) for value in args.connections.split(',')):
+                report(f"{kind}/{connections}", drive(url, connections, args.duration, args.users))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""HTTP load test of the production server across gunicorn worker counts.
+
+For each value of ``--workers`` this starts ``gunicorn -c gunicorn.conf.py
+wsgi:app`` with that many workers and drives it from ``--concurrency`` client
+threads for ``--duration`` seconds. The clients use keep-alive connections
+and a read/write mix of balance lookups and funds. It reports requests per
+second and latency percentiles for each run.
+
+    DATABASE_URL=postgresql://... python benchmarks/load_test.py --workers 1,2,4,8
+    python benchmarks/load_test.py --url http://localhost:5000 --duration 30
+
+Pass ``--url`` to measure a server that is already running instead. The
+database must be migrated first (``flask db upgrade``).
+"""
+from __future__ import annotations
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def wait_until_ready(url: str, timeout: float = 30) -> None:
+    parts = urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=1)
+            connection.request('GET', '/')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not become ready")
+
+def drive(url: str, concurrency: int, duration: float, users: int, write_ratio: float) -> Dict[str, float]:
+    parts = urlsplit(url)
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(seed: int) -> None:
+        rng = random.Random(seed)
+        connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=10)
+        local: List[float] = []
+        failed = 0
+        while time.monotonic() < deadline:
+            user_id = f"load{rng.randrange(users)}"
+            started = time.perf_counter()
+            try:
+                if rng.random() < write_ratio:
+                    connection.request('POST', f'/wallets/{user_id}/fund',
+                                       body=json.dumps({'currency': 'USD', 'amount': 1}),
+                                       headers={'Content-Type': 'application/json'})
+                else:
+                    connection.request('GET', f'/wallets/{user_id}/balances')
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 500:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=10)
+                continue
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def percentile(p: float) -> float:
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+    return {
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": percentile(0.50),
+        "p99_ms": percentile(0.99),
+        "errors": errors[0]
+    }
+
+def start_server(workers: int, threads: int, port: int) -> subprocess.Popen:
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads),
+               PORT=str(port), APP_CONFIG='production')
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--access-logfile', '', 'wsgi:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+def report(label: str, result: Dict[str, float]) -> None:
+    print(f"{label:<10} {result['requests_per_second']:>10.1f} {result['p50_ms']:>9.2f} "
+          f"{result['p99_ms']:>9.2f} {int(result['errors']):>7}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=None, help='Benchmark an already running server instead.')
+    parser.add_argument('--workers', default='1,2,4', help='Comma-separated gunicorn worker counts.')
+    parser.add_argument('--threads', type=int, default=4, help='gthread threads per worker.')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--concurrency', type=int, default=32, help='Concurrent client connections.')
+    parser.add_argument('--duration', type=float, default=15.0, help='Seconds per run.')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--write-ratio', type=float, default=0.2, help='Fraction of requests that fund a wallet.')
+    args = parser.parse_args()
+
+    print(f"{'workers':<10} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    if args.url:
+        wait_until_ready(args.url)
+        report('external', drive(args.url, args.concurrency, args.duration, args.users, args.write_ratio))
+        return
+
+    url = f"http://127.0.0.1:{args.port}"
+    for workers in (int(value) for value in args.workers.split(',')):
+        server: Optional[subprocess.Popen] = start_server(workers, args.threads, args.port)
+        try:
+            wait_until_ready(url)
+            report(str(workers), drive(url, args.concurrency, args.duration, args.users, args.write_ratio))
+        finally:
+            assert server is not None
+            server.terminate()
+            server.wait(timeout=30)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Compare the pessimistic and optimistic wallet locking strategies.
+
+Runs the same mix of conversions, funds and withdrawals from several threads
+under each strategy and reports throughput and conflict counters. Fewer users
+means more contention on the same wallets.
+
+    python benchmarks/wallet_locking.py --threads 8 --users 1000 --operations 5000
+    python benchmarks/wallet_locking.py --database-url postgresql://.../fx_benchmark --users 10
+
+By default a temporary SQLite file is used; ``DATABASE_URL`` and ``.env`` are
+ignored. ``--database-url`` must name a scratch database: its schema is
+dropped and recreated for every strategy.
+"""
+from __future__ import annotations
+from decimal import Decimal
+from typing import Any, Dict, List
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db  # noqa: E402
+from app.services import FxService, WalletService  # noqa: E402
+
+def run(database_url: str, strategy: str, threads: int, users: int, operations: int, seed: int) -> Dict[str, Any]:
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'WALLET_LOCKING_STRATEGY': strategy})
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        FxService.initialize_rates()
+        WalletService.apply_batch([
+            {"user_id": f"user{i}", "type": "fund", "currency": currency, "amount": Decimal('1000000')}
+            for i in range(users) for currency in ('USD', 'MXN')
+        ])
+
+    errors: List[BaseException] = []
+    per_thread = operations // threads
+
+    def worker(worker_seed: int) -> None:
+        rng = random.Random(worker_seed)
+        for _ in range(per_thread):
+            user_id = f"user{rng.randrange(users)}"
+            choice = rng.random()
+            with app.app_context():
+                try:
+                    if choice < 0.4:
+                        WalletService.convert_currency(user_id, 'USD', 'MXN', Decimal('1'))
+                    elif choice < 0.8:
+                        WalletService.convert_currency(user_id, 'MXN', 'USD', Decimal('18'))
+                    elif choice < 0.9:
+                        WalletService.fund_wallet(user_id, 'USD', Decimal('1'))
+                    else:
+                        WalletService.withdraw_funds(user_id, 'USD', Decimal('1'))
+                except ValueError:
+                    pass
+                except Exception as e:
+                    errors.append(e)
+
+    pool = [threading.Thread(target=worker, args=(seed + i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    metrics = app.extensions['wallet_lock_metrics'].snapshot()
+    return {
+        "strategy": strategy,
+        "ops_per_second": per_thread * threads / elapsed,
+        "elapsed": elapsed,
+        "retries": metrics['retries'],
+        "failures": metrics['failures'] + len(errors),
+        "lock_wait_avg_ms": metrics['wait_seconds_avg'] * 1000
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--users', type=int, default=1000, help='Distinct users; fewer means more contention.')
+    parser.add_argument('--operations', type=int, default=4000, help='Total operations per strategy.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database-url', default=None,
+                        help='Scratch database to benchmark against; its schema is dropped. Defaults to temporary SQLite.')
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}"
+
+    print(f"{'strategy':<12} {'ops/s':>10} {'elapsed s':>10} {'retries':>8} {'failures':>9} {'lock wait ms':>13}")
+    for strategy in ('pessimistic', 'optimistic'):
+        result = run(database_url, strategy, args.threads, args.users, args.operations, args.seed)
+        print(f"{result['strategy']:<12} {result['ops_per_second']:>10.1f} {result['elapsed']:>10.2f} "
+              f"{result['retries']:>8} {result['failures']:>9} {result['lock_wait_avg_ms']:>13.3f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+"""Gunicorn settings for production serving.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Each worker process runs ``GUNICORN_THREADS`` request threads and builds its
+own SQLAlchemy pool after the fork, so keep ``DB_POOL_SIZE`` at least as large
+as the thread count and size the database's ``max_connections`` for
+``WEB_CONCURRENCY * (DB_POOL_SIZE + DB_MAX_OVERFLOW)``.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', str(multiprocessing.cpu_count() * 2 + 1)))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+# Recycle workers periodically, jittered so they do not all restart at once.
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '10000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '1000'))
+# Engines and pools must not be shared across a fork, so the app is loaded per worker.
+preload_app = False
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
@@ -0,0 +1,48 @@
+"""Add append-only fx_rate_history and fx_rates.updated_at
+
+Revision ID: 180225d7eaac
+Revises: 5ce217d490e9
+Create Date: 2026-10-17 13:58:16.402771
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '180225d7eaac'
+down_revision = '5ce217d490e9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('fx_rate_history',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('from_currency', sa.String(length=3), nullable=False),
+    sa.Column('to_currency', sa.String(length=3), nullable=False),
+    sa.Column('rate', sa.DECIMAL(precision=20, scale=8), nullable=False),
+    sa.Column('effective_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_fx_rate_history_pair_effective_at', 'fx_rate_history', ['from_currency', 'to_currency', 'effective_at'], unique=False)
+    op.create_index('ix_fx_rate_history_effective_at', 'fx_rate_history', ['effective_at'], unique=False)
+
+    op.add_column('fx_rates', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE fx_rates SET updated_at = created_at')
+    with op.batch_alter_table('fx_rates') as batch_op:
+        batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+
+    # Seed the history with the rates currently in force.
+    op.execute(
+        'INSERT INTO fx_rate_history (from_currency, to_currency, rate, effective_at) '
+        'SELECT from_currency, to_currency, rate, created_at FROM fx_rates'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('fx_rates') as batch_op:
+        batch_op.drop_column('updated_at')
+    op.drop_index('ix_fx_rate_history_effective_at', table_name='fx_rate_history')
+    op.drop_index('ix_fx_rate_history_pair_effective_at', table_name='fx_rate_history')
+    op.drop_table('fx_rate_history')
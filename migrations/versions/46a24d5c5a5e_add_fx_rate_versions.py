@@ -0,0 +1,29 @@
+"""Add fx_rate_versions counter for rate cache invalidation
+
+Revision ID: 46a24d5c5a5e
+Revises: 212a93a6e25d
+Create Date: 2026-10-17 09:12:41.208113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '46a24d5c5a5e'
+down_revision = '212a93a6e25d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    fx_rate_versions = op.create_table('fx_rate_versions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(fx_rate_versions, [{'id': 1, 'version': 1}])
+
+
+def downgrade():
+    op.drop_table('fx_rate_versions')
@@ -0,0 +1,36 @@
+"""Add transaction history and reconciliation indexes
+
+Revision ID: d2282dabf636
+Revises: f3025eee16e3
+Create Date: 2026-10-17 11:21:05.734410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2282dabf636'
+down_revision = 'f3025eee16e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block on PostgreSQL.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_transactions_user_id_created_at', 'transactions',
+                        ['user_id', 'created_at', 'id'], unique=False,
+                        postgresql_concurrently=True)
+        op.create_index('ix_transactions_user_id_id', 'transactions',
+                        ['user_id', 'id'], unique=False,
+                        postgresql_include=['currency', 'transaction_type', 'amount'],
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_transactions_user_id_id', table_name='transactions',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_transactions_user_id_created_at', table_name='transactions',
+                      postgresql_concurrently=True)
@@ -0,0 +1,112 @@
+"""Partition transactions by month on PostgreSQL
+
+Revision ID: d2a78057c3ab
+Revises: 49fd6e6779f8
+Create Date: 2026-10-17 19:04:37.512904
+
+"""
+from alembic import op
+from datetime import datetime, timezone
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a78057c3ab'
+down_revision = '49fd6e6779f8'
+branch_labels = None
+depends_on = None
+
+# Partitions created ahead of the current month; `flask ensure-ledger-partitions`
+# keeps extending them.
+MONTHS_AHEAD = 3
+
+COLUMNS = 'id, user_id, transaction_type, currency, amount, from_currency, to_currency, fx_rate, created_at'
+
+
+def _add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _create_indexes(table):
+    op.execute(f"CREATE INDEX ix_{table}_user_id_created_at ON {table} (user_id, created_at, id)")
+    op.execute(f"CREATE INDEX ix_{table}_user_id_id ON {table} (user_id, id) "
+               f"INCLUDE (currency, transaction_type, amount)")
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        # Other backends keep the plain table; partition management is a no-op there.
+        return
+
+    op.execute("ALTER TABLE transactions RENAME TO transactions_unpartitioned")
+    op.execute("ALTER TABLE transactions_unpartitioned RENAME CONSTRAINT transactions_pkey TO transactions_unpartitioned_pkey")
+    op.execute("DROP INDEX ix_transactions_user_id_created_at")
+    op.execute("DROP INDEX ix_transactions_user_id_id")
+    # Detach the id sequence so it survives dropping the old table.
+    op.execute("ALTER SEQUENCE transactions_id_seq OWNED BY NONE")
+
+    # The partition key has to be part of the primary key.
+    op.execute("""
+        CREATE TABLE transactions (
+            id INTEGER NOT NULL DEFAULT nextval('transactions_id_seq'),
+            user_id VARCHAR(50) NOT NULL,
+            transaction_type transactiontype NOT NULL,
+            currency VARCHAR(3) NOT NULL,
+            amount NUMERIC(20, 8) NOT NULL,
+            from_currency VARCHAR(3),
+            to_currency VARCHAR(3),
+            fx_rate NUMERIC(20, 8),
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            CONSTRAINT transactions_pkey PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id")
+    # Catches rows outside every monthly partition instead of rejecting the insert.
+    op.execute("CREATE TABLE transactions_default PARTITION OF transactions DEFAULT")
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    oldest = bind.execute(sa.text("SELECT min(created_at) FROM transactions_unpartitioned")).scalar() or now
+    month = datetime(oldest.year, oldest.month, 1)
+    last = _add_months(datetime(now.year, now.month, 1), MONTHS_AHEAD)
+    while month <= last:
+        following = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE transactions_y{month.year:04d}m{month.month:02d} PARTITION OF transactions "
+            f"FOR VALUES FROM ('{month.isoformat(' ')}') TO ('{following.isoformat(' ')}')"
+        )
+        month = following
+
+    op.execute(f"INSERT INTO transactions ({COLUMNS}) SELECT {COLUMNS} FROM transactions_unpartitioned")
+    op.execute("DROP TABLE transactions_unpartitioned")
+    _create_indexes('transactions')
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    op.execute("ALTER SEQUENCE transactions_id_seq OWNED BY NONE")
+    op.execute("""
+        CREATE TABLE transactions_unpartitioned (
+            id INTEGER NOT NULL DEFAULT nextval('transactions_id_seq'),
+            user_id VARCHAR(50) NOT NULL,
+            transaction_type transactiontype NOT NULL,
+            currency VARCHAR(3) NOT NULL,
+            amount NUMERIC(20, 8) NOT NULL,
+            from_currency VARCHAR(3),
+            to_currency VARCHAR(3),
+            fx_rate NUMERIC(20, 8),
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            CONSTRAINT transactions_unpartitioned_pkey PRIMARY KEY (id)
+        )
+    """)
+    op.execute(f"INSERT INTO transactions_unpartitioned ({COLUMNS}) SELECT {COLUMNS} FROM transactions")
+    # Dropping the parent drops every attached partition with it.
+    op.execute("DROP TABLE transactions")
+    op.execute("ALTER TABLE transactions_unpartitioned RENAME TO transactions")
+    op.execute("ALTER TABLE transactions RENAME CONSTRAINT transactions_unpartitioned_pkey TO transactions_pkey")
+    op.execute("ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id")
+    _create_indexes('transactions')
@@ -8,9 +8,7 @@ from app.services import FxService
 def app():
     db_fd, db_path = tempfile.mkstemp()
 
-    app = create_app()
-    app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}'})
 
     with app.app_context():
         db.create_all()
@@ -27,3 +25,6 @@ def client(app):
 @pytest.fixture
 def runner(app):
     return app.test_cli_runner()
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'postgres: needs a PostgreSQL server at TEST_POSTGRES_URL')
@@ -0,0 +1,232 @@
+import gzip
+import json
+import os
+import pytest
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import func, literal, select, update
+from app import archive as archive_module, create_app, db
+from app.archive import ArchivedTransaction, LedgerArchive
+from app.models import LedgerArchiveMonth, Transaction, TransactionType, Wallet, WalletBalanceSnapshot
+from app.services import FxService, LedgerArchiveService, ReconciliationService, SnapshotService, WalletService
+
+NOW = datetime(2026, 10, 17)
+
+@pytest.fixture
+def archive_app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'ledger.db'}",
+        'LEDGER_ARCHIVE_DIR': str(tmp_path / 'archive'),
+        'LEDGER_ARCHIVE_USER_BUCKETS': 4,
+        'RECONCILE_CHECKPOINT_SETTLE_SECONDS': 0
+    })
+    with app.app_context():
+        db.create_all()
+        FxService.initialize_rates()
+        yield app
+
+def _backdate(user_id, created_at):
+    db.session.execute(
+        update(Transaction).where(Transaction.user_id == user_id).values(created_at=created_at)
+    )
+    db.session.commit()
+
+def _seed_old_ledger():
+    """user0 and user1 with history in January 2025, user1 with more in March 2026."""
+    WalletService.fund_wallet('user0', 'USD', Decimal('100'))
+    WalletService.withdraw_funds('user0', 'USD', Decimal('30'))
+    WalletService.fund_wallet('user1', 'USD', Decimal('50'))
+    WalletService.convert_currency('user1', 'USD', 'MXN', Decimal('10'))
+    _backdate('user0', datetime(2025, 1, 10))
+    _backdate('user1', datetime(2025, 1, 20))
+    WalletService.fund_wallet('user1', 'EUR', Decimal('5'))
+    db.session.execute(
+        update(Transaction).where(Transaction.currency == 'EUR').values(created_at=datetime(2026, 3, 5))
+    )
+    db.session.commit()
+
+def _row(txn_id, user_id, amount='1.5'):
+    return ArchivedTransaction(txn_id, user_id, TransactionType.FUND, 'USD', Decimal(amount),
+                               None, None, None, datetime(2025, 1, 1, 12))
+
+class TestLedgerArchive:
+
+    def test_segments_round_trip(self, tmp_path):
+        archive = LedgerArchive(str(tmp_path))
+        rows = [_row(1, 'alice'), _row(2, 'alice', '2.25'), _row(3, 'bob')]
+
+        assert archive.write_month(datetime(2025, 1, 1), 4, rows) == 3
+
+        assert list(archive.read_user(datetime(2025, 1, 1), 4, 'alice')) == rows[:2]
+        assert list(archive.read_user(datetime(2025, 1, 1), 4, 'bob')) == rows[2:]
+        assert list(archive.read_user(datetime(2025, 1, 1), 4, 'carol')) == []
+        # Every bucket has a segment, including empty ones.
+        assert sorted(os.listdir(tmp_path / '2025-01')) == [
+            f'bucket-{bucket:03d}.ndjson.gz{suffix}' for bucket in range(4) for suffix in ('', '.idx')
+        ]
+        assert not any(name.endswith('.tmp') for name in os.listdir(tmp_path / '2025-01'))
+
+    def test_index_seeks_to_the_users_member(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(archive_module, 'MEMBER_SIZE', 1)
+        archive = LedgerArchive(str(tmp_path))
+        rows = [_row(index, f'user{index:02d}') for index in range(20)]
+        archive.write_month(datetime(2025, 1, 1), 1, rows)
+
+        path = archive.segment_path(datetime(2025, 1, 1), 0)
+        with open(f'{path}.idx') as index_file:
+            index = json.load(index_file)
+        with gzip.open(path) as segment:
+            assert len(segment.readlines()) == 20
+
+        assert [user_id for user_id, _ in index] == [f'user{index:02d}' for index in range(20)]
+        assert list(archive.read_range(datetime(2025, 1, 1), 0, 'user05', 'user07')) == rows[5:8]
+
+    def test_failed_write_leaves_no_segments(self, tmp_path):
+        archive = LedgerArchive(str(tmp_path))
+
+        def rows():
+            yield _row(1, 'alice')
+            raise RuntimeError('connection lost')
+
+        with pytest.raises(RuntimeError):
+            archive.write_month(datetime(2025, 1, 1), 2, rows())
+        assert os.listdir(tmp_path / '2025-01') == []
+
+    def test_rows_out_of_codepoint_order_are_rejected(self, tmp_path):
+        archive = LedgerArchive(str(tmp_path))
+
+        # A case-insensitive collation sorts 'alice' before 'Bob'; codepoints do not.
+        with pytest.raises(ValueError, match='codepoints'):
+            archive.write_month(datetime(2025, 1, 1), 1, [_row(1, 'alice'), _row(2, 'Bob')])
+        assert os.listdir(tmp_path / '2025-01') == []
+
+class TestLedgerArchiveService:
+
+    def test_archive_moves_old_months_out_of_transactions(self, archive_app):
+        with archive_app.app_context():
+            _seed_old_ledger()
+
+            archived = LedgerArchiveService.archive_months(12, now=NOW)
+
+            assert [(month.month, month.row_count) for month in archived] == [(datetime(2025, 1, 1), 5)]
+            assert db.session.execute(select(func.count(Transaction.id))).scalar() == 1
+            archive_month = db.session.get(LedgerArchiveMonth, datetime(2025, 1, 1))
+            assert archive_month is not None
+            assert archive_month.user_buckets == 4
+            # Nothing left to archive.
+            assert LedgerArchiveService.archive_months(12, now=NOW) == []
+
+    def test_archive_rejects_bad_age(self, archive_app):
+        with archive_app.app_context():
+            with pytest.raises(ValueError, match='at least 1 month'):
+                LedgerArchiveService.archive_months(0)
+
+    def test_reconcile_reads_archived_rows(self, archive_app):
+        with archive_app.app_context():
+            _seed_old_ledger()
+            LedgerArchiveService.archive_months(12, now=NOW)
+
+            assert WalletService.reconcile_balances('user1', full=True)['reconciled'] is True
+            assert WalletService.reconcile_balances('user1')['reconciled'] is True
+
+            Wallet.query.filter_by(user_id='user0', currency='USD').update({'balance': Decimal('71')})
+            db.session.commit()
+            result = WalletService.reconcile_balances('user0')
+
+            assert result['discrepancies'] == {'USD': {'calculated': 70.0, 'actual': 71.0, 'difference': 1.0}}
+
+    def test_checkpoint_covers_rows_before_archiving(self, archive_app):
+        with archive_app.app_context():
+            _seed_old_ledger()
+            WalletService.reconcile_balances('user0')
+            LedgerArchiveService.archive_months(12, now=NOW)
+
+            result = WalletService.reconcile_balances('user0')
+
+            assert result == {'reconciled': True, 'mode': 'incremental', 'discrepancies': {}}
+
+    def test_reconcile_shard_reads_archived_rows(self, archive_app):
+        with archive_app.app_context():
+            _seed_old_ledger()
+            LedgerArchiveService.archive_months(12, now=NOW)
+
+            assert ReconciliationService.reconcile_shard('user0', 'user1', full=True) == []
+            assert ReconciliationService.reconcile_shard('user0', 'user1') == []
+
+            Wallet.query.filter_by(user_id='user1', currency='MXN').update({'balance': Decimal('1')})
+            db.session.commit()
+            rows = ReconciliationService.reconcile_shard('user0', 'user1', full=True)
+
+            assert [(row['user_id'], row['currency'], row['difference']) for row in rows] == [
+                ('user1', 'MXN', '-186.00000000')
+            ]
+
+    def test_shard_bounds_in_database_collation_find_archived_rows(self, archive_app):
+        with archive_app.app_context():
+            WalletService.fund_wallet('alice', 'USD', Decimal('10'))
+            WalletService.fund_wallet('Bob', 'USD', Decimal('20'))
+            _backdate('alice', datetime(2025, 1, 10))
+            _backdate('Bob', datetime(2025, 1, 10))
+            LedgerArchiveService.archive_months(12, now=NOW)
+
+            assert [row.user_id for row in LedgerArchiveService.iter_rows(db.session, ['Bob'])] == ['Bob']
+            # A locale-collated PostgreSQL shard runs from 'alice' to 'Bob', an
+            # empty range in codepoint order.
+            shard_rows = db.session.execute(
+                select(Wallet.user_id, Wallet.currency, literal(Decimal('0')).label('calculated'),
+                       Wallet.balance.label('actual'))
+            ).all()
+            assert ReconciliationService._add_archived(db.session, shard_rows, 'alice', 'Bob', True) == []
+
+    def test_balances_as_of_include_archived_rows(self, archive_app):
+        client = archive_app.test_client()
+        with archive_app.app_context():
+            _seed_old_ledger()
+            SnapshotService.build_snapshots(datetime(2025, 1, 15))
+            points = ['2025-01-15', '2025-01-25', '2026-04-01']
+            expected = {
+                (user_id, as_of): client.get(f'/wallets/{user_id}/balances?as_of={as_of}').get_json()
+                for user_id in ('user0', 'user1') for as_of in points
+            }
+            LedgerArchiveService.archive_months(12, now=NOW)
+
+            assert expected[('user1', '2025-01-25')] == {'USD': 40.0, 'MXN': 187.0}
+            for (user_id, as_of), balances in expected.items():
+                assert client.get(f'/wallets/{user_id}/balances?as_of={as_of}').get_json() == balances
+
+            assert SnapshotService.build_snapshots(datetime(2026, 4, 1)) == 4
+            snapshot = {
+                (row.user_id, row.currency): row.balance
+                for row in WalletBalanceSnapshot.query.filter_by(as_of=datetime(2026, 4, 1))
+            }
+            assert snapshot == {
+                ('user0', 'USD'): Decimal('70'), ('user1', 'USD'): Decimal('40'),
+                ('user1', 'MXN'): Decimal('187'), ('user1', 'EUR'): Decimal('5')
+            }
+            for (user_id, as_of), balances in expected.items():
+                assert client.get(f'/wallets/{user_id}/balances?as_of={as_of}').get_json() == balances
+
+    def test_export_includes_archived_rows(self, archive_app):
+        with archive_app.app_context():
+            _seed_old_ledger()
+            expected = list(WalletService.iter_transactions('user1'))
+            LedgerArchiveService.archive_months(12, now=NOW)
+
+            assert list(WalletService.iter_transactions('user1')) == expected
+            assert [row['currency'] for row in WalletService.iter_transactions(
+                'user1', start=datetime(2025, 1, 20), end=datetime(2026, 1, 1)
+            )] == ['USD', 'USD', 'MXN']
+            assert [row['currency'] for row in WalletService.iter_transactions(
+                'user1', start=datetime(2026, 1, 1)
+            )] == ['EUR']
+
+    def test_archive_command(self, archive_app):
+        with archive_app.app_context():
+            _seed_old_ledger()
+
+        result = archive_app.test_cli_runner().invoke(args=['archive-ledger', '--older-than-months', '1'])
+
+        assert result.exit_code == 0
+        assert 'Archived 5 transactions from 2025-01' in result.output
+        assert 'Archived 2 ledger months' in result.output
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import pytest
+
+pytest.importorskip('asgiref')
+pytest.importorskip('aiosqlite')
+pytest.importorskip('greenlet')
+
+from app.asgi import AsyncReadApp
+
+def _call(asgi_app, method, path, query='', body=b''):
+    async def run():
+        messages = []
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            'headers': [(b'host', b'testserver'), (b'content-type', b'application/json')],
+            'server': ('testserver', 80),
+            'client': ('127.0.0.1', 50000),
+        }
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        await asgi_app(scope, receive, send)
+        # Pooled aiosqlite connections are bound to this event loop.
+        await asgi_app.dispose()
+        return messages
+
+    messages = asyncio.run(run())
+    status = messages[0]['status']
+    payload = b''.join(message.get('body', b'') for message in messages[1:])
+    return status, json.loads(payload)
+
+@pytest.fixture
+def asgi_app(app):
+    return AsyncReadApp(app)
+
+def _fund(client, user_id, currency, amount):
+    response = client.post(f'/wallets/{user_id}/fund', json={'currency': currency, 'amount': amount})
+    assert response.status_code == 200
+
+class TestAsyncReadPath:
+
+    def test_balances_match_sync_path(self, client, asgi_app):
+        _fund(client, 'user1', 'USD', 100)
+        _fund(client, 'user1', 'MXN', 250)
+
+        status, payload = _call(asgi_app, 'GET', '/wallets/user1/balances')
+
+        assert status == 200
+        assert payload == client.get('/wallets/user1/balances').get_json()
+        assert payload == {'USD': 100.0, 'MXN': 250.0}
+
+    def test_transactions_page_through_with_cursor(self, client, asgi_app):
+        for amount in (10, 20, 30):
+            _fund(client, 'user1', 'USD', amount)
+
+        status, first = _call(asgi_app, 'GET', '/wallets/user1/transactions', 'limit=2')
+        assert status == 200
+        assert first == client.get('/wallets/user1/transactions?limit=2').get_json()
+        assert [txn['amount'] for txn in first['transactions']] == [30.0, 20.0]
+
+        status, second = _call(asgi_app, 'GET', '/wallets/user1/transactions', f"limit=2&cursor={first['next_cursor']}")
+        assert status == 200
+        assert [txn['amount'] for txn in second['transactions']] == [10.0]
+        assert second['next_cursor'] is None
+
+    def test_invalid_cursor_is_rejected(self, asgi_app):
+        status, payload = _call(asgi_app, 'GET', '/wallets/user1/transactions', 'cursor=not-a-cursor')
+
+        assert status == 400
+        assert 'error' in payload
+
+    def test_rates_match_sync_path(self, client, asgi_app):
+        status, payload = _call(asgi_app, 'GET', '/fx/rates')
+
+        assert status == 200
+        assert payload == client.get('/fx/rates').get_json()
+        assert 'USD/MXN' in payload['rates']
+
+    def test_other_requests_fall_through_to_flask(self, asgi_app):
+        body = json.dumps({'currency': 'USD', 'amount': 50}).encode()
+
+        status, payload = _call(asgi_app, 'POST', '/wallets/user1/fund', body=body)
+        assert status == 200
+
+        status, payload = _call(asgi_app, 'GET', '/wallets/user1/balances', 'as_of=2020-01-01T00:00:00Z')
+        assert status == 200
+        assert payload == {}
+
+        status, payload = _call(asgi_app, 'GET', '/wallets/user1/balances')
+        assert payload == {'USD': 50.0}
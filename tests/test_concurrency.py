@@ -0,0 +1,187 @@
+import json
+import pytest
+import random
+import sqlite3
+import threading
+from decimal import Decimal
+from sqlalchemy import case, func, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from app import create_app, db
+from app.models import Transaction, TransactionType, Wallet
+from app.services import FxService, WalletService
+
+THREADS = 16
+OPERATIONS_PER_THREAD = 25
+
+def _file_app(tmp_path, strategy='pessimistic'):
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'stress.db'}",
+        'WALLET_LOCKING_STRATEGY': strategy,
+        'WALLET_MAX_RETRIES': 50
+    })
+    with app.app_context():
+        db.create_all()
+        FxService.initialize_rates()
+    return app
+
+def _ledger_balance(user_id, currency):
+    signed = func.sum(
+        case(
+            (Transaction.transaction_type.in_([TransactionType.WITHDRAW, TransactionType.CONVERT_OUT]), -Transaction.amount),
+            else_=Transaction.amount
+        )
+    )
+    return db.session.query(signed).filter_by(user_id=user_id, currency=currency).scalar() or Decimal('0')
+
+class TestWalletConcurrency:
+
+    @pytest.mark.parametrize('strategy', ['pessimistic', 'optimistic'])
+    def test_parallel_operations_lose_no_updates(self, tmp_path, strategy):
+        app = _file_app(tmp_path, strategy)
+        with app.app_context():
+            WalletService.fund_wallet('user1', 'USD', Decimal('1000'))
+            WalletService.fund_wallet('user1', 'MXN', Decimal('10000'))
+
+        errors = []
+
+        def worker(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(OPERATIONS_PER_THREAD):
+                    with app.app_context():
+                        choice = rng.random()
+                        try:
+                            if choice < 0.35:
+                                WalletService.convert_currency('user1', 'USD', 'MXN', Decimal('3'))
+                            elif choice < 0.7:
+                                WalletService.convert_currency('user1', 'MXN', 'USD', Decimal('50'))
+                            elif choice < 0.85:
+                                WalletService.fund_wallet('user1', 'USD', Decimal('5'))
+                            else:
+                                WalletService.withdraw_funds('user1', 'MXN', Decimal('20'))
+                        except ValueError:
+                            pass
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        with app.app_context():
+            for currency in ('USD', 'MXN'):
+                wallet = Wallet.query.filter_by(user_id='user1', currency=currency).one()
+                assert wallet.balance >= 0
+                assert wallet.balance == _ledger_balance('user1', currency)
+            assert Transaction.query.count() > THREADS * OPERATIONS_PER_THREAD // 2
+
+            metrics = app.extensions['wallet_lock_metrics'].snapshot()
+            assert metrics['failures'] == 0
+            assert (metrics['acquisitions'] > 0) == (strategy == 'pessimistic')
+
+    def test_metrics_endpoint(self, client, app):
+        with app.app_context():
+            WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+            WalletService.convert_currency('user1', 'USD', 'MXN', Decimal('10'))
+
+            response = client.get('/metrics')
+
+            assert response.status_code == 200
+            locks = json.loads(response.data)['wallet_locks']
+            assert locks['acquisitions'] == 1
+            assert locks['retries'] == 0
+
+    def test_retries_transient_conflicts(self, app, monkeypatch):
+        with app.app_context():
+            app.config['WALLET_RETRY_BASE_DELAY'] = 0
+            credit = WalletService._credit_wallet
+            calls = []
+
+            def locked_once(*args):
+                calls.append(args)
+                if len(calls) == 1:
+                    raise OperationalError('UPDATE wallets', {}, sqlite3.OperationalError('database is locked'))
+                return credit(*args)
+
+            monkeypatch.setattr(WalletService, '_credit_wallet', locked_once)
+            result = WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+
+            assert result['balance'] == Decimal('100')
+            assert len(calls) == 2
+            assert Transaction.query.count() == 1
+            assert app.extensions['wallet_lock_metrics'].snapshot()['retries'] == 1
+
+    def test_gives_up_after_max_retries(self, app, monkeypatch):
+        with app.app_context():
+            app.config['WALLET_RETRY_BASE_DELAY'] = 0
+            app.config['WALLET_MAX_RETRIES'] = 2
+
+            def always_locked(*args):
+                raise OperationalError('UPDATE wallets', {}, sqlite3.OperationalError('database is locked'))
+
+            monkeypatch.setattr(WalletService, '_credit_wallet', always_locked)
+            with pytest.raises(OperationalError):
+                WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+
+            metrics = app.extensions['wallet_lock_metrics'].snapshot()
+            assert metrics['retries'] == 2
+            assert metrics['failures'] == 1
+
+    def test_does_not_retry_other_errors(self, app, monkeypatch):
+        with app.app_context():
+            calls = []
+
+            def conflict(*args):
+                calls.append(args)
+                raise IntegrityError('INSERT INTO wallets', {}, sqlite3.IntegrityError('UNIQUE constraint failed'))
+
+            monkeypatch.setattr(WalletService, '_credit_wallet', conflict)
+            with pytest.raises(IntegrityError):
+                WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+
+            assert len(calls) == 1
+
+    def test_balance_writes_bump_version(self, app):
+        with app.app_context():
+            WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+            WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+            WalletService.withdraw_funds('user1', 'USD', Decimal('50'))
+            WalletService.convert_currency('user1', 'USD', 'MXN', Decimal('10'))
+
+            versions = {wallet.currency: wallet.version for wallet in Wallet.query.filter_by(user_id='user1')}
+            assert versions == {'USD': 4, 'MXN': 2}
+
+    def test_optimistic_convert_retries_on_stale_version(self, app, monkeypatch):
+        with app.app_context():
+            app.config['WALLET_LOCKING_STRATEGY'] = 'optimistic'
+            app.config['WALLET_RETRY_BASE_DELAY'] = 0
+            WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+            acquire = WalletService._acquire_wallets
+            calls = []
+
+            def acquire_then_race(keys):
+                wallets = acquire(keys)
+                calls.append(keys)
+                if len(calls) == 1:
+                    # Simulate another writer bumping the version after the read. It
+                    # shares this session, so it is rolled back with the attempt.
+                    wallets_table = Wallet.__table__  # type: ignore[attr-defined]
+                    db.session.execute(
+                        update(wallets_table)
+                        .where(wallets_table.c.user_id == 'user1', wallets_table.c.currency == 'USD')
+                        .values(balance=wallets_table.c.balance + 5, version=wallets_table.c.version + 1)
+                    )
+                return wallets
+
+            monkeypatch.setattr(WalletService, '_acquire_wallets', acquire_then_race)
+            WalletService.convert_currency('user1', 'USD', 'MXN', Decimal('10'))
+
+            assert len(calls) == 2
+            assert Wallet.query.filter_by(user_id='user1', currency='USD').one().balance == Decimal('90')
+            metrics = app.extensions['wallet_lock_metrics'].snapshot()
+            assert metrics['retries'] == 1
+            assert metrics['acquisitions'] == 0
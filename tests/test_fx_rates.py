@@ -1,8 +1,12 @@
 import pytest
 import json
 from decimal import Decimal
-from app.services import FxService
-from app.models import FxRate
+from sqlalchemy import event, update
+from app import db
+from app.cache import FxQuoteStore, FxRateMatrix
+from app.services import FxService, WalletService
+from app.models import FxRate, FxRateHistory, FxRateQuote, FxRateVersion
+from datetime import datetime, timedelta, timezone
 
 class TestFxRatesEndpoints:
 
@@ -66,6 +70,40 @@ class TestFxRatesEndpoints:
         data = json.loads(response.data)
         assert 'error' in data
 
+    def test_update_fx_rates_batch(self, client, app):
+        with app.app_context():
+            response = client.put(
+                '/fx/rates/batch',
+                data=json.dumps({'rates': [
+                    {'from_currency': 'USD', 'to_currency': 'MXN', 'rate': 19.2},
+                    {'from_currency': 'usd', 'to_currency': 'eur', 'rate': '0.91'},
+                    {'from_currency': 'USD', 'to_currency': 'MXN', 'rate': 19.3},
+                    {'from_currency': 'USD', 'to_currency': 'BRL', 'rate': -5},
+                    {'from_currency': 'EUR', 'to_currency': 'EUR', 'rate': 1}
+                ]}),
+                content_type='application/json'
+            )
+
+            assert response.status_code == 200
+            data = json.loads(response.data)
+            assert [r['success'] for r in data['results']] == [True, True, False, False, False]
+            assert data['results'][2]['error'] == 'Duplicate pair in batch'
+            assert 'rate' in data['results'][3]['details']
+            assert data['updated'] == 2
+            assert data['failed'] == 3
+
+            assert FxService.get_rate('USD', 'MXN') == Decimal('19.2')
+            assert FxService.get_rate('USD', 'EUR') == Decimal('0.91')
+
+    def test_update_fx_rates_batch_requires_rates(self, client):
+        response = client.put(
+            '/fx/rates/batch',
+            data=json.dumps({'rates': {}}),
+            content_type='application/json'
+        )
+
+        assert response.status_code == 400
+
 class TestFxService:
 
     def test_initialize_rates(self, app):
@@ -117,3 +155,346 @@ class TestFxService:
             assert 'MXN/USD' in rates
             assert rates['USD/MXN']['rate'] == 18.7
             assert rates['MXN/USD']['rate'] == 0.053
+
+class TestFxRateCache:
+
+    @staticmethod
+    def _count_statements(callback):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            callback()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        return statements
+
+    @staticmethod
+    def _write_rate_from_other_worker(rate):
+        db.session.execute(
+            update(FxRate)
+            .where(FxRate.from_currency == 'USD', FxRate.to_currency == 'MXN')
+            .values(rate=rate)
+        )
+        db.session.execute(
+            update(FxRateVersion)
+            .where(FxRateVersion.id == 1)
+            .values(version=FxRateVersion.version + 1)
+        )
+        db.session.commit()
+
+    def test_cached_lookup_issues_no_sql(self, app):
+        with app.app_context():
+            FxService.get_rate('USD', 'MXN')
+
+            statements = self._count_statements(lambda: FxService.get_rate('USD', 'MXN'))
+            assert statements == []
+
+    def test_update_rate_bumps_version(self, app):
+        with app.app_context():
+            version = db.session.get(FxRateVersion, 1)
+            assert version is not None
+            before = version.version
+            FxService.update_rate('USD', 'MXN', Decimal('19.1'))
+            db.session.refresh(version)
+            assert version.version == before + 1
+
+    def test_external_write_hidden_within_staleness_bound(self, app):
+        with app.app_context():
+            FxService.get_rate('USD', 'MXN')
+            self._write_rate_from_other_worker(Decimal('21.5'))
+
+            assert FxService.get_rate('USD', 'MXN') == Decimal('18.70')
+
+    def test_external_write_visible_after_staleness_bound(self, app):
+        with app.app_context():
+            cache = app.extensions['fx_rate_cache']
+            cache.max_staleness = 0
+            FxService.get_rate('USD', 'MXN')
+            self._write_rate_from_other_worker(Decimal('21.5'))
+
+            assert FxService.get_rate('USD', 'MXN') == Decimal('21.5')
+
+class TestFxRateMatrix:
+
+    def test_direct_and_inverse_rates(self):
+        matrix = FxRateMatrix({('USD', 'EUR'): Decimal('0.8')}, pivot='USD')
+
+        assert matrix.rate('USD', 'EUR') == Decimal('0.8')
+        assert matrix.rate('EUR', 'USD') == Decimal('1.25')
+        assert matrix.rate('EUR', 'EUR') == Decimal('1')
+
+    def test_cross_rate_through_pivot(self):
+        matrix = FxRateMatrix({
+            ('USD', 'MXN'): Decimal('18.70'),
+            ('USD', 'EUR'): Decimal('0.8'),
+            ('EUR', 'JPY'): Decimal('160'),
+            ('MXN', 'JPY'): Decimal('9'),
+        }, pivot='USD')
+
+        assert matrix.rate('MXN', 'EUR') == (Decimal('0.8') / Decimal('18.70')).quantize(Decimal('0.00000001'))
+        # Stored pairs always win over derived paths.
+        assert matrix.rate('MXN', 'JPY') == Decimal('9')
+
+    def test_multi_hop_without_pivot(self):
+        matrix = FxRateMatrix({
+            ('GBP', 'EUR'): Decimal('1.2'),
+            ('EUR', 'CHF'): Decimal('0.95'),
+            ('CHF', 'SEK'): Decimal('12'),
+        }, pivot='USD')
+
+        assert matrix.rate('GBP', 'SEK') == Decimal('13.68')
+        assert matrix.rate('USD', 'GBP') is None
+
+    def test_configured_currencies_without_rates(self):
+        matrix = FxRateMatrix({('USD', 'MXN'): Decimal('18.70')}, pivot='USD', currencies=['BRL'])
+
+        assert 'BRL' in matrix.currencies
+        assert matrix.rate('USD', 'BRL') is None
+
+class TestSupportedCurrencies:
+
+    def test_currencies_default_to_stored_rates(self, app):
+        with app.app_context():
+            assert FxService.supported_currencies() == frozenset({'USD', 'MXN'})
+
+            FxService.update_rate('USD', 'EUR', Decimal('0.9'))
+            assert FxService.supported_currencies() == frozenset({'USD', 'MXN', 'EUR'})
+
+    def test_configured_currencies(self, client, app):
+        with app.app_context():
+            app.extensions['fx_rate_cache'].configured_currencies = frozenset({'USD', 'EUR'})
+
+            assert client.post(
+                '/wallets/user1/fund',
+                data=json.dumps({'currency': 'EUR', 'amount': 10}),
+                content_type='application/json'
+            ).status_code == 200
+            assert client.post(
+                '/wallets/user1/fund',
+                data=json.dumps({'currency': 'MXN', 'amount': 10}),
+                content_type='application/json'
+            ).status_code == 400
+
+    def test_convert_through_derived_rate(self, app):
+        with app.app_context():
+            FxService.update_rate('USD', 'EUR', Decimal('0.9'))
+            WalletService.fund_wallet('user1', 'MXN', Decimal('1000'))
+
+            result = WalletService.convert_currency('user1', 'MXN', 'EUR', Decimal('1000'))
+
+            assert result['fx_rate'] == Decimal('0.0477')
+            assert result['converted_amount'] == Decimal('47.7')
+
+class TestFxRateHistory:
+
+    @staticmethod
+    def _history_at(app, effective_times):
+        """Rewrite the USD/MXN history to fixed effective times and drop the cache."""
+        rows = FxRateHistory.query.filter_by(from_currency='USD', to_currency='MXN')\
+            .order_by(FxRateHistory.id).all()
+        for row, effective_at in zip(rows, effective_times):
+            row.effective_at = effective_at
+        db.session.commit()
+        app.extensions['fx_rate_cache'].invalidate()
+
+    def test_update_rate_appends_history(self, app):
+        with app.app_context():
+            FxService.update_rate('USD', 'MXN', Decimal('19.0'))
+            FxService.update_rate('USD', 'MXN', Decimal('19.5'))
+
+            rates = [row.rate for row in FxRateHistory.query.filter_by(from_currency='USD', to_currency='MXN')
+                     .order_by(FxRateHistory.id)]
+            assert rates == [Decimal('18.70'), Decimal('19.0'), Decimal('19.5')]
+
+    def test_update_rate_refreshes_updated_at(self, app):
+        with app.app_context():
+            before = FxService.get_all_rates()['USD/MXN']['updated_at']
+            FxService.update_rate('USD', 'MXN', Decimal('18.70'))
+
+            assert FxService.get_all_rates()['USD/MXN']['updated_at'] > before
+
+    def test_get_rate_at_recent_time(self, app):
+        with app.app_context():
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            FxService.update_rate('USD', 'MXN', Decimal('19.0'))
+            self._history_at(app, [now - timedelta(hours=3), now - timedelta(hours=1)])
+
+            assert FxService.get_rate('USD', 'MXN', at=now - timedelta(hours=2)) == Decimal('18.70')
+            assert FxService.get_rate('USD', 'MXN', at=now) == Decimal('19.0')
+            assert FxService.get_rate('USD', 'MXN', at=(now - timedelta(minutes=30)).replace(tzinfo=timezone.utc)) \
+                == Decimal('19.0')
+
+    def test_get_rate_at_before_history_window(self, app):
+        with app.app_context():
+            FxService.update_rate('USD', 'MXN', Decimal('19.0'))
+            self._history_at(app, [datetime(2025, 1, 1), datetime(2025, 6, 1)])
+
+            assert FxService.get_rate('USD', 'MXN', at=datetime(2025, 3, 1)) == Decimal('18.70')
+            assert FxService.get_rate('USD', 'MXN', at=datetime(2026, 1, 1)) == Decimal('19.0')
+            with pytest.raises(ValueError, match="FX rate not found"):
+                FxService.get_rate('USD', 'MXN', at=datetime(2024, 1, 1))
+
+    def test_get_rate_at_unchanged_pair_stays_in_memory(self, app):
+        with app.app_context():
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            self._history_at(app, [now - timedelta(days=3)])
+            FxService.get_rate('USD', 'MXN', at=now)
+
+            statements = TestFxRateCache._count_statements(
+                lambda: [FxService.get_rate('USD', 'MXN', at=now) for _ in range(100)]
+            )
+
+            assert statements == []
+            assert FxService.get_rate('USD', 'MXN', at=now - timedelta(hours=1)) == Decimal('18.70')
+
+class TestFxQuotes:
+
+    @staticmethod
+    def _quote(client, from_currency='USD', to_currency='MXN', user_id='user1'):
+        response = client.post(
+            '/fx/quotes',
+            data=json.dumps({'user_id': user_id, 'from_currency': from_currency, 'to_currency': to_currency}),
+            content_type='application/json'
+        )
+        return response.status_code, json.loads(response.data)
+
+    @staticmethod
+    def _convert(client, quote_id, amount=100, from_currency='USD', to_currency='MXN', user_id='user1'):
+        response = client.post(
+            f'/wallets/{user_id}/convert',
+            data=json.dumps({
+                'from_currency': from_currency,
+                'to_currency': to_currency,
+                'amount': amount,
+                'quote_id': quote_id
+            }),
+            content_type='application/json'
+        )
+        return response.status_code, json.loads(response.data)
+
+    def test_create_quote(self, client):
+        status, quote = self._quote(client)
+
+        assert status == 201
+        assert quote['user_id'] == 'user1'
+        assert quote['from_currency'] == 'USD'
+        assert quote['to_currency'] == 'MXN'
+        assert Decimal(str(quote['rate'])) == Decimal('18.70')
+        assert quote['expires_at'].endswith('Z')
+
+    def test_convert_uses_locked_rate_without_reading_rates(self, client, app):
+        with app.app_context():
+            WalletService.fund_wallet('user1', 'USD', Decimal('1000'))
+            _, quote = self._quote(client)
+            FxService.update_rate('USD', 'MXN', Decimal('20.0'))
+            FxService.supported_currencies()
+
+            statements = []
+
+            def record(conn, cursor, statement, parameters, context, executemany):
+                statements.append(statement)
+
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                status, result = self._convert(client, quote['quote_id'])
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+            assert status == 200
+            assert result['quote_id'] == quote['quote_id']
+            assert Decimal(str(result['converted_amount'])) == Decimal('1870')
+            assert not any('fx_rates' in statement for statement in statements)
+
+    def test_quote_is_single_use(self, client, app):
+        with app.app_context():
+            WalletService.fund_wallet('user1', 'USD', Decimal('1000'))
+            _, quote = self._quote(client)
+
+            assert self._convert(client, quote['quote_id'])[0] == 200
+            status, result = self._convert(client, quote['quote_id'])
+
+            assert status == 400
+            assert result['error'] == 'Quote not found or expired'
+
+    def test_failed_convert_keeps_quote(self, client, app):
+        with app.app_context():
+            _, quote = self._quote(client)
+
+            status, result = self._convert(client, quote['quote_id'], from_currency='MXN', to_currency='USD')
+            assert status == 400
+            assert result['error'] == 'Quote does not match the requested currency pair'
+
+            status, result = self._convert(client, quote['quote_id'])
+            assert status == 400
+            assert result['error'] == 'Insufficient funds'
+
+            WalletService.fund_wallet('user1', 'USD', Decimal('1000'))
+            assert self._convert(client, quote['quote_id'])[0] == 200
+
+    def test_quote_is_honoured_by_another_process(self, client, app):
+        with app.app_context():
+            WalletService.fund_wallet('user1', 'USD', Decimal('1000'))
+            _, quote = self._quote(client)
+            # A worker that did not issue the quote has nothing for it in memory.
+            app.extensions['fx_quote_store'] = FxQuoteStore(ttl=30, max_size=10)
+
+            status, result = self._convert(client, quote['quote_id'])
+
+            assert status == 200
+            assert Decimal(str(result['fx_rate'])) == Decimal('18.70')
+            assert FxRateQuote.query.count() == 0
+            assert self._convert(client, quote['quote_id'])[0] == 400
+
+    def test_quote_is_bound_to_its_user(self, client, app):
+        with app.app_context():
+            WalletService.fund_wallet('user2', 'USD', Decimal('1000'))
+            _, quote = self._quote(client, user_id='user1')
+
+            status, result = self._convert(client, quote['quote_id'], user_id='user2')
+
+            assert status == 400
+            assert result['error'] == 'Quote not found or expired'
+            assert FxRateQuote.query.count() == 1
+
+    def test_create_quote_requires_user(self, client):
+        response = client.post(
+            '/fx/quotes',
+            data=json.dumps({'from_currency': 'USD', 'to_currency': 'MXN'}),
+            content_type='application/json'
+        )
+
+        assert response.status_code == 400
+        assert 'user_id' in json.loads(response.data)['details']
+
+    def test_expired_quote_rejected(self, client, app):
+        with app.app_context():
+            WalletService.fund_wallet('user1', 'USD', Decimal('1000'))
+            app.extensions['fx_quote_store'].ttl = 0
+            _, quote = self._quote(client)
+
+            status, result = self._convert(client, quote['quote_id'])
+
+            assert status == 400
+            assert result['error'] == 'Quote not found or expired'
+
+    def test_store_evicts_oldest_beyond_max_size(self):
+        store = FxQuoteStore(ttl=30, max_size=2)
+        first = store.issue('user1', 'USD', 'MXN', Decimal('18.7'))
+        second = store.issue('user1', 'USD', 'MXN', Decimal('18.7'))
+        third = store.issue('user1', 'USD', 'MXN', Decimal('18.7'))
+
+        assert len(store) == 2
+        assert store.get(first.quote_id) is None
+        assert store.get(second.quote_id) == second
+        assert store.get(third.quote_id) == third
+
+    def test_store_purges_expired_quotes(self):
+        store = FxQuoteStore(ttl=0, max_size=10)
+        store.issue('user1', 'USD', 'MXN', Decimal('18.7'))
+        store.issue('user1', 'USD', 'MXN', Decimal('18.7'))
+
+        assert len(store) == 1
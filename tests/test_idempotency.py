@@ -0,0 +1,200 @@
+import json
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from sqlalchemy import event, update
+from app import db
+from app.cache import IdempotencyCache
+from app.models import IdempotencyKey, Transaction, Wallet
+from app.services import IdempotencyService, WalletService
+
+def _fund(client, key, amount=100, user_id='user1'):
+    return client.post(
+        f'/wallets/{user_id}/fund',
+        data=json.dumps({'currency': 'USD', 'amount': amount}),
+        content_type='application/json',
+        headers={'Idempotency-Key': key}
+    )
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class TestIdempotencyKeys:
+
+    @staticmethod
+    def _statements(callback):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            result = callback()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        return result, statements
+
+    def test_replay_returns_stored_response(self, client, app):
+        with app.app_context():
+            first = _fund(client, 'key-1')
+            replay = _fund(client, 'key-1')
+
+            assert first.status_code == 200
+            assert replay.status_code == 200
+            assert replay.data == first.data
+            assert replay.headers['Idempotent-Replayed'] == 'true'
+            assert 'Idempotent-Replayed' not in first.headers
+            assert Transaction.query.count() == 1
+            assert Wallet.query.filter_by(user_id='user1', currency='USD').one().balance == Decimal('100')
+
+    def test_cached_replay_issues_no_sql(self, client, app):
+        with app.app_context():
+            _fund(client, 'key-1')
+
+            replay, statements = self._statements(lambda: _fund(client, 'key-1'))
+
+            assert replay.status_code == 200
+            assert statements == []
+
+    def test_replay_from_database_skips_wallets(self, client, app):
+        with app.app_context():
+            _fund(client, 'key-1')
+            app.extensions['idempotency_cache'] = IdempotencyCache(10)
+
+            replay, statements = self._statements(lambda: _fund(client, 'key-1'))
+
+            assert replay.status_code == 200
+            assert replay.headers['Idempotent-Replayed'] == 'true'
+            assert not any('wallets' in statement or 'transactions' in statement for statement in statements)
+
+    def test_client_errors_are_replayed(self, client, app):
+        with app.app_context():
+            response = client.post(
+                '/wallets/user1/withdraw',
+                data=json.dumps({'currency': 'USD', 'amount': 50}),
+                content_type='application/json',
+                headers={'Idempotency-Key': 'key-1'}
+            )
+            assert response.status_code == 400
+
+            WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+            replay = client.post(
+                '/wallets/user1/withdraw',
+                data=json.dumps({'currency': 'USD', 'amount': 50}),
+                content_type='application/json',
+                headers={'Idempotency-Key': 'key-1'}
+            )
+
+            assert replay.status_code == 400
+            assert json.loads(replay.data)['error'] == 'Insufficient funds'
+
+    def test_key_reused_with_different_request(self, client, app):
+        with app.app_context():
+            _fund(client, 'key-1', amount=100)
+            response = _fund(client, 'key-1', amount=200)
+
+            assert response.status_code == 422
+            assert Transaction.query.count() == 1
+
+    def test_keys_are_scoped_per_user(self, client, app):
+        with app.app_context():
+            assert _fund(client, 'key-1', user_id='user1').status_code == 200
+            assert 'Idempotent-Replayed' not in _fund(client, 'key-1', user_id='user2').headers
+            assert Transaction.query.count() == 2
+
+    def test_in_flight_key_conflicts(self, client, app):
+        with app.app_context():
+            _fund(client, 'key-1')
+            record = IdempotencyKey.query.one()
+            record.status_code = None
+            db.session.commit()
+            app.extensions['idempotency_cache'] = IdempotencyCache(10)
+
+            assert _fund(client, 'key-1').status_code == 409
+            assert Transaction.query.count() == 1
+
+    def test_lapsed_claim_is_taken_over(self, client, app):
+        with app.app_context():
+            _fund(client, 'key-1')
+            record = IdempotencyKey.query.one()
+            record.status_code = None
+            record.expires_at = _utcnow() - timedelta(seconds=1)
+            db.session.commit()
+            app.extensions['idempotency_cache'] = IdempotencyCache(10)
+
+            response = _fund(client, 'key-1')
+
+            assert response.status_code == 200
+            assert 'Idempotent-Replayed' not in response.headers
+            assert IdempotencyKey.query.one().status_code == 200
+
+    def test_response_commits_with_the_ledger_write(self, client, app, monkeypatch):
+        with app.app_context():
+            def crash(*args, **kwargs):
+                raise RuntimeError("process died after commit")
+
+            with monkeypatch.context() as patch:
+                patch.setattr(IdempotencyService, 'remember', crash)
+                patch.setattr(IdempotencyService, 'complete', crash)
+                first = _fund(client, 'key-1')
+            app.extensions['idempotency_cache'] = IdempotencyCache(10)
+
+            replay = _fund(client, 'key-1')
+
+            assert first.status_code == 200
+            assert replay.headers['Idempotent-Replayed'] == 'true'
+            assert replay.data == first.data
+            assert Transaction.query.count() == 1
+
+    def test_taken_over_claim_does_not_apply(self, client, app, monkeypatch):
+        with app.app_context():
+            credit_wallet = WalletService._credit_wallet
+
+            def taken_over(*args):
+                # Another request takes the key over while this one is still running.
+                db.session.execute(update(IdempotencyKey).values(created_at=_utcnow() + timedelta(seconds=1)))
+                db.session.commit()
+                return credit_wallet(*args)
+
+            monkeypatch.setattr(WalletService, '_credit_wallet', taken_over)
+            response = _fund(client, 'key-1')
+
+            assert response.status_code == 409
+            assert Transaction.query.count() == 0
+            assert Wallet.query.count() == 0
+            assert IdempotencyKey.query.one().status_code is None
+
+    def test_server_error_releases_key(self, client, app, monkeypatch):
+        with app.app_context():
+            def fail(*args, **kwargs):
+                raise RuntimeError("boom")
+
+            with monkeypatch.context() as patch:
+                patch.setattr(WalletService, 'fund_wallet', fail)
+                assert _fund(client, 'key-1').status_code == 500
+            assert IdempotencyKey.query.count() == 0
+
+            assert _fund(client, 'key-1').status_code == 200
+            assert Transaction.query.count() == 1
+
+    def test_purge_expired(self, client, app):
+        with app.app_context():
+            _fund(client, 'key-1')
+            _fund(client, 'key-2')
+            IdempotencyKey.query.filter_by(key='key-1').one().expires_at = _utcnow() - timedelta(seconds=1)
+            db.session.commit()
+
+            assert IdempotencyService.purge_expired(batch_size=1) == 1
+            assert [record.key for record in IdempotencyKey.query.all()] == ['key-2']
+
+    def test_sweep_command_once(self, client, app, runner):
+        with app.app_context():
+            _fund(client, 'key-1')
+            IdempotencyKey.query.one().expires_at = _utcnow() - timedelta(seconds=1)
+            db.session.commit()
+
+            result = runner.invoke(args=['sweep-idempotency-keys', '--once'])
+
+            assert result.exit_code == 0
+            assert 'Purged 1 expired idempotency keys' in result.output
+            assert IdempotencyKey.query.count() == 0
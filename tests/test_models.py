@@ -0,0 +1,45 @@
+from datetime import datetime
+from sqlalchemy import text, tuple_
+from sqlalchemy.dialects import sqlite
+from app import db
+from app.models import Transaction
+
+def _query_plan(query):
+    compiled = query.statement.compile(dialect=sqlite.dialect(), compile_kwargs={'literal_binds': True})
+    rows = db.session.execute(text(f'EXPLAIN QUERY PLAN {compiled}')).all()
+    return ' | '.join(row[-1] for row in rows)
+
+class TestTransactionIndexes:
+
+    def test_history_query_uses_index(self, app):
+        with app.app_context():
+            plan = _query_plan(
+                Transaction.query.filter_by(user_id='user1')
+                .order_by(Transaction.created_at.desc(), Transaction.id.desc())
+                .limit(100)
+            )
+
+            assert 'USING INDEX ix_transactions_user_id_created_at' in plan
+            assert 'TEMP B-TREE' not in plan
+
+    def test_history_cursor_query_seeks_index(self, app):
+        with app.app_context():
+            plan = _query_plan(
+                Transaction.query.filter(
+                    Transaction.user_id == 'user1',
+                    tuple_(Transaction.created_at, Transaction.id) < tuple_(datetime(2026, 1, 1), 500)
+                )
+                .order_by(Transaction.created_at.desc(), Transaction.id.desc())
+                .limit(100)
+            )
+
+            assert 'USING INDEX ix_transactions_user_id_created_at (user_id=? AND created_at<' in plan
+            assert 'TEMP B-TREE' not in plan
+
+    def test_reconcile_range_uses_index(self, app):
+        with app.app_context():
+            plan = _query_plan(
+                Transaction.query.filter(Transaction.user_id == 'user1', Transaction.id > 10)
+            )
+
+            assert 'USING INDEX ix_transactions_user_id_id' in plan
@@ -0,0 +1,137 @@
+import os
+import uuid
+import pytest
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from flask_migrate import upgrade
+from sqlalchemy import create_engine, make_url, text
+from sqlalchemy.exc import OperationalError
+from app import create_app, db
+from app.models import Transaction, TransactionType, Wallet
+from app.services import LedgerPartitionService, WalletService
+
+MIGRATIONS = os.path.join(os.path.dirname(__file__), os.pardir, 'migrations')
+
+def _transaction(transaction_type, amount, created_at):
+    return Transaction(
+        user_id='user1',  # type: ignore[call-arg]
+        transaction_type=transaction_type,  # type: ignore[call-arg]
+        currency='USD',  # type: ignore[call-arg]
+        amount=Decimal(amount),  # type: ignore[call-arg]
+        created_at=created_at  # type: ignore[call-arg]
+    )
+
+@pytest.fixture
+def postgres_app(tmp_path):
+    """An app migrated into a throwaway schema on ``TEST_POSTGRES_URL``, dropped afterwards."""
+    url = os.getenv('TEST_POSTGRES_URL')
+    if not url:
+        pytest.skip('TEST_POSTGRES_URL is not set')
+    pytest.importorskip('psycopg2')
+    schema = f'test_{uuid.uuid4().hex[:12]}'
+    admin = create_engine(url)
+    try:
+        with admin.begin() as connection:
+            connection.execute(text(f'CREATE SCHEMA {schema}'))
+    except OperationalError:
+        admin.dispose()
+        pytest.skip('PostgreSQL server is not available')
+
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': make_url(url).update_query_dict(
+            {'options': f'-csearch_path={schema}'}
+        ).render_as_string(hide_password=False),
+        'RECONCILE_CHECKPOINT_SETTLE_SECONDS': 0,
+        'LEDGER_ARCHIVE_DIR': str(tmp_path / 'archive'),
+        'BALANCE_CACHE_SIZE': 0
+    })
+    try:
+        with app.app_context():
+            yield app
+            db.session.remove()
+            db.engine.dispose()
+    finally:
+        with admin.begin() as connection:
+            connection.execute(text(f'DROP SCHEMA {schema} CASCADE'))
+        admin.dispose()
+
+class TestLedgerPartitions:
+
+    def test_month_arithmetic_and_names(self):
+        assert LedgerPartitionService.add_months(datetime(2026, 11, 1), 2) == datetime(2027, 1, 1)
+        assert LedgerPartitionService.add_months(datetime(2026, 1, 1), -1) == datetime(2025, 12, 1)
+        assert LedgerPartitionService.partition_name(datetime(2026, 3, 1)) == 'transactions_y2026m03'
+
+    def test_parse_bound(self):
+        bound = "FOR VALUES FROM ('2026-03-01 00:00:00') TO ('2026-04-01 00:00:00')"
+
+        assert LedgerPartitionService.parse_bound(bound) == (datetime(2026, 3, 1), datetime(2026, 4, 1))
+        assert LedgerPartitionService.parse_bound('DEFAULT') is None
+
+    def test_sqlite_fallback_is_a_no_op(self, app):
+        with app.app_context():
+            assert LedgerPartitionService.is_partitioned() is False
+            assert LedgerPartitionService.list_partitions() == []
+            assert LedgerPartitionService.ensure_partitions(3) == []
+            assert LedgerPartitionService.detach_partitions(datetime(2030, 1, 1)) == []
+
+    def test_detach_rejects_unsafe_schema(self, app):
+        with app.app_context():
+            with pytest.raises(ValueError, match='Archive schema'):
+                LedgerPartitionService.detach_partitions(datetime(2030, 1, 1), archive_schema='x; DROP TABLE wallets')
+
+    def test_cli_commands(self, runner):
+        result = runner.invoke(args=['ensure-ledger-partitions', '--once'])
+        assert result.exit_code == 0
+        assert 'not partitioned' in result.output
+
+        result = runner.invoke(args=['detach-ledger-partitions', '--before', '2030-01-01'])
+        assert result.exit_code == 0
+        assert 'Detached 0 ledger partitions' in result.output
+
+        result = runner.invoke(args=['detach-ledger-partitions', '--before', 'soon'])
+        assert result.exit_code != 0
+
+@pytest.mark.postgres
+class TestLedgerPartitionsOnPostgres:
+
+    def test_partitioned_ledger_prunes_and_detaches(self, postgres_app):
+        upgrade(directory=MIGRATIONS, revision='d2a78057c3ab')
+        assert LedgerPartitionService.is_partitioned() is True
+        upgrade(directory=MIGRATIONS)
+
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        current = LedgerPartitionService.partition_name(datetime(now.year, now.month, 1))
+        assert LedgerPartitionService.ensure_partitions(3) == []
+        assert LedgerPartitionService.ensure_partitions(1, now=datetime(2020, 1, 15)) == [
+            'transactions_y2020m01', 'transactions_y2020m02'
+        ]
+
+        db.session.add_all([
+            _transaction(TransactionType.FUND, '100', datetime(2020, 1, 10)),
+            _transaction(TransactionType.WITHDRAW, '30', datetime(2020, 2, 10)),
+            _transaction(TransactionType.FUND, '50', now - timedelta(minutes=1)),
+            Wallet(user_id='user1', currency='USD', balance=Decimal('120'))  # type: ignore[call-arg]
+        ])
+        db.session.commit()
+        rows = {name: db.session.execute(text(f'SELECT count(*) FROM {name}')).scalar()
+                for name in ('transactions_y2020m01', 'transactions_y2020m02', current)}
+        assert rows == {'transactions_y2020m01': 1, 'transactions_y2020m02': 1, current: 1}
+
+        february = Transaction.query.filter(Transaction.created_at == datetime(2020, 2, 10)).one()
+        stmt, _ = WalletService.transactions_statement('user1', 10, WalletService._encode_cursor(february))
+        connection = db.session.connection()
+        compiled = stmt.compile(connection)
+        plan = '\n'.join(row[0] for row in connection.exec_driver_sql(f'EXPLAIN {compiled}', compiled.params))
+        assert 'transactions_y2020m01' in plan
+        assert current not in plan
+        db.session.rollback()
+
+        with pytest.raises(ValueError, match='not covered'):
+            LedgerPartitionService.detach_partitions(datetime(2020, 2, 1))
+        assert WalletService.reconcile_balances('user1')['reconciled'] is True
+
+        assert LedgerPartitionService.detach_partitions(datetime(2020, 2, 1)) == ['transactions_y2020m01']
+        assert 'transactions_y2020m01' not in [name for name, _, _ in LedgerPartitionService.list_partitions()]
+        assert WalletService.reconcile_balances('user1')['reconciled'] is True
@@ -0,0 +1,61 @@
+import pytest
+from app import create_app
+from app.profiles import async_database_url, engine_options, load_profile
+
+class TestConfigProfiles:
+
+    def test_engine_options_from_environment(self, monkeypatch):
+        monkeypatch.setenv('DB_POOL_SIZE', '25')
+        monkeypatch.setenv('DB_MAX_OVERFLOW', '5')
+        monkeypatch.setenv('DB_POOL_PRE_PING', 'false')
+        monkeypatch.setenv('DB_POOL_RECYCLE', '600')
+
+        options = engine_options('postgresql://fx_user@localhost/fx_processor')
+
+        assert options == {
+            'pool_pre_ping': False,
+            'pool_recycle': 600,
+            'pool_size': 25,
+            'max_overflow': 5,
+            'pool_timeout': 30.0
+        }
+
+    def test_engine_options_skip_pool_sizing_for_sqlite(self):
+        options = engine_options('sqlite:///fx.db')
+
+        assert options == {'pool_pre_ping': True, 'pool_recycle': 1800}
+
+    def test_production_profile_sets_engine_options(self):
+        profile = load_profile('production', 'postgresql://fx_user@localhost/fx_processor')
+
+        assert profile['SQLALCHEMY_ENGINE_OPTIONS']['pool_size'] == 10
+        assert profile['SQLALCHEMY_ENGINE_OPTIONS']['max_overflow'] == 20
+
+    def test_async_database_url(self):
+        assert async_database_url('postgresql://fx_user@localhost/fx_processor') == 'postgresql+asyncpg://fx_user@localhost/fx_processor'
+        assert async_database_url('postgresql+psycopg2://fx_user@localhost/fx') == 'postgresql+asyncpg://fx_user@localhost/fx'
+        assert async_database_url('sqlite:///fx.db') == 'sqlite+aiosqlite:///fx.db'
+
+        with pytest.raises(ValueError, match='No async driver'):
+            async_database_url('mysql://fx_user@localhost/fx')
+
+    def test_unknown_profile(self):
+        with pytest.raises(ValueError, match='Unknown config profile'):
+            load_profile('staging', 'sqlite://')
+
+    def test_create_app_with_profile_and_overrides(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('DATABASE_URL', 'sqlite://')
+
+        assert create_app('testing').config['TESTING'] is True
+
+        database_uri = f"sqlite:///{tmp_path / 'fx.db'}"
+        app = create_app({'SQLALCHEMY_DATABASE_URI': database_uri, 'WALLET_MAX_RETRIES': 1})
+        assert app.config['SQLALCHEMY_DATABASE_URI'] == database_uri
+        assert app.config['WALLET_MAX_RETRIES'] == 1
+
+    def test_create_app_production_profile(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'fx.db'}")
+
+        app = create_app('production')
+
+        assert app.config['SQLALCHEMY_ENGINE_OPTIONS'] == {'pool_pre_ping': True, 'pool_recycle': 1800}
@@ -0,0 +1,101 @@
+import pytest
+import json
+import time
+from decimal import Decimal
+from sqlalchemy import event
+from app import db
+from app.models import FxRate, FxRateHistory
+from app.providers import FileRateProvider, build_provider, parse_rate_table
+from app.services import FxService
+from app.workers import RateIngestionWorker
+
+def _write_rates(path, table):
+    path.write_text(json.dumps(table))
+    return str(path)
+
+class TestRateProviders:
+
+    def test_parse_rate_table_skips_invalid_entries(self):
+        rates = parse_rate_table({
+            'USD/MXN': '18.9',
+            'usd/eur': 0.92,
+            'USDJPY': '150',
+            'USD/BRL': 'n/a',
+            'USD/CAD': '-1'
+        })
+
+        assert rates == {('USD', 'MXN'): Decimal('18.9'), ('USD', 'EUR'): Decimal('0.92')}
+
+    def test_file_provider(self, tmp_path):
+        path = _write_rates(tmp_path / 'rates.json', {'USD/MXN': '18.9'})
+
+        assert FileRateProvider(path).fetch_rates() == {('USD', 'MXN'): Decimal('18.9')}
+
+    def test_build_provider_requires_path(self):
+        with pytest.raises(ValueError, match='FX_RATE_PROVIDER_PATH'):
+            build_provider({'FX_RATE_PROVIDER': 'file'})
+
+class TestRateIngestion:
+
+    def test_upsert_rates_uses_one_statement_and_commit(self, app):
+        with app.app_context():
+            rates = {('USD', f'X{i:02d}'): Decimal(i + 1) for i in range(500)}
+            rates[('USD', 'MXN')] = Decimal('19.25')
+            statements = []
+            commits = []
+
+            def record(conn, cursor, statement, parameters, context, executemany):
+                statements.append(statement)
+
+            def record_commit(session):
+                commits.append(session)
+
+            event.listen(db.engine, 'before_cursor_execute', record)
+            event.listen(db.session, 'after_commit', record_commit)
+            try:
+                assert FxService.upsert_rates(rates) == 501
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+                event.remove(db.session, 'after_commit', record_commit)
+
+            assert len([s for s in statements if s.startswith('INSERT INTO fx_rates')]) == 1
+            assert len(commits) == 1
+            assert FxRate.query.count() == 502
+            assert FxService.get_rate('USD', 'MXN') == Decimal('19.25')
+            assert FxRateHistory.query.filter_by(to_currency='X42').one().rate == Decimal('43')
+
+    def test_worker_run_once(self, app, tmp_path):
+        with app.app_context():
+            path = _write_rates(tmp_path / 'rates.json', {'USD/MXN': '18.95', 'USD/EUR': '0.91'})
+            worker = RateIngestionWorker(app, FileRateProvider(path), interval=60)
+
+            assert worker.run_once() == 2
+            assert FxService.get_rate('EUR', 'MXN') == Decimal('20.82417582')
+
+    def test_worker_thread_ingests_until_stopped(self, app, tmp_path):
+        path = _write_rates(tmp_path / 'rates.json', {'USD/MXN': '19.40'})
+        worker = RateIngestionWorker(app, FileRateProvider(path), interval=0.05)
+
+        worker.start()
+        try:
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                with app.app_context():
+                    if FxService.get_rate('USD', 'MXN') == Decimal('19.40'):
+                        break
+                time.sleep(0.05)
+        finally:
+            worker.stop(timeout=5)
+
+        assert not worker.is_alive()
+        with app.app_context():
+            assert FxService.get_rate('USD', 'MXN') == Decimal('19.40')
+
+    def test_ingest_rates_command_once(self, app, runner, tmp_path):
+        with app.app_context():
+            app.config['FX_RATE_PROVIDER_PATH'] = _write_rates(tmp_path / 'rates.json', {'USD/MXN': '19.1'})
+
+            result = runner.invoke(args=['ingest-rates', '--once'])
+
+            assert result.exit_code == 0
+            assert 'Ingested 1 FX rates' in result.output
@@ -0,0 +1,83 @@
+import csv
+import json
+from decimal import Decimal
+from app import db
+from app.models import Wallet
+from app.services import ReconciliationService, WalletService
+
+def _seed(users):
+    for index in range(users):
+        WalletService.fund_wallet(f'user{index:03d}', 'USD', Decimal('100'))
+    WalletService.convert_currency('user001', 'USD', 'MXN', Decimal('10'))
+
+def _corrupt(user_id, currency, balance):
+    Wallet.query.filter_by(user_id=user_id, currency=currency).update({'balance': balance})
+    db.session.commit()
+
+class TestReconcileAll:
+
+    def test_plan_shards(self, app):
+        with app.app_context():
+            _seed(5)
+
+            assert ReconciliationService.plan_shards(2) == [
+                ('user000', 'user001'), ('user002', 'user003'), ('user004', 'user004')
+            ]
+
+    def test_reconcile_all_reports_discrepancies(self, app, tmp_path):
+        with app.app_context():
+            _seed(5)
+            _corrupt('user001', 'MXN', Decimal('1'))
+            _corrupt('user003', 'USD', Decimal('99.5'))
+            output = str(tmp_path / 'report.jsonl')
+
+            summary = ReconciliationService.reconcile_all(output, shard_size=2)
+
+            assert summary == {'shards': 3, 'skipped_shards': 0, 'discrepancies': 2}
+            with open(output) as report:
+                rows = [json.loads(line) for line in report]
+            assert sorted((row['user_id'], row['currency'], row['difference']) for row in rows) == [
+                ('user001', 'MXN', '-186.00000000'),
+                ('user003', 'USD', '-0.50000000')
+            ]
+
+    def test_reconcile_all_resumes_unfinished_shards(self, app, tmp_path):
+        with app.app_context():
+            _seed(4)
+            _corrupt('user000', 'USD', Decimal('1'))
+            _corrupt('user003', 'USD', Decimal('1'))
+            output = str(tmp_path / 'report.jsonl')
+            with open(f'{output}.progress', 'w') as progress:
+                progress.write(json.dumps({'shards': [['user000', 'user001'], ['user002', 'user003']]}) + '\n')
+                progress.write(json.dumps({'done': 0}) + '\n')
+
+            summary = ReconciliationService.reconcile_all(output, resume=True)
+
+            assert summary == {'shards': 2, 'skipped_shards': 1, 'discrepancies': 1}
+            with open(output) as report:
+                assert [json.loads(line)['user_id'] for line in report] == ['user003']
+
+    def test_reconcile_all_in_process_pool(self, app, tmp_path):
+        with app.app_context():
+            _seed(6)
+            _corrupt('user005', 'USD', Decimal('0'))
+            output = str(tmp_path / 'report.csv')
+
+            summary = ReconciliationService.reconcile_all(output, report_format='csv', shard_size=2, workers=2)
+
+            assert summary['discrepancies'] == 1
+            with open(output, newline='') as report:
+                rows = list(csv.DictReader(report))
+            assert [(row['user_id'], row['currency']) for row in rows] == [('user005', 'USD')]
+
+    def test_reconcile_all_command(self, app, runner, tmp_path):
+        with app.app_context():
+            _seed(3)
+            output = str(tmp_path / 'report.csv')
+
+            result = runner.invoke(args=['reconcile-all', '--output', output, '--workers', '1'])
+
+            assert result.exit_code == 0
+            assert '0 discrepancies' in result.output
+            with open(output, newline='') as report:
+                assert list(csv.DictReader(report)) == []
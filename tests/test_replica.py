@@ -0,0 +1,145 @@
+import pytest
+from flask import current_app
+from decimal import Decimal
+from sqlalchemy import create_engine, delete, insert, select, update
+from app import create_app, db
+from app.models import ReconciliationCheckpoint, Wallet
+from app.replica import ReadRouter
+from app.services import FxService, WalletService
+
+@pytest.fixture
+def replica_app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'primary.db'}",
+        'DATABASE_REPLICA_URL': f"sqlite:///{tmp_path / 'replica.db'}",
+        'READ_YOUR_WRITES_WINDOW': 60,
+        'RECONCILE_CHECKPOINT_SETTLE_SECONDS': 0,
+        'BALANCE_CACHE_SIZE': 0
+    })
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(replica_engine())
+        FxService.initialize_rates()
+        replicate()
+        yield app
+
+def replicate():
+    """Copy every table from the primary to the replica, as if replication caught up."""
+    with replica_engine().begin() as connection:
+        for table in reversed(db.metadata.sorted_tables):
+            connection.execute(delete(table))
+        for table in db.metadata.sorted_tables:
+            rows = db.session.execute(select(table)).mappings().all()
+            if rows:
+                connection.execute(insert(table), [dict(row) for row in rows])
+
+def replica_engine():
+    return current_app.extensions['read_router'].engine
+
+def expire_writes(app):
+    app.extensions['read_router'].window = 0
+
+class TestReadReplica:
+
+    def test_balances_read_own_writes_then_replica(self, replica_app):
+        WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+        replicate()
+        WalletService.fund_wallet('user1', 'USD', Decimal('50'))
+
+        assert WalletService.get_balances('user1') == {'USD': 150.0}
+
+        expire_writes(replica_app)
+        assert WalletService.get_balances('user1') == {'USD': 100.0}
+
+    def test_other_users_read_the_replica(self, replica_app):
+        WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+
+        assert WalletService.get_balances('user2') == {}
+        assert WalletService.get_transactions('user1')['transactions'] != []
+        assert WalletService.get_transactions('user2')['transactions'] == []
+
+    def test_transactions_from_replica(self, replica_app):
+        WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+        replicate()
+        WalletService.fund_wallet('user1', 'USD', Decimal('50'))
+        expire_writes(replica_app)
+
+        page = WalletService.get_transactions('user1')
+
+        assert [txn['amount'] for txn in page['transactions']] == [100.0]
+
+    def test_replica_reads_see_later_replication(self, replica_app):
+        expire_writes(replica_app)
+        WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+        assert WalletService.get_balances('user1') == {}
+
+        replicate()
+        assert WalletService.get_balances('user1') == {'USD': 100.0}
+
+    def test_rates_from_replica(self, replica_app):
+        before = FxService.get_all_rates()['USD/MXN']['rate']
+
+        FxService.update_rate('USD', 'MXN', Decimal('99'))
+
+        assert FxService.get_all_rates()['USD/MXN']['rate'] == before
+        replicate()
+        assert FxService.get_all_rates()['USD/MXN']['rate'] == 99.0
+
+    def test_reconcile_reads_replica_and_checkpoints_primary(self, replica_app):
+        WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+        replicate()
+        expire_writes(replica_app)
+        with replica_engine().begin() as connection:
+            connection.execute(update(Wallet).where(Wallet.user_id == 'user1').values(balance=Decimal('90')))
+
+        result = WalletService.reconcile_balances('user1', full=True)
+
+        assert result['reconciled'] is False
+        assert result['discrepancies']['USD']['actual'] == 90.0
+        assert ReconciliationCheckpoint.query.filter_by(user_id='user1').count() == 1
+        with replica_engine().connect() as connection:
+            assert connection.execute(select(ReconciliationCheckpoint)).all() == []
+
+    def test_lagging_replica_does_not_corrupt_checkpoint(self, replica_app):
+        WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+        replicate()
+        WalletService.fund_wallet('user1', 'USD', Decimal('50'))
+        expire_writes(replica_app)
+
+        WalletService.reconcile_balances('user1')
+
+        checkpoint = ReconciliationCheckpoint.query.filter_by(user_id='user1').one()
+        assert checkpoint.calculated_balance == Decimal('150')
+        replicate()
+        assert WalletService.reconcile_balances('user1')['reconciled'] is True
+
+    def test_endpoint_reads_own_write(self, replica_app):
+        client = replica_app.test_client()
+
+        assert client.post('/wallets/user1/fund', json={'currency': 'USD', 'amount': 100}).status_code == 200
+
+        assert client.get('/wallets/user1/balances').get_json() == {'USD': 100.0}
+
+    def test_without_replica_reads_go_to_primary(self, app):
+        WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+
+        assert app.extensions['read_router'].enabled is False
+        assert WalletService.get_balances('user1') == {'USD': 100.0}
+
+class TestReadRouter:
+
+    def test_expired_writes_are_pruned(self, monkeypatch):
+        router = ReadRouter(window=10, engine=create_engine('sqlite://'))
+        now = [1000.0]
+        monkeypatch.setattr('app.replica.time.monotonic', lambda: now[0])
+
+        router.record_write('user1')
+        assert router.use_replica('user1') is False
+        assert router.use_replica('user2') is True
+        assert router.use_replica() is True
+
+        now[0] += 11
+        assert router.use_replica('user1') is True
+        router.record_write('user2')
+        assert list(router._writes) == ['user2']
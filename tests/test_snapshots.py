@@ -0,0 +1,84 @@
+import json
+from datetime import datetime, timezone
+from decimal import Decimal
+import pytest
+from app import db
+from app.models import Transaction, WalletBalanceSnapshot
+from app.services import SnapshotService, WalletService
+
+def _fund_at(user_id, currency, amount, created_at):
+    WalletService.fund_wallet(user_id, currency, Decimal(amount))
+    latest = db.session.query(db.func.max(Transaction.id)).scalar()
+    Transaction.query.filter_by(id=latest).update({'created_at': created_at})
+    db.session.commit()
+
+class TestBalanceSnapshots:
+
+    def test_build_snapshots_carries_balances_forward(self, app):
+        with app.app_context():
+            _fund_at('user1', 'USD', '100', datetime(2026, 1, 15))
+            _fund_at('user2', 'MXN', '50', datetime(2026, 1, 20))
+
+            assert SnapshotService.build_snapshots(datetime(2026, 1, 31)) == 2
+
+            _fund_at('user1', 'USD', '25', datetime(2026, 2, 10))
+            assert SnapshotService.build_snapshots(datetime(2026, 2, 28)) == 2
+
+            february = {
+                (s.user_id, s.currency): s.balance
+                for s in WalletBalanceSnapshot.query.filter_by(as_of=datetime(2026, 2, 28))
+            }
+            assert february == {('user1', 'USD'): Decimal('125'), ('user2', 'MXN'): Decimal('50')}
+
+    def test_build_snapshots_rejects_duplicate_batch(self, app):
+        with app.app_context():
+            _fund_at('user1', 'USD', '100', datetime(2026, 1, 15))
+            SnapshotService.build_snapshots(datetime(2026, 1, 31))
+
+            with pytest.raises(ValueError, match="already exist"):
+                SnapshotService.build_snapshots(datetime(2026, 1, 31))
+
+    def test_build_snapshots_waits_for_settle_window(self, app):
+        with app.app_context():
+            WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+
+            with pytest.raises(ValueError, match='SNAPSHOT_SETTLE_SECONDS'):
+                SnapshotService.build_snapshots(datetime.now(timezone.utc).replace(tzinfo=None))
+            # The default batch sits behind the settle window, so the fresh
+            # transaction is left for the next batch rather than skipped.
+            assert SnapshotService.build_snapshots() == 0
+            app.config['SNAPSHOT_SETTLE_SECONDS'] = 0
+            assert SnapshotService.build_snapshots() == 1
+            assert WalletBalanceSnapshot.query.one().balance == Decimal('100')
+
+    def test_balances_as_of(self, app):
+        with app.app_context():
+            _fund_at('user1', 'USD', '100', datetime(2026, 1, 15))
+            SnapshotService.build_snapshots(datetime(2026, 1, 31))
+            _fund_at('user1', 'USD', '25', datetime(2026, 2, 10))
+            _fund_at('user1', 'MXN', '70', datetime(2026, 3, 5))
+
+            assert SnapshotService.get_balances_as_of('user1', datetime(2026, 1, 1)) == {}
+            assert SnapshotService.get_balances_as_of('user1', datetime(2026, 1, 20)) == {'USD': 100}
+            assert SnapshotService.get_balances_as_of('user1', datetime(2026, 2, 28)) == {'USD': 125}
+            assert SnapshotService.get_balances_as_of('user1', datetime(2026, 3, 31)) == {'USD': 125, 'MXN': 70}
+
+    def test_balances_endpoint_as_of(self, client, app):
+        with app.app_context():
+            _fund_at('user1', 'USD', '100', datetime(2026, 1, 15))
+            _fund_at('user1', 'USD', '40', datetime(2026, 4, 2))
+
+            response = client.get('/wallets/user1/balances?as_of=2026-03-31T23:59:59Z')
+            assert response.status_code == 200
+            assert json.loads(response.data) == {'USD': 100}
+
+            assert client.get('/wallets/user1/balances?as_of=soon').status_code == 400
+
+    def test_build_snapshots_command(self, app, runner):
+        with app.app_context():
+            _fund_at('user1', 'USD', '100', datetime(2026, 1, 15))
+
+            result = runner.invoke(args=['build-snapshots', '--as-of', '2026-01-31T00:00:00'])
+
+            assert result.exit_code == 0
+            assert 'Wrote 1 balance snapshots' in result.output
@@ -1,7 +1,11 @@
 import pytest
 import json
+from datetime import datetime
+from sqlalchemy import event
 from decimal import Decimal
-from app.models import Wallet, Transaction, TransactionType
+from app import db
+from app.cache import BalanceCache, MemoryBalanceBackend
+from app.models import Wallet, Transaction, TransactionType, ReconciliationCheckpoint
 from app.services import WalletService
 
 class TestWalletEndpoints:
@@ -161,6 +165,66 @@ class TestWalletEndpoints:
             assert data['transactions'][0]['currency'] == 'USD'
             assert data['transactions'][0]['amount'] == 1000
 
+    def test_get_transactions_pages_with_cursor(self, client, app):
+        with app.app_context():
+            for amount in range(1, 6):
+                WalletService.fund_wallet('user1', 'USD', Decimal(amount))
+            # Identical timestamps must still page deterministically on id.
+            Transaction.query.update({'created_at': datetime(2026, 1, 1)})
+            db.session.commit()
+
+            seen = []
+            cursor = None
+            while True:
+                url = '/wallets/user1/transactions?limit=2'
+                if cursor:
+                    url += f'&cursor={cursor}'
+                data = json.loads(client.get(url).data)
+                seen.extend(txn['id'] for txn in data['transactions'])
+                cursor = data['next_cursor']
+                if cursor is None:
+                    break
+
+            assert seen == [5, 4, 3, 2, 1]
+
+    def test_get_transactions_invalid_cursor(self, client):
+        response = client.get('/wallets/user1/transactions?cursor=not-a-cursor')
+
+        assert response.status_code == 400
+        assert json.loads(response.data)['error'] == 'Invalid cursor'
+
+    def test_export_transactions_ndjson(self, client, app):
+        with app.app_context():
+            for amount in (10, 20, 30):
+                WalletService.fund_wallet('user1', 'USD', Decimal(amount))
+            Transaction.query.filter_by(id=1).update({'created_at': datetime(2025, 12, 31, 23, 0)})
+            db.session.commit()
+
+            response = client.get('/wallets/user1/transactions/export')
+            assert response.status_code == 200
+            assert response.mimetype == 'application/x-ndjson'
+            rows = [json.loads(line) for line in response.data.decode().splitlines()]
+            assert [row['amount'] for row in rows] == [10, 20, 30]
+
+            response = client.get('/wallets/user1/transactions/export?from=2026-01-01T00:00:00%2B00:00')
+            rows = [json.loads(line) for line in response.data.decode().splitlines()]
+            assert [row['amount'] for row in rows] == [20, 30]
+
+    def test_export_transactions_csv(self, client, app):
+        with app.app_context():
+            WalletService.fund_wallet('user1', 'USD', Decimal('10'))
+
+            response = client.get('/wallets/user1/transactions/export?format=csv&to=2000-01-01')
+
+            assert response.status_code == 200
+            assert response.data.decode().splitlines() == [
+                'id,type,currency,amount,from_currency,to_currency,fx_rate,timestamp'
+            ]
+
+    def test_export_transactions_invalid_arguments(self, client):
+        assert client.get('/wallets/user1/transactions/export?format=xml').status_code == 400
+        assert client.get('/wallets/user1/transactions/export?from=yesterday').status_code == 400
+
     def test_reconciliation_success(self, client, app):
         with app.app_context():
             client.post(
@@ -176,6 +240,45 @@ class TestWalletEndpoints:
             assert data['reconciled'] is True
             assert data['discrepancies'] == {}
 
+    def test_batch_reports_per_item_results(self, client, app):
+        with app.app_context():
+            response = client.post(
+                '/wallets/batch',
+                data=json.dumps({'operations': [
+                    {'user_id': 'user1', 'type': 'fund', 'currency': 'USD', 'amount': 100},
+                    {'user_id': 'user1', 'type': 'withdraw', 'currency': 'USD', 'amount': 30},
+                    {'user_id': 'user1', 'type': 'withdraw', 'currency': 'USD', 'amount': 100},
+                    {'user_id': 'user2', 'type': 'fund', 'currency': 'EUR', 'amount': 10},
+                    {'user_id': 'user2', 'type': 'fund', 'currency': 'MXN', 'amount': 500}
+                ]}),
+                content_type='application/json'
+            )
+
+            assert response.status_code == 200
+            data = json.loads(response.data)
+            assert [item['success'] for item in data['results']] == [True, True, False, False, True]
+            assert data['results'][2]['error'] == 'Insufficient funds'
+            assert 'currency' in data['results'][3]['details']
+            assert data['succeeded'] == 3
+            assert data['failed'] == 2
+
+            assert WalletService.get_balances('user1') == {'USD': 70}
+            assert WalletService.get_balances('user2') == {'MXN': 500}
+
+    def test_batch_requires_operations(self, client):
+        response = client.post(
+            '/wallets/batch',
+            data=json.dumps({'operations': []}),
+            content_type='application/json'
+        )
+
+        assert response.status_code == 400
+
+    def test_reconcile_rejects_unknown_mode(self, client):
+        response = client.get('/wallets/user1/reconcile?mode=partial')
+
+        assert response.status_code == 400
+
 class TestWalletServices:
 
     def test_get_or_create_wallet(self, app):
@@ -188,6 +291,33 @@ class TestWalletServices:
             same_wallet = WalletService.get_or_create_wallet('user1', 'USD')
             assert wallet.id == same_wallet.id
 
+    def test_get_or_create_wallet_does_not_commit(self, app):
+        with app.app_context():
+            WalletService.get_or_create_wallet('user1', 'USD')
+            db.session.rollback()
+
+            assert Wallet.query.filter_by(user_id='user1', currency='USD').first() is None
+
+    def test_fund_wallet_provisions_wallet_in_one_statement(self, app):
+        with app.app_context():
+            statements = []
+
+            def record(conn, cursor, statement, parameters, context, executemany):
+                statements.append(statement)
+
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                WalletService.fund_wallet('user1', 'USD', Decimal('50'))
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+            wallet_statements = [s for s in statements if 'wallets' in s]
+            assert len(wallet_statements) == 1
+            assert 'ON CONFLICT' in wallet_statements[0]
+
+            WalletService.fund_wallet('user1', 'USD', Decimal('25'))
+            assert WalletService.get_balances('user1') == {'USD': 75}
+
     def test_fund_wallet_service(self, app):
         with app.app_context():
             result = WalletService.fund_wallet('user1', 'USD', Decimal('1000'))
@@ -219,6 +349,33 @@ class TestWalletServices:
             with pytest.raises(ValueError, match="Insufficient funds"):
                 WalletService.withdraw_funds('user1', 'USD', Decimal('1000'))
 
+    def test_withdraw_checks_funds_in_database(self, app):
+        with app.app_context():
+            WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+            wallet = Wallet.query.filter_by(user_id='user1', currency='USD').first()
+            assert wallet is not None
+
+            WalletService.withdraw_funds('user1', 'USD', Decimal('60'))
+            with pytest.raises(ValueError, match="Insufficient funds"):
+                WalletService.withdraw_funds('user1', 'USD', Decimal('60'))
+
+            db.session.refresh(wallet)
+            assert wallet.balance == Decimal('40')
+            assert Transaction.query.filter_by(
+                user_id='user1',
+                transaction_type=TransactionType.WITHDRAW
+            ).count() == 1
+
+    def test_convert_insufficient_funds_leaves_balances(self, app):
+        with app.app_context():
+            WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+
+            with pytest.raises(ValueError, match="Insufficient funds"):
+                WalletService.convert_currency('user1', 'USD', 'MXN', Decimal('150'))
+
+            assert WalletService.get_balances('user1') == {'USD': 100}
+            assert Transaction.query.filter_by(user_id='user1').count() == 1
+
     def test_convert_currency_service(self, app):
         with app.app_context():
             WalletService.fund_wallet('user1', 'USD', Decimal('1000'))
@@ -244,6 +401,38 @@ class TestWalletServices:
             with pytest.raises(ValueError, match="Cannot convert to the same currency"):
                 WalletService.convert_currency('user1', 'USD', 'USD', Decimal('100'))
 
+    def test_apply_batch_service(self, app):
+        with app.app_context():
+            WalletService.fund_wallet('user1', 'USD', Decimal('10'))
+
+            results = WalletService.apply_batch([
+                {'user_id': 'user1', 'type': 'withdraw', 'currency': 'USD', 'amount': Decimal('4')},
+                {'user_id': 'user1', 'type': 'fund', 'currency': 'MXN', 'amount': Decimal('0')},
+                {'user_id': 'user3', 'type': 'fund', 'currency': 'USD', 'amount': Decimal('7.5')}
+            ])
+
+            assert results[0] == {'success': True, 'balance': Decimal('6')}
+            assert results[1]['success'] is False
+            assert results[2] == {'success': True, 'balance': Decimal('7.5')}
+            assert Transaction.query.count() == 3
+            assert WalletService.reconcile_balances('user1')['reconciled'] is True
+            assert WalletService.reconcile_balances('user3')['reconciled'] is True
+
+    def test_apply_batch_failed_ops_create_no_wallets(self, app):
+        with app.app_context():
+            results = WalletService.apply_batch([
+                {'user_id': 'ghost', 'type': 'withdraw', 'currency': 'MXN', 'amount': Decimal('5')},
+                {'user_id': 'ghost', 'type': 'fund', 'currency': 'EUR', 'amount': Decimal('0')},
+                {'user_id': 'user1', 'type': 'fund', 'currency': 'USD', 'amount': Decimal('3')},
+                {'user_id': 'user1', 'type': 'withdraw', 'currency': 'USD', 'amount': Decimal('2')}
+            ])
+
+            assert [result['success'] for result in results] == [False, False, True, True]
+            assert results[0]['error'] == 'Insufficient funds'
+            assert [(wallet.user_id, wallet.currency, wallet.balance) for wallet in Wallet.query.all()] == [
+                ('user1', 'USD', Decimal('1'))
+            ]
+
     def test_get_balances_service(self, app):
         with app.app_context():
             balances = WalletService.get_balances('user1')
@@ -256,6 +445,64 @@ class TestWalletServices:
             assert balances['USD'] == 1000
             assert balances['MXN'] == 5000
 
+    def test_reconcile_advances_checkpoint(self, app):
+        with app.app_context():
+            app.config['RECONCILE_CHECKPOINT_SETTLE_SECONDS'] = 0
+            WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+            WalletService.convert_currency('user1', 'USD', 'MXN', Decimal('40'))
+
+            assert WalletService.reconcile_balances('user1')['reconciled'] is True
+
+            last_id = db.session.query(db.func.max(Transaction.id)).scalar()
+            checkpoints = {c.currency: c for c in ReconciliationCheckpoint.query.filter_by(user_id='user1')}
+            assert checkpoints['USD'].calculated_balance == Decimal('60')
+            assert checkpoints['MXN'].calculated_balance == Decimal('748')
+            assert {c.last_transaction_id for c in checkpoints.values()} == {last_id}
+
+    def test_incremental_reconcile_skips_checkpointed_history(self, app):
+        with app.app_context():
+            app.config['RECONCILE_CHECKPOINT_SETTLE_SECONDS'] = 0
+            WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+            WalletService.reconcile_balances('user1')
+
+            # Tamper with history already covered by the checkpoint.
+            Transaction.query.filter_by(user_id='user1').update({'amount': Decimal('1')})
+            db.session.commit()
+            WalletService.fund_wallet('user1', 'USD', Decimal('5'))
+
+            incremental = WalletService.reconcile_balances('user1')
+            assert incremental['mode'] == 'incremental'
+            assert incremental['reconciled'] is True
+
+            full = WalletService.reconcile_balances('user1', full=True)
+            assert full['mode'] == 'full'
+            assert full['reconciled'] is False
+            assert full['discrepancies']['USD']['calculated'] == 6
+
+    def test_reconcile_reports_wallet_drift(self, app):
+        with app.app_context():
+            WalletService.fund_wallet('user1', 'USD', Decimal('0.1'))
+            WalletService.fund_wallet('user1', 'USD', Decimal('0.2'))
+            WalletService.withdraw_funds('user1', 'USD', Decimal('0.3'))
+            WalletService.fund_wallet('user1', 'MXN', Decimal('10'))
+            assert WalletService.reconcile_balances('user1')['reconciled'] is True
+
+            Wallet.query.filter_by(user_id='user1', currency='MXN').update({'balance': Decimal('12.5')})
+            db.session.commit()
+
+            result = WalletService.reconcile_balances('user1')
+            assert result['reconciled'] is False
+            assert result['discrepancies'] == {
+                'MXN': {'calculated': 10.0, 'actual': 12.5, 'difference': 2.5}
+            }
+
+    def test_unsettled_transactions_do_not_advance_checkpoint(self, app):
+        with app.app_context():
+            WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+
+            assert WalletService.reconcile_balances('user1')['reconciled'] is True
+            assert ReconciliationCheckpoint.query.filter_by(user_id='user1').count() == 0
+
     def test_complex_transaction_flow(self, app):
         with app.app_context():
             WalletService.fund_wallet('user1', 'USD', Decimal('2000'))
@@ -270,3 +517,106 @@ class TestWalletServices:
             balances = WalletService.get_balances('user1')
             assert balances['USD'] == 1000
             assert balances['MXN'] == 17700
+
+class TestBalanceCache:
+
+    @staticmethod
+    def _count_statements(operation):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            result = operation()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        return result, statements
+
+    def test_repeated_reads_hit_the_cache(self, app):
+        with app.app_context():
+            WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+            WalletService.get_balances('user1')
+
+            balances, statements = self._count_statements(lambda: WalletService.get_balances('user1'))
+
+            assert balances == {'USD': 100}
+            assert statements == []
+            snapshot = app.extensions['balance_cache'].snapshot()
+            assert (snapshot['hits'], snapshot['misses'], snapshot['size']) == (1, 1, 1)
+
+    def test_writes_go_through_to_the_cache(self, app):
+        with app.app_context():
+            WalletService.fund_wallet('user1', 'USD', Decimal('1000'))
+            WalletService.get_balances('user1')
+
+            WalletService.fund_wallet('user1', 'USD', Decimal('50'))
+            WalletService.withdraw_funds('user1', 'USD', Decimal('25'))
+            WalletService.convert_currency('user1', 'USD', 'MXN', Decimal('100'))
+            WalletService.apply_batch([
+                {'user_id': 'user1', 'type': 'fund', 'currency': 'MXN', 'amount': Decimal('30')}
+            ])
+
+            balances, statements = self._count_statements(lambda: WalletService.get_balances('user1'))
+
+            assert balances == {'USD': 925, 'MXN': 1900}
+            assert statements == []
+            app.extensions['balance_cache'].backend.delete('user1')
+            assert WalletService.get_balances('user1') == balances
+
+    def test_failed_write_leaves_cache_alone(self, app):
+        with app.app_context():
+            WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+            WalletService.get_balances('user1')
+
+            with pytest.raises(ValueError):
+                WalletService.withdraw_funds('user1', 'USD', Decimal('500'))
+
+            assert WalletService.get_balances('user1') == {'USD': 100}
+
+    def test_external_writes_visible_after_ttl(self, app):
+        with app.app_context():
+            WalletService.fund_wallet('user1', 'USD', Decimal('100'))
+            WalletService.get_balances('user1')
+            Wallet.query.filter_by(user_id='user1').update({'balance': Decimal('70')})
+            db.session.commit()
+
+            assert WalletService.get_balances('user1') == {'USD': 100}
+
+            app.extensions['balance_cache'].ttl = 0
+            app.extensions['balance_cache'].backend.delete('user1')
+            assert WalletService.get_balances('user1') == {'USD': 70}
+
+    def test_stale_read_does_not_overwrite_newer_write(self):
+        backend = MemoryBalanceBackend(max_size=10)
+
+        backend.merge('user1', {'USD': (Decimal('150'), 3)}, complete=False, ttl=60)
+        assert backend.get('user1') is None
+
+        backend.merge('user1', {'USD': (Decimal('100'), 2), 'MXN': (Decimal('5'), 1)}, complete=True, ttl=60)
+        assert backend.get('user1') == {'USD': (Decimal('150'), 3), 'MXN': (Decimal('5'), 1)}
+
+    def test_memory_backend_evicts_least_recently_used(self):
+        backend = MemoryBalanceBackend(max_size=2)
+        for user_id in ('user1', 'user2'):
+            backend.merge(user_id, {'USD': (Decimal('1'), 1)}, complete=True, ttl=60)
+        backend.get('user1')
+
+        backend.merge('user3', {'USD': (Decimal('1'), 1)}, complete=True, ttl=60)
+
+        assert backend.get('user2') is None
+        assert backend.get('user1') is not None
+        assert len(backend) == 2
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError, match='Unknown balance cache backend'):
+            BalanceCache.from_config({'BALANCE_CACHE_BACKEND': 'redis', 'BALANCE_CACHE_TTL': 1})
+
+    def test_metrics_endpoint(self, client, app):
+        with app.app_context():
+            client.get('/wallets/user1/balances')
+
+            response = client.get('/metrics')
+
+            assert response.get_json()['balance_cache']['misses'] == 1
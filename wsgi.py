@@ -0,0 +1,9 @@
+from __future__ import annotations
+from app import create_app
+from app.services import FxService
+
+app = create_app('production')
+
+with app.app_context():
+    # Database tables are managed by migrations: flask db upgrade
+    FxService.initialize_rates()